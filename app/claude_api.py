@@ -1,15 +1,96 @@
 import aiohttp
 import asyncio
+import json
 import logging
+import time
+from typing import AsyncIterator, Optional
+
+from app.utils.cache import ResponseCache, make_key
+from app.utils.hedging import HedgePolicy, hedged_call, hedged_stream
+from app.utils.metrics import CLAUDE_RESPONSES, CLAUDE_RETRIES, CLAUDE_SECONDS
+from app.utils.ratelimit import AdmissionController, AdmissionTimeout, backoff_delay, retry_after_seconds
+from app.utils.singleflight import SingleFlight
+from app.utils.tracing import add_span, span
 
 logger = logging.getLogger(__name__)
 
 
+class StreamInterrupted(Exception):
+    """Поток оборвался после первых фрагментов: ответ неполный"""
+
+
+COPY_VARIANTS = {
+    "fixed": "✅ ИСПРАВЛЕННАЯ ВЕРСИЯ",
+    "short": "📏 КОРОТКАЯ ВЕРСИЯ",
+    "long": "📖 РАЗВЕРНУТАЯ ВЕРСИЯ",
+    "emotional": "❤️ ЭМОЦИОНАЛЬНАЯ ВЕРСИЯ",
+    "twitter": "🐦 ДЛЯ TWITTER",
+    "threads": "🧵 ДЛЯ THREADS",
+    "linkedin": "💼 ДЛЯ LINKEDIN",
+}
+
+
+def parse_copy_variants(response: Optional[str]) -> Optional[dict]:
+    """Разбор JSON-ответа копирайтера; None, если формат не соблюден"""
+    if not response:
+        return None
+    
+    # Модель иногда оборачивает JSON в ```json ... ``` или добавляет текст вокруг
+    start, end = response.find("{"), response.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        data = json.loads(response[start:end + 1])
+    except ValueError:
+        return None
+    
+    variants = {key: str(data[key]).strip() for key in COPY_VARIANTS if data.get(key)}
+    return variants or None
+
+
+class GenerationProfile:
+    """Параметры генерации для одной задачи"""
+    
+    def __init__(
+        self,
+        model: str,
+        max_tokens: int,
+        temperature: float = 0.7,
+        cache_prompt: bool = False,
+        hedge_model: Optional[str] = None,
+    ):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        # Помечать статический системный промпт для prompt caching
+        self.cache_prompt = cache_prompt
+        # Модель страхующего запроса, если основной долго молчит
+        self.hedge_model = hedge_model
+
+
 class ClaudeAPI:
     BASE_URL = "https://api.anthropic.com/v1/messages"
     
-    def __init__(self, api_key: str, model: str, max_tokens: int):
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        max_tokens: int,
+        pool_size: int = 100,
+        pool_per_host: int = 20,
+        keepalive_timeout: float = 30.0,
+        dns_ttl: int = 300,
+        cache: Optional[ResponseCache] = None,
+        cache_ttls: Optional[dict] = None,
+        limiter: Optional[AdmissionController] = None,
+        max_retries: int = 4,
+        profiles: Optional[dict] = None,
+        base_url: Optional[str] = None,
+        hedging: Optional[HedgePolicy] = None,
+        hedge_cache_ttl: float = 600,
+    ):
         self.api_key = api_key
+        self.base_url = base_url or self.BASE_URL
         self.model = model
         self.max_tokens = max_tokens
         self.headers = {
@@ -17,49 +98,457 @@ class ClaudeAPI:
             "anthropic-version": "2023-06-01",
             "content-type": "application/json"
         }
+        
+        # Параметры пула соединений
+        self.pool_size = pool_size
+        self.pool_per_host = pool_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Кэш ответов и TTL для каждой задачи
+        self.cache = cache
+        self.cache_ttls = cache_ttls or {}
+        
+        # Схлопывание одинаковых запросов, идущих одновременно
+        self.flight = SingleFlight("claude")
+        
+        # Контроль конкурентности и бюджетов запросов/токенов
+        self.limiter = limiter or AdmissionController()
+        self.max_retries = max_retries
+        
+        # Профили задач: модель, max_tokens, температура, prompt caching
+        self.default_profile = GenerationProfile(model, max_tokens)
+        self.profiles = {
+            task: GenerationProfile(**{"model": model, "max_tokens": max_tokens, **options})
+            for task, options in (profiles or {}).items()
+        }
+        
+        # Расход токенов по задачам (по полям usage из ответов)
+        self.usage = {}
+        
+        # Страховка хвостовых задержек; None - без страховки
+        self.hedging = hedging
+        self.hedge_cache_ttl = hedge_cache_ttl
+    
+    async def start(self):
+        """Открытие долгоживущей сессии с пулом соединений"""
+        if self._session is not None and not self._session.closed:
+            return
+        
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_ttl,
+            use_dns_cache=True,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=60),
+        )
+        logger.info(
+            f"Claude session opened (pool={self.pool_size}, per_host={self.pool_per_host})"
+        )
+    
+    async def close(self):
+        """Закрытие сессии и всех соединений пула"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Claude session closed")
+        self._session = None
     
-    async def send_message(self, prompt: str, system_prompt: str = None, temperature: float = 0.7):
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Сессия открывается лениво, если lifespan еще не успел это сделать
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    def pool_stats(self) -> dict:
+        """Статистика пула: активные/свободные соединения и ожидающие"""
+        if self._session is None or self._session.closed:
+            return {"open": False, "active": 0, "idle": 0, "waiters": 0, "limit": self.pool_size}
+        
+        connector = self._session.connector
+        # Публичного API для этих счетчиков у aiohttp нет
+        active = len(getattr(connector, "_acquired", ()))
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        waiters = sum(len(queue) for queue in getattr(connector, "_waiters", {}).values())
+        
+        return {
+            "open": True,
+            "active": active,
+            "idle": idle,
+            "waiters": waiters,
+            "limit": connector.limit,
+            "limit_per_host": connector.limit_per_host,
+        }
+    
+    async def send_message(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: Optional[float] = None,
+        task: Optional[str] = None,
+    ):
+        ttl = self._cache_ttl(task)
+        payload = self._build_payload(prompt, system_prompt, temperature, task)
+        key = make_key(payload)
+        
+        if ttl > 0:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+        
+        return await self.flight.do(key, lambda: self._request_hedged(payload, task, key, ttl))
+    
+    async def stream_message(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: Optional[float] = None,
+        task: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """Потоковый ответ: отдает текстовые дельты по мере генерации"""
+        ttl = self._cache_ttl(task)
+        payload = self._build_payload(prompt, system_prompt, temperature, task)
+        key = make_key(payload)
+        
+        if ttl > 0:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        
+        # Одинаковые потоки читают один общий ответ
+        chunks = self.flight.stream(
+            key, lambda: self._stream_hedged(payload, task, key, ttl)
+        )
+        async for chunk in chunks:
+            yield chunk
+    
+    def _hedge_payload(self, payload: dict, task: Optional[str]) -> Optional[dict]:
+        model = self.profile_for(task).hedge_model
+        if self.hedging is None or not model:
+            return None
+        return {**payload, "model": model}
+    
+    def _hedge_ttl(self, ttl: float) -> float:
+        # Ответ hedge_model хуже основного: он не должен жить в кэше весь TTL задачи
+        return min(ttl, self.hedge_cache_ttl)
+    
+    def _limiter_busy(self) -> bool:
+        return self.limiter.queue_depth > 0
+    
+    async def _request_hedged(
+        self,
+        payload: dict,
+        task: Optional[str],
+        cache_key: str,
+        ttl: float,
+    ):
+        backup = self._hedge_payload(payload, task)
+        winner = "primary"
+        
+        def won(name: str):
+            nonlocal winner
+            winner = name
+        
+        if backup is None:
+            text = await self._request(payload, task)
+        else:
+            text = await hedged_call(
+                f"{task or 'default'}:message",
+                lambda: self._request(payload, task),
+                lambda: self._request(backup, task),
+                self.hedging,
+                saturated=self._limiter_busy,
+                on_winner=won,
+            )
+        
+        if winner == "backup":
+            ttl = self._hedge_ttl(ttl)
+        if text and ttl > 0:
+            await self.cache.set(cache_key, text, ttl)
+        
+        return text
+    
+    def _stream_hedged(
+        self,
+        payload: dict,
+        task: Optional[str],
+        cache_key: str,
+        ttl: float,
+    ) -> AsyncIterator[str]:
+        backup = self._hedge_payload(payload, task)
+        if backup is None:
+            return self._stream_request(payload, task, cache_key, ttl)
+        # Победитель кэширует ответ под ключом основного запроса; ответ
+        # страхующей модели - с коротким TTL
+        return hedged_stream(
+            f"{task or 'default'}:stream",
+            lambda: self._stream_request(payload, task, cache_key, ttl),
+            lambda: self._stream_request(backup, task, cache_key, self._hedge_ttl(ttl)),
+            self.hedging,
+            saturated=self._limiter_busy,
+        )
+    
+    async def _stream_request(
+        self,
+        payload: dict,
+        task: Optional[str],
+        cache_key: str,
+        ttl: float,
+    ) -> AsyncIterator[str]:
+        payload = {**payload, "stream": True}
+        
+        session = await self._get_session()
+        estimate = self._estimate_tokens(payload)
+        parts = []
+        label = task or "default"
+        started = time.monotonic()
+        first_token = None
+        # Ответ полный только после message_stop; обрыв не кэшируется
+        completed = False
+        
+        for attempt in range(self.max_retries):
+            retry_after = None
+            if attempt:
+                CLAUDE_RETRIES.inc(task=label)
+            try:
+                async with self.limiter.slot(estimate) as admission:
+                    async with session.post(
+                        self.base_url,
+                        json=payload,
+                        timeout=aiohttp.ClientTimeout(total=None, sock_read=60),
+                    ) as response:
+                        CLAUDE_RESPONSES.inc(task=label, status=response.status)
+                        if response.status != 200:
+                            retry_after = self._handle_error_status(response)
+                            if retry_after is False:
+                                return
+                        else:
+                            async for event, data in self._iter_sse(response):
+                                if event == "content_block_delta":
+                                    delta = data.get("delta", {})
+                                    if delta.get("type") == "text_delta":
+                                        if first_token is None:
+                                            first_token = time.monotonic() - started
+                                        parts.append(delta["text"])
+                                        yield delta["text"]
+                                elif event == "message_start":
+                                    usage = data.get("message", {}).get("usage")
+                                    admission.actual_tokens = self._input_tokens(usage)
+                                    self._record_usage(task, usage)
+                                elif event == "message_delta":
+                                    # Здесь приходит только output_tokens
+                                    self._record_usage(task, data.get("usage"), count_request=False)
+                                elif event == "error":
+                                    logger.error(f"Claude API stream error event: {data}")
+                                    break
+                                elif event == "message_stop":
+                                    completed = True
+                                    break
+                            if completed or parts:
+                                break
+                            # Ни одного фрагмента - запрос можно повторить
+                            CLAUDE_RESPONSES.inc(task=label, status="incomplete")
+            except AdmissionTimeout as e:
+                CLAUDE_RESPONSES.inc(task=label, status="shed")
+                logger.warning(f"Claude request shed: {e}")
+                break
+            except Exception as e:
+                CLAUDE_RESPONSES.inc(task=label, status="error")
+                logger.error(f"Stream error: {e}")
+                # Повторять можно только пока пользователь ничего не увидел
+                if parts:
+                    break
+            
+            if attempt < self.max_retries - 1 and retry_after is None:
+                await asyncio.sleep(backoff_delay(attempt))
+        
+        elapsed = time.monotonic() - started
+        CLAUDE_SECONDS.observe(elapsed, task=label, mode="stream")
+        add_span("claude.stream", started, elapsed, task=label, first_token=f"{first_token or 0:.3f}s")
+        text = "".join(parts)
+        if completed and text and ttl > 0:
+            await self.cache.set(cache_key, text, ttl)
+        elif parts and not completed:
+            CLAUDE_RESPONSES.inc(task=label, status="interrupted")
+            raise StreamInterrupted(f"Claude stream for {label} ended after {len(text)} chars")
+    
+    @staticmethod
+    async def _iter_sse(response: aiohttp.ClientResponse):
+        """Разбор потока server-sent events на пары (event, data)"""
+        event = None
+        data_lines = []
+        
+        async for raw in response.content:
+            line = raw.decode("utf-8").rstrip("\r\n")
+            
+            if not line:
+                if data_lines:
+                    try:
+                        yield event, json.loads("\n".join(data_lines))
+                    except ValueError:
+                        logger.warning("Malformed SSE payload skipped")
+                event = None
+                data_lines = []
+                continue
+            
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data_lines.append(line[5:].lstrip())
+    
+    def _cache_ttl(self, task: Optional[str]) -> float:
+        if self.cache is None or not task:
+            return 0
+        return self.cache_ttls.get(task, 0)
+    
+    def profile_for(self, task: Optional[str]) -> GenerationProfile:
+        return self.profiles.get(task, self.default_profile)
+    
+    def _build_payload(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: Optional[float] = None,
+        task: Optional[str] = None,
+    ) -> dict:
+        profile = self.profile_for(task)
         payload = {
-            "model": self.model,
-            "max_tokens": self.max_tokens,
-            "temperature": temperature,
+            "model": profile.model,
+            "max_tokens": profile.max_tokens,
+            "temperature": profile.temperature if temperature is None else temperature,
             "messages": [{"role": "user", "content": prompt}]
         }
         
         if system_prompt:
-            payload["system"] = system_prompt
+            if profile.cache_prompt:
+                # Статический префикс кэшируется на стороне Anthropic
+                payload["system"] = [
+                    {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+                ]
+            else:
+                payload["system"] = system_prompt
         
-        for attempt in range(3):
+        return payload
+    
+    def _record_usage(self, task: Optional[str], usage: Optional[dict], count_request: bool = True):
+        if not usage:
+            return
+        stats = self.usage.setdefault(task or "default", {
+            "requests": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        })
+        if count_request:
+            stats["requests"] += 1
+        for field in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+            stats[field] += usage.get(field) or 0
+    
+    def _call(
+        self,
+        prompt: str,
+        system_prompt: str,
+        temperature: Optional[float] = None,
+        task: Optional[str] = None,
+        stream: bool = False,
+    ):
+        # stream=True -> асинхронный итератор дельт, иначе корутина с полным ответом
+        if stream:
+            return self.stream_message(prompt, system_prompt, temperature, task=task)
+        return self.send_message(prompt, system_prompt, temperature, task=task)
+    
+    async def _request(self, payload: dict, task: Optional[str] = None):
+        label = task or "default"
+        started = time.perf_counter()
+        try:
+            with span("claude.request", task=label):
+                return await self._request_with_retries(payload, label)
+        finally:
+            CLAUDE_SECONDS.observe(time.perf_counter() - started, task=label, mode="message")
+    
+    async def _request_with_retries(self, payload: dict, task: str):
+        session = await self._get_session()
+        estimate = self._estimate_tokens(payload)
+        
+        for attempt in range(self.max_retries):
+            retry_after = None
+            if attempt:
+                CLAUDE_RETRIES.inc(task=task)
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        self.BASE_URL, 
-                        headers=self.headers, 
-                        json=payload, 
-                        timeout=aiohttp.ClientTimeout(total=60)
-                    ) as response:
+                async with self.limiter.slot(estimate) as admission:
+                    async with session.post(self.base_url, json=payload) as response:
+                        CLAUDE_RESPONSES.inc(task=task, status=response.status)
                         if response.status == 200:
                             data = await response.json()
+                            admission.actual_tokens = self._input_tokens(data.get("usage"))
+                            self._record_usage(task, data.get("usage"))
                             return data["content"][0]["text"]
-                        elif response.status == 429:
-                            await asyncio.sleep(2 ** attempt)
-                            continue
-                        else:
-                            logger.error(f"Claude API error: {response.status}")
+                        
+                        retry_after = self._handle_error_status(response)
+                        if retry_after is False:
                             return None
+            except AdmissionTimeout as e:
+                CLAUDE_RESPONSES.inc(task=task, status="shed")
+                logger.warning(f"Claude request shed: {e}")
+                return None
             except Exception as e:
+                CLAUDE_RESPONSES.inc(task=task, status="error")
                 logger.error(f"Error: {e}")
-                if attempt < 2:
-                    await asyncio.sleep(2)
-                    continue
-                return None
+            
+            # После retry-after ждет сам контроллер, иначе - бэкофф с джиттером
+            if attempt < self.max_retries - 1 and retry_after is None:
+                await asyncio.sleep(backoff_delay(attempt))
         return None
     
-    async def analyze_trends(self, raw_data: str):
-        system = "Ты эксперт по SMM и 3D-графике. Анализируй тренды для 3D-художников."
-        prompt = f"""Проанализируй тренды:
+    def _handle_error_status(self, response: aiohttp.ClientResponse):
+        """
+        Разбор ошибочного ответа
+        
+        Returns:
+            False - повторять бессмысленно, секунды паузы или None для бэкоффа
+        """
+        if response.status in (429, 529):
+            retry_after = retry_after_seconds(response.headers)
+            if retry_after is not None:
+                self.limiter.pause(backoff_delay(0, retry_after))
+            logger.warning(f"Claude API throttled: {response.status}, retry after {retry_after}")
+            return retry_after
+        
+        logger.error(f"Claude API error: {response.status}")
+        if response.status >= 500:
+            return None
+        return False
+    
+    @staticmethod
+    def _estimate_tokens(payload: dict) -> int:
+        # Грубая оценка входных токенов: ~3 символа на токен для смешанного ru/en
+        system = payload.get("system") or ""
+        if isinstance(system, list):
+            system = "".join(block["text"] for block in system)
+        chars = len(system) + sum(len(m["content"]) for m in payload["messages"])
+        return chars // 3 + 1
+    
+    @staticmethod
+    def _input_tokens(usage: Optional[dict]) -> Optional[int]:
+        if not usage:
+            return None
+        # Чтение из кэша промптов не расходует лимит входных токенов
+        return (usage.get("input_tokens") or 0) + (usage.get("cache_creation_input_tokens") or 0)
+    
+    # Статические части промптов вынесены в system: этот префикс
+    # одинаков для всех запросов задачи и попадает в prompt cache
+    
+    TRENDS_SYSTEM = """Ты эксперт по SMM и 3D-графике. Анализируй тренды для 3D-художников.
 
-{raw_data}
+На входе ранжированный дайджест: истории уже отсортированы по скорости роста и числу источников, дубликаты склеены.
 
 Верни в формате:
 
@@ -83,50 +572,30 @@ class ClaudeAPI:
 
 💼 LinkedIn:
 [пост]"""
-        
-        return await self.send_message(prompt, system)
     
-    async def rewrite_copy(self, text: str):
-        system = "Ты профессиональный копирайтер."
-        prompt = f"""Перепиши этот текст:
-
-{text}
-
-Верни в формате:
-
-✅ ИСПРАВЛЕННАЯ ВЕРСИЯ:
-[текст]
-
-📏 КОРОТКАЯ ВЕРСИЯ (до 280 символов):
-[текст]
-
-📖 РАЗВЕРНУТАЯ ВЕРСИЯ:
-[текст]
-
-❤️ ЭМОЦИОНАЛЬНАЯ ВЕРСИЯ:
-[текст]
-
-🐦 ДЛЯ TWITTER:
-[текст]
-
-🧵 ДЛЯ THREADS:
-[текст]
+    COPY_SYSTEM = """Ты профессиональный копирайтер.
+
+Перепиши текст пользователя в семи вариантах. Верни ТОЛЬКО JSON-объект без пояснений и markdown, со строковыми полями:
+"fixed" - исправленная версия,
+"short" - короткая версия (до 280 символов),
+"long" - развернутая версия,
+"emotional" - эмоциональная версия,
+"twitter" - версия для Twitter,
+"threads" - версия для Threads,
+"linkedin" - версия для LinkedIn."""
+    
+    COPY_VARIANT_SYSTEM = """Ты профессиональный копирайтер.
 
-💼 ДЛЯ LINKEDIN:
-[текст]"""
-        
-        return await self.send_message(prompt, system)
+Напиши заново ОДИН вариант текста, заметно отличающийся от текущего, в том же стиле, что и остальные варианты. Верни только текст варианта без заголовков и пояснений."""
     
-    async def analyze_competitor(self, data: str):
-        system = "Ты аналитик SMM для 3D-художников."
-        prompt = f"""Проанализируй конкурента:
+    COMPETITOR_SYSTEM = """Ты аналитик SMM для 3D-художников.
 
-{data}
+Статистика профиля уже посчитана (частота, реакции по часам и дням, форматы, хэштеги, топ постов). Не пересчитывай цифры - интерпретируй их.
 
 Верни:
 
 📊 СТАТИСТИКА:
-[частота постов, форматы]
+[частота постов, форматы - кратко по сводке]
 
 🔥 САМЫЕ УСПЕШНЫЕ ПОСТЫ:
 [топ-3 с описанием]
@@ -139,12 +608,25 @@ class ClaudeAPI:
 
 🎯 НИШЕВЫЕ ТРЕНДЫ:
 [темы]"""
-        
-        return await self.send_message(prompt, system)
     
-    async def generate_daily_content(self):
-        system = "Ты ментор для 3D-художников."
-        prompt = """Создай ежедневную мотивационную рассылку:
+    COMPETITOR_CHANGES_SYSTEM = """Ты аналитик SMM для 3D-художников.
+
+Тебе дан прошлый анализ профиля и только новые посты с тех пор. Не повторяй прошлый анализ - опиши, что изменилось.
+
+Верни:
+
+🆕 ЧТО НОВОГО:
+[новые посты, форматы, темы]
+
+📈 ДИНАМИКА:
+[реакции лучше или хуже, что выстрелило]
+
+💡 ЧТО ВЗЯТЬ НА ЗАМЕТКУ:
+[1-3 конкретных совета]"""
+    
+    DAILY_SYSTEM = """Ты ментор для 3D-художников.
+
+Создай ежедневную мотивационную рассылку в формате:
 
 💡 ИДЕЯ ДНЯ:
 [креативная идея для 3D-проекта]
@@ -159,13 +641,98 @@ class ClaudeAPI:
 [актуальная тема в 3D/дизайне]
 
 Будь вдохновляющим!"""
+    
+    def analyze_trends(self, raw_data: str, stream: bool = False):
+        prompt = f"""Проанализируй тренды:
+
+{raw_data}"""
+        
+        return self._call(prompt, self.TRENDS_SYSTEM, task="analyze_trends", stream=stream)
+    
+    async def rewrite_copy(self, text: str) -> Optional[dict]:
+        """Все варианты текста в виде {ключ варианта: текст}"""
+        prompt = f"""Перепиши этот текст:
+
+{text}"""
         
-        return await self.send_message(prompt, system, temperature=0.8)
+        response = await self.send_message(prompt, self.COPY_SYSTEM, task="rewrite_copy")
+        return parse_copy_variants(response)
+    
+    async def rewrite_copy_variant(self, text: str, variant: str, variants: dict) -> Optional[str]:
+        """Перегенерация одного варианта с опорой на оригинал и остальные варианты"""
+        others = "\n\n".join(
+            f"{COPY_VARIANTS[key]}:\n{value}" for key, value in variants.items() if key != variant
+        )
+        prompt = f"""Оригинальный текст:
 
+{text}
 
-from app.config import settings
-claude_api = ClaudeAPI(settings.CLAUDE_API_KEY, settings.CLAUDE_MODEL, settings.CLAUDE_MAX_TOKENS)
+Остальные варианты:
 
+{others}
+
+Текущий вариант «{COPY_VARIANTS[variant]}»:
+
+{variants.get(variant, "")}
+
+Напиши новый вариант «{COPY_VARIANTS[variant]}»."""
+        
+        response = await self.send_message(prompt, self.COPY_VARIANT_SYSTEM, task="rewrite_copy_variant")
+        return response.strip() if response else None
+    
+    def analyze_competitor(self, data: str, stream: bool = False):
+        prompt = f"""Проанализируй конкурента:
+
+{data}"""
+        
+        return self._call(prompt, self.COMPETITOR_SYSTEM, task="analyze_competitor", stream=stream)
+    
+    def analyze_competitor_changes(self, data: str, stream: bool = False):
+        prompt = f"""Что изменилось у конкурента:
+
+{data}"""
+        
+        return self._call(
+            prompt, self.COMPETITOR_CHANGES_SYSTEM, task="analyze_competitor_changes", stream=stream
+        )
+    
+    def generate_daily_content(self, stream: bool = False):
+        prompt = "Создай рассылку на сегодня."
+        
+        return self._call(prompt, self.DAILY_SYSTEM, task="generate_daily_content", stream=stream)
+
+
+from app.config import settings
+from app.utils.cache import response_cache
 
 # Singleton экземпляр
-claude_api = ClaudeAPI()
+claude_api = ClaudeAPI(
+    settings.CLAUDE_API_KEY,
+    settings.CLAUDE_MODEL,
+    settings.CLAUDE_MAX_TOKENS,
+    pool_size=settings.CLAUDE_POOL_SIZE,
+    pool_per_host=settings.CLAUDE_POOL_PER_HOST,
+    keepalive_timeout=settings.CLAUDE_KEEPALIVE_TIMEOUT,
+    dns_ttl=settings.CLAUDE_DNS_TTL,
+    cache=response_cache,
+    cache_ttls=settings.CACHE_TTL,
+    # Лимиты аккаунта делятся между воркерами uvicorn: у каждого своя доля
+    limiter=AdmissionController(
+        max_concurrency=max(1, settings.CLAUDE_MAX_CONCURRENCY // settings.WORKERS),
+        requests_per_minute=settings.CLAUDE_RPM / settings.WORKERS,
+        tokens_per_minute=settings.CLAUDE_INPUT_TPM / settings.WORKERS,
+        queue_timeout=settings.CLAUDE_QUEUE_TIMEOUT,
+        reserved_interactive=settings.CLAUDE_RESERVED_INTERACTIVE,
+        max_waiting=max(1, settings.CLAUDE_MAX_WAITING // settings.WORKERS),
+    ),
+    max_retries=settings.CLAUDE_MAX_RETRIES,
+    profiles=settings.CLAUDE_PROFILES,
+    base_url=settings.CLAUDE_API_URL,
+    hedging=HedgePolicy(
+        percentile=settings.CLAUDE_HEDGE_PERCENTILE,
+        max_rate=settings.CLAUDE_HEDGE_MAX_RATE,
+        min_samples=settings.CLAUDE_HEDGE_MIN_SAMPLES,
+        min_delay=settings.CLAUDE_HEDGE_MIN_DELAY,
+    ) if settings.CLAUDE_HEDGING else None,
+    hedge_cache_ttl=settings.CLAUDE_HEDGE_CACHE_TTL,
+)
@@ -11,16 +11,176 @@ class Settings:
         self.WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
         self.WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
         self.PORT = int(os.getenv("PORT", 10000))
+        self.WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 16))
+        self.WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+        # Свой адрес Bot API (локальный сервер или заглушка в бенчмарках)
+        self.TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+        # Несколько ботов в одном процессе: JSON-список арендаторов (пусто - один бот
+        # из TELEGRAM_BOT_TOKEN) и доли общих ресурсов по умолчанию
+        self.TENANTS_FILE = os.getenv("TENANTS_FILE")
+        self.TENANT_MAX_QUEUED = int(os.getenv("TENANT_MAX_QUEUED", self.WEBHOOK_QUEUE_SIZE // 2))
+        self.TENANT_CLAUDE_JOBS_PER_HOUR = int(os.getenv("TENANT_CLAUDE_JOBS_PER_HOUR", 0))
+        
+        # Несколько воркеров: общее FSM-хранилище и выбор лидера.
+        # WEB_CONCURRENCY - число воркеров uvicorn (его же читает сам uvicorn).
+        # Лимиты Claude (CLAUDE_MAX_CONCURRENCY, CLAUDE_RPM, CLAUDE_INPUT_TPM,
+        # CLAUDE_MAX_WAITING) заданы на весь аккаунт и делятся между воркерами
+        # поровну; пауза по 429 - своя у каждого воркера. Повторы апдейтов,
+        # порядок апдейтов чата и задачи Claude пользователя при WORKERS > 1
+        # сверяются через общую базу COORDINATION_DB_PATH - только в пределах
+        # одного хоста
+        self.WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+        self.COORDINATION_DB_PATH = os.getenv("COORDINATION_DB_PATH", "workers.db")
+        self.CHAT_LEASE_TTL = float(os.getenv("CHAT_LEASE_TTL", 60))
+        self.FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+        self.FSM_DB_PATH = os.getenv("FSM_DB_PATH", "fsm.db")
+        self.FSM_TTL = int(os.getenv("FSM_TTL", 3600))
+        self.REDIS_URL = os.getenv("REDIS_URL")
+        self.LEADER_LOCK_PATH = os.getenv("LEADER_LOCK_PATH", "scheduler.lock")
         
         # Claude API
         self.CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
-        self.CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+        self.CLAUDE_API_URL = os.getenv("CLAUDE_API_URL", "https://api.anthropic.com/v1/messages")
+        self.CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20241022")
+        # Быстрая модель: короткие задачи и страхующие запросы (hedging)
+        self.CLAUDE_MODEL_FAST = os.getenv("CLAUDE_MODEL_FAST", "claude-3-5-haiku-20241022")
         self.CLAUDE_MAX_TOKENS = 4000
+        hedge_model = os.getenv("CLAUDE_HEDGE_MODEL", self.CLAUDE_MODEL_FAST)
+        
+        # Профили задач: max_tokens подобран под лимит сообщения Telegram
+        # (~3900 символов, около 1500 токенов русского текста)
+        self.CLAUDE_PROFILES = {
+            "analyze_trends": {
+                "model": os.getenv("CLAUDE_MODEL_TRENDS", self.CLAUDE_MODEL),
+                "max_tokens": int(os.getenv("CLAUDE_MAX_TOKENS_TRENDS", 1500)),
+                "temperature": 0.7,
+                "cache_prompt": True,
+                "hedge_model": hedge_model,
+            },
+            "rewrite_copy": {
+                "model": os.getenv("CLAUDE_MODEL_COPY", self.CLAUDE_MODEL),
+                "max_tokens": int(os.getenv("CLAUDE_MAX_TOKENS_COPY", 1800)),
+                "temperature": 0.7,
+                "cache_prompt": True,
+                "hedge_model": hedge_model,
+            },
+            "rewrite_copy_variant": {
+                "model": os.getenv("CLAUDE_MODEL_COPY_VARIANT", self.CLAUDE_MODEL_FAST),
+                "max_tokens": int(os.getenv("CLAUDE_MAX_TOKENS_COPY_VARIANT", 600)),
+                "temperature": 0.9,
+                "cache_prompt": True,
+                "hedge_model": hedge_model,
+            },
+            "analyze_competitor": {
+                "model": os.getenv("CLAUDE_MODEL_COMPETITOR", self.CLAUDE_MODEL),
+                "max_tokens": int(os.getenv("CLAUDE_MAX_TOKENS_COMPETITOR", 1500)),
+                "temperature": 0.5,
+                "cache_prompt": True,
+                "hedge_model": hedge_model,
+            },
+            "analyze_competitor_changes": {
+                "model": os.getenv("CLAUDE_MODEL_COMPETITOR", self.CLAUDE_MODEL),
+                "max_tokens": int(os.getenv("CLAUDE_MAX_TOKENS_COMPETITOR_CHANGES", 800)),
+                "temperature": 0.5,
+                "cache_prompt": True,
+                "hedge_model": hedge_model,
+            },
+            "generate_daily_content": {
+                "model": os.getenv("CLAUDE_MODEL_DAILY", self.CLAUDE_MODEL_FAST),
+                "max_tokens": int(os.getenv("CLAUDE_MAX_TOKENS_DAILY", 800)),
+                "temperature": 0.8,
+                "cache_prompt": False,
+            },
+        }
+        
+        # Пул HTTP-соединений к Claude API
+        self.CLAUDE_POOL_SIZE = int(os.getenv("CLAUDE_POOL_SIZE", 100))
+        self.CLAUDE_POOL_PER_HOST = int(os.getenv("CLAUDE_POOL_PER_HOST", 20))
+        self.CLAUDE_KEEPALIVE_TIMEOUT = float(os.getenv("CLAUDE_KEEPALIVE_TIMEOUT", 30))
+        self.CLAUDE_DNS_TTL = int(os.getenv("CLAUDE_DNS_TTL", 300))
+        
+        # Ограничение нагрузки на Claude API
+        self.CLAUDE_MAX_CONCURRENCY = int(os.getenv("CLAUDE_MAX_CONCURRENCY", 8))
+        self.CLAUDE_RPM = float(os.getenv("CLAUDE_RPM", 50))
+        self.CLAUDE_INPUT_TPM = float(os.getenv("CLAUDE_INPUT_TPM", 40000))
+        self.CLAUDE_QUEUE_TIMEOUT = float(os.getenv("CLAUDE_QUEUE_TIMEOUT", 30))
+        # Приоритеты: слоты только для пользователей, предел очереди, задачи на пользователя
+        self.CLAUDE_RESERVED_INTERACTIVE = int(os.getenv("CLAUDE_RESERVED_INTERACTIVE", 2))
+        self.CLAUDE_MAX_WAITING = int(os.getenv("CLAUDE_MAX_WAITING", 50))
+        self.CLAUDE_JOBS_PER_USER = int(os.getenv("CLAUDE_JOBS_PER_USER", 2))
+        self.CLAUDE_MAX_RETRIES = int(os.getenv("CLAUDE_MAX_RETRIES", 4))
+        
+        # Страховка медленных запросов: после перцентиля времени до первого
+        # токена параллельно идет запрос к hedge_model профиля
+        self.CLAUDE_HEDGING = os.getenv("CLAUDE_HEDGING", "1") == "1"
+        self.CLAUDE_HEDGE_PERCENTILE = float(os.getenv("CLAUDE_HEDGE_PERCENTILE", 95))
+        self.CLAUDE_HEDGE_MAX_RATE = float(os.getenv("CLAUDE_HEDGE_MAX_RATE", 0.1))
+        self.CLAUDE_HEDGE_MIN_SAMPLES = int(os.getenv("CLAUDE_HEDGE_MIN_SAMPLES", 20))
+        self.CLAUDE_HEDGE_MIN_DELAY = float(os.getenv("CLAUDE_HEDGE_MIN_DELAY", 1.0))
+        # Ответ страхующей (более простой) модели живет в кэше не дольше этого
+        self.CLAUDE_HEDGE_CACHE_TTL = float(os.getenv("CLAUDE_HEDGE_CACHE_TTL", 600))
+        
+        # Кэш ответов Claude
+        self.CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.db")
+        self.CACHE_MAX_ITEMS = int(os.getenv("CACHE_MAX_ITEMS", 1000))
+        # Чистка просроченных строк на диске и предел их числа (0 - без предела)
+        self.CACHE_PURGE_INTERVAL = float(os.getenv("CACHE_PURGE_INTERVAL", 3600))
+        self.CACHE_MAX_ROWS = int(os.getenv("CACHE_MAX_ROWS", 50000))
+        self.COPY_SESSION_TTL = int(os.getenv("COPY_SESSION_TTL", 86400))
+        # Страницы длинных ответов для кнопок "Дальше"
+        self.REPLY_PAGES_TTL = int(os.getenv("REPLY_PAGES_TTL", 86400))
+        self.CACHE_TTL = {
+            "analyze_trends": int(os.getenv("CACHE_TTL_TRENDS", 1800)),
+            "rewrite_copy": int(os.getenv("CACHE_TTL_COPY", 86400)),
+            "analyze_competitor": int(os.getenv("CACHE_TTL_COMPETITOR", 21600)),
+            "generate_daily_content": int(os.getenv("CACHE_TTL_DAILY", 3600)),
+        }
+        
+        # Источники трендов: "name|url|title;..." (пусто - набор по умолчанию)
+        self.TREND_SOURCES = os.getenv("TREND_SOURCES", "")
+        self.TREND_SOURCE_LIMIT = int(os.getenv("TREND_SOURCE_LIMIT", 5))
+        self.TREND_SOURCE_TIMEOUT = float(os.getenv("TREND_SOURCE_TIMEOUT", 10))
+        self.TREND_PARSE_PROCESSES = int(os.getenv("TREND_PARSE_PROCESSES", 0))
+        
+        # Ранжирование трендов: история сборов, склейка дубликатов, бюджет дайджеста
+        self.TRENDS_DB_PATH = os.getenv("TRENDS_DB_PATH", "trends.db")
+        self.TREND_HISTORY_RETENTION = int(os.getenv("TREND_HISTORY_RETENTION", 259200))
+        self.TREND_DIGEST_TOKENS = int(os.getenv("TREND_DIGEST_TOKENS", 700))
+        self.TREND_DIGEST_MAX_ITEMS = int(os.getenv("TREND_DIGEST_MAX_ITEMS", 15))
+        self.TREND_DUPLICATE_THRESHOLD = float(os.getenv("TREND_DUPLICATE_THRESHOLD", 0.5))
+        
+        # Конкуренты: провайдер постов (reddit, feed, fixture) и снимки профилей
+        self.COMPETITOR_PROVIDER = os.getenv("COMPETITOR_PROVIDER", "reddit")
+        self.COMPETITOR_REDDIT_URL = os.getenv("COMPETITOR_REDDIT_URL", "https://www.reddit.com")
+        self.COMPETITOR_FEED_URL = os.getenv("COMPETITOR_FEED_URL")
+        self.COMPETITOR_FIXTURES_DIR = os.getenv("COMPETITOR_FIXTURES_DIR", "fixtures/competitors")
+        self.COMPETITOR_FETCH_TIMEOUT = float(os.getenv("COMPETITOR_FETCH_TIMEOUT", 15))
+        self.COMPETITOR_DB_PATH = os.getenv("COMPETITOR_DB_PATH", "competitors.db")
+        self.COMPETITOR_MAX_POSTS = int(os.getenv("COMPETITOR_MAX_POSTS", 1000))
+        
+        # Снимок трендов (секунды)
+        self.TRENDS_SNAPSHOT_MAX_AGE = int(os.getenv("TRENDS_SNAPSHOT_MAX_AGE", 3600))
+        self.TRENDS_REFRESH_INTERVAL = int(os.getenv("TRENDS_REFRESH_INTERVAL", 1800))
+        self.TRENDS_REFRESH_MIN = int(os.getenv("TRENDS_REFRESH_MIN", 600))
+        self.TRENDS_REFRESH_MAX = int(os.getenv("TRENDS_REFRESH_MAX", 7200))
+        self.TRENDS_WARMUP_DELAY = float(os.getenv("TRENDS_WARMUP_DELAY", 30))
+        
+        # Диагностика: медленные апдейты и профилировщик (только с ADMIN_TOKEN)
+        self.SLOW_UPDATE_THRESHOLD = float(os.getenv("SLOW_UPDATE_THRESHOLD", 5))
+        self.ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+        self.PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))
         
         # Notifications
         self.TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
         self.NOTIFICATION_TIME = os.getenv("NOTIFICATION_TIME", "09:00")
         self.NOTIFICATION_USERS = os.getenv("NOTIFICATION_USERS")
+        # Шарды рассылки: ширина слота, заготовка выпуска заранее, пересборка шардов
+        self.NOTIFICATION_SLOT_MINUTES = int(os.getenv("NOTIFICATION_SLOT_MINUTES", 15))
+        self.NOTIFICATION_LEAD_TIME = float(os.getenv("NOTIFICATION_LEAD_TIME", 600))
+        self.NOTIFICATION_SYNC_INTERVAL = float(os.getenv("NOTIFICATION_SYNC_INTERVAL", 600))
+        self.SUBSCRIBERS_DB_PATH = os.getenv("SUBSCRIBERS_DB_PATH", "subscribers.db")
+        self.BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+        self.BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))
 
 
 settings = Settings()
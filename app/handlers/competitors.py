@@ -1,9 +1,14 @@
+import time
+
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from app.claude_api import claude_api
-from app.utils.scraping import competitor_scraper
+from app.utils.competitors import CACHED, CHANGES, EMPTY, ERROR, competitor_service, is_valid_username
+from app.utils.formatter import COMPETITOR_HEADER, format_competitor_response
+from app.utils.snapshots import format_age
+from app.utils.streaming import reply_pipeline
 
 router = Router()
 
@@ -21,44 +26,67 @@ async def start_competitor_analysis(message: Message, state: FSMContext):
         "Примеры:\n"
         "• @username\n"
         "• username\n"
-        "• https://twitter.com/username\n\n"
+        "• https://www.reddit.com/user/username\n\n"
         "📝 Жду никнейм...",
         parse_mode="HTML"
     )
 
 
-@router.message(CompetitorStates.waiting_for_username)
+@router.message(CompetitorStates.waiting_for_username, flags={"claude": "competitor"})
 async def process_competitor(message: Message, state: FSMContext):
     username = message.text.strip().replace("@", "").replace("https://", "").replace("http://", "")
     username = username.split("/")[-1]
     
-    if len(username) < 2:
+    if not is_valid_username(username):
         await message.answer("❌ Некорректный никнейм. Попробуйте еще раз.")
         return
     
-    msg = await message.answer(f"🔎 <b>Анализирую @{username}...</b>\n⏳ Собираю данные...", parse_mode="HTML")
-    
     try:
-        # Собираем данные
-        data = await competitor_scraper.analyze_username(username)
-        
-        await msg.edit_text(f"🔎 <b>Анализирую @{username}...</b>\n✅ Данные собраны\n⏳ Анализирую...", parse_mode="HTML")
-        
-        # Анализируем через Claude
-        response = await claude_api.analyze_competitor(data)
+        # Индикатор набора вместо заглушки - до первого текста ответа
+        async with reply_pipeline.typing(message) as action:
+            # Догружаем только новые посты с прошлой проверки
+            check = await competitor_service.check(username)
+            
+            if check.kind == ERROR:
+                await state.clear()
+                await message.answer(
+                    f"⚠️ Не удалось получить посты @{username}: источник сейчас недоступен. "
+                    "Попробуйте позже."
+                )
+                return
+            
+            if check.kind == EMPTY:
+                await state.clear()
+                await message.answer(f"❌ Не нашел публичных постов у @{username}. Проверьте никнейм.")
+                return
+            
+            if check.kind == CACHED:
+                # Новых постов нет - отдаем сохраненный анализ без Claude
+                await state.clear()
+                profile = check.profile
+                text = format_competitor_response(profile.analysis)
+                if profile.changes:
+                    text += f"\n\n🆕 <b>ПОСЛЕДНИЕ ИЗМЕНЕНИЯ</b>\n\n{profile.changes}"
+                text += f"\n\n🕐 <i>Новых постов нет, анализ от {format_age(time.time() - profile.analyzed_at)}</i>"
+                await reply_pipeline.send(message, text)
+                return
+            
+            # Анализируем через Claude: весь профиль или только изменения
+            if check.kind == CHANGES:
+                header = f"🆕 <b>ЧТО ИЗМЕНИЛОСЬ</b> (новых постов: {len(check.new_posts)})\n\n"
+                stream = claude_api.analyze_competitor_changes(check.data, stream=True)
+            else:
+                header = COMPETITOR_HEADER
+                stream = claude_api.analyze_competitor(check.data, stream=True)
+            response = await reply_pipeline.stream(
+                message, stream, header, error=format_competitor_response(None), action=action
+            )
         
-        await msg.delete()
         await state.clear()
         
         if response:
-            if len(response) > 4000:
-                response = response[:3900] + "\n\n... (обрезано)"
-            
-            await message.answer(f"🔎 <b>АНАЛИЗ КОНКУРЕНТА</b>\n\n{response}", parse_mode="HTML")
-        else:
-            await message.answer("❌ Ошибка при анализе. Попробуйте позже.")
+            await competitor_service.save(check, response)
     
     except Exception as e:
-        await msg.delete()
         await state.clear()
         await message.answer("❌ Произошла ошибка. Попробуйте снова.")
@@ -1,16 +1,72 @@
+import html
+import json
+import secrets
+from typing import Optional
+
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from app.claude_api import claude_api
+from app.claude_api import claude_api, COPY_VARIANTS
+from app.config import settings
+from app.utils.cache import response_cache
+from app.utils.formatter import format_copy_response
+from app.utils.streaming import reply_pipeline
 
 router = Router()
 
+# Подписи кнопок перегенерации отдельных вариантов
+REGEN_LABELS = {
+    "fixed": "🔁 Исправленная",
+    "short": "🔁 Короткая",
+    "long": "🔁 Развернутая",
+    "emotional": "🔁 Эмоциональная",
+    "twitter": "🔁 Twitter",
+    "threads": "🔁 Threads",
+    "linkedin": "🔁 LinkedIn",
+}
+
 
 class CopyStates(StatesGroup):
     waiting_for_text = State()
 
 
+class CopyRegen(CallbackData, prefix="copy"):
+    copy_id: str
+    variant: str
+
+
+async def save_session(copy_id: str, text: str, variants: dict):
+    # Общий кэш на SQLite: кнопки работают в любом воркере и после рестарта
+    payload = json.dumps({"text": text, "variants": variants}, ensure_ascii=False)
+    await response_cache.set(f"copy:{copy_id}", payload, settings.COPY_SESSION_TTL)
+
+
+async def load_session(copy_id: str) -> Optional[dict]:
+    payload = await response_cache.get(f"copy:{copy_id}")
+    return json.loads(payload) if payload else None
+
+
+def render_variants(variants: dict) -> str:
+    blocks = [
+        f"<b>{COPY_VARIANTS[key]}:</b>\n{html.escape(variants[key])}"
+        for key in COPY_VARIANTS
+        if key in variants
+    ]
+    return format_copy_response("\n\n".join(blocks))
+
+
+def variants_keyboard(copy_id: str, variants: dict) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for key in COPY_VARIANTS:
+        if key in variants:
+            builder.button(text=REGEN_LABELS[key], callback_data=CopyRegen(copy_id=copy_id, variant=key))
+    builder.adjust(3)
+    return builder.as_markup()
+
+
 @router.message(F.text == "✍️ Копирайтер")
 async def start_copywriter(message: Message, state: FSMContext):
     await state.set_state(CopyStates.waiting_for_text)
@@ -28,7 +84,7 @@ async def start_copywriter(message: Message, state: FSMContext):
     )
 
 
-@router.message(CopyStates.waiting_for_text)
+@router.message(CopyStates.waiting_for_text, flags={"claude": "copy"})
 async def process_copywriting(message: Message, state: FSMContext):
     text = message.text
     
@@ -40,23 +96,47 @@ async def process_copywriting(message: Message, state: FSMContext):
         await message.answer("❌ Текст слишком длинный. Максимум 2000 символов.")
         return
     
-    msg = await message.answer("✍️ <b>Обрабатываю текст...</b>\n⏳ Claude AI создает варианты...", parse_mode="HTML")
-    
     try:
-        response = await claude_api.rewrite_copy(text)
+        # Индикатор набора вместо заглушки: ответ придет одним сообщением
+        async with reply_pipeline.typing(message):
+            variants = await claude_api.rewrite_copy(text)
         
-        await msg.delete()
         await state.clear()
         
-        if response:
-            if len(response) > 4000:
-                response = response[:3900] + "\n\n... (обрезано)"
-            
-            await message.answer(f"✍️ <b>ВАРИАНТЫ ТЕКСТА</b>\n\n{response}", parse_mode="HTML")
+        if variants:
+            copy_id = secrets.token_urlsafe(8)
+            await save_session(copy_id, text, variants)
+            await reply_pipeline.send(message, render_variants(variants), variants_keyboard(copy_id, variants))
         else:
-            await message.answer("❌ Ошибка при обработке. Попробуйте позже.")
+            await message.answer(format_copy_response(None))
     
     except Exception as e:
-        await msg.delete()
         await state.clear()
         await message.answer("❌ Произошла ошибка. Попробуйте снова.")
+
+
+@router.callback_query(CopyRegen.filter(), flags={"claude": "copy_variant"})
+async def regenerate_variant(callback: CallbackQuery, callback_data: CopyRegen):
+    session = await load_session(callback_data.copy_id)
+    
+    if session is None or callback_data.variant not in COPY_VARIANTS:
+        await callback.answer("⌛ Варианты устарели. Отправьте текст заново.", show_alert=True)
+        return
+    
+    await callback.answer("⏳ Переписываю вариант...")
+    
+    variants = session["variants"]
+    async with reply_pipeline.typing(callback.message):
+        new_variant = await claude_api.rewrite_copy_variant(session["text"], callback_data.variant, variants)
+    
+    if not new_variant:
+        await callback.message.answer("❌ Не удалось переписать вариант. Попробуйте позже.")
+        return
+    
+    variants[callback_data.variant] = new_variant
+    await save_session(callback_data.copy_id, session["text"], variants)
+    await reply_pipeline.edit(
+        callback.message,
+        render_variants(variants),
+        variants_keyboard(callback_data.copy_id, variants)
+    )
@@ -1,93 +1,86 @@
-from aiogram import Router, F, Bot
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
-import json
-import os
 import logging
-from app.claude_api import claude_api
+from datetime import datetime
+import pytz
+from app.utils.delivery import parse_delivery_time, parse_timezone
+from app.utils.tenants import Tenant
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-SUBS_FILE = "subscribers.json"
 
+def _schedule_text(tenant: Tenant, sub) -> str:
+    # У каждого бота свои подписчики и время рассылки по умолчанию
+    local_time = tenant.planner.local_time(sub, datetime.now(pytz.UTC).date())
+    return f"⏰ Время доставки: <b>{local_time}</b> ({tenant.planner.timezone(sub)})"
 
-def load_subscribers():
-    if os.path.exists(SUBS_FILE):
-        try:
-            with open(SUBS_FILE, "r") as f:
-                return set(json.load(f))
-        except:
-            return set()
-    return set()
 
-
-def save_subscribers(subs):
-    try:
-        with open(SUBS_FILE, "w") as f:
-            json.dump(list(subs), f)
-    except Exception as e:
-        logger.error(f"Error saving subscribers: {e}")
+SETTINGS_HINT = (
+    "Изменить время: /time 08:30\n"
+    "Изменить часовой пояс: /timezone Europe/Berlin или /timezone +3"
+)
 
 
 @router.message(F.text == "🔔 Уведомления")
-async def toggle_notifications(message: Message):
-    subs = load_subscribers()
-    user_id = message.from_user.id
+async def toggle_notifications(message: Message, tenant: Tenant):
+    subscribed = await tenant.subscribers.toggle(message.from_user.id)
     
-    if user_id in subs:
-        subs.remove(user_id)
-        save_subscribers(subs)
+    if not subscribed:
         await message.answer(
             "🔕 <b>Уведомления отключены</b>\n\n"
             "Вы больше не будете получать ежедневные советы.",
             parse_mode="HTML"
         )
     else:
-        subs.add(user_id)
-        save_subscribers(subs)
+        sub = tenant.subscribers.get(message.from_user.id)
         await message.answer(
             "🔔 <b>Уведомления включены!</b>\n\n"
-            "Каждое утро в 09:00 (МСК) вы будете получать:\n"
+            "Каждый день вы будете получать:\n"
             "💡 Идею дня\n"
             "🎨 Совет дня\n"
             "⏰ Лучшее время для постинга\n"
-            "🔥 Актуальные тренды",
+            "🔥 Актуальные тренды\n\n"
+            f"{_schedule_text(tenant, sub)}\n\n{SETTINGS_HINT}",
             parse_mode="HTML"
         )
 
 
-async def send_daily_notifications(bot: Bot):
-    """Отправка ежедневных уведомлений"""
-    subs = load_subscribers()
-    
-    if not subs:
-        logger.info("No subscribers")
+async def _save_setting(message: Message, tenant: Tenant, **meta):
+    user_id = message.from_user.id
+    subscribers = tenant.subscribers
+    await subscribers.refresh(user_id)
+    # Настройка времени доставки заодно включает рассылку
+    if subscribers.is_subscribed(user_id):
+        sub = await subscribers.update(user_id, **meta)
+        prefix = "✅ <b>Настройки сохранены</b>"
+    else:
+        sub = await subscribers.subscribe(user_id, **meta)
+        prefix = "🔔 <b>Уведомления включены!</b>"
+    await message.answer(f"{prefix}\n\n{_schedule_text(tenant, sub)}", parse_mode="HTML")
+
+
+@router.message(Command("time"))
+async def set_delivery_time(message: Message, command: CommandObject, tenant: Tenant):
+    delivery_time = parse_delivery_time(command.args or "")
+    if delivery_time is None:
+        await message.answer(
+            "❌ Укажите время в формате ЧЧ:ММ, например: /time 08:30\n\n"
+            f"Рассылка уходит слотами по {tenant.planner.slot_minutes} мин, "
+            "время округляется вниз до начала слота."
+        )
         return
-    
-    logger.info(f"Sending to {len(subs)} users")
-    
-    try:
-        content = await claude_api.generate_daily_content()
-        
-        if content:
-            for user_id in list(subs):
-                try:
-                    await bot.send_message(
-                        chat_id=user_id,
-                        text=f"🌅 <b>ДОБРОЕ УТРО, 3D-ХУДОЖНИК!</b>\n\n{content}",
-                        parse_mode="HTML"
-                    )
-                    logger.info(f"Sent to {user_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send to {user_id}: {e}")
-                    if "bot was blocked" in str(e).lower():
-                        subs.discard(user_id)
-            
-            save_subscribers(subs)
-    
-    except Exception as e:
-        logger.error(f"Error generating content: {e}")
-        logger.info("Daily notifications completed")
-    
-    except Exception as e:
-        logger.error(f"Error generating daily content: {e}")
+    await _save_setting(message, tenant, delivery_time=delivery_time)
+
+
+@router.message(Command("timezone"))
+async def set_timezone(message: Message, command: CommandObject, tenant: Tenant):
+    timezone = parse_timezone(command.args or "")
+    if timezone is None:
+        await message.answer(
+            "❌ Не знаю такой часовой пояс.\n\n"
+            "Примеры: /timezone Europe/Moscow, /timezone Asia/Almaty, /timezone +5:30"
+        )
+        return
+    await _save_setting(message, tenant, timezone=timezone)
@@ -0,0 +1,26 @@
+from aiogram import Router
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery
+from app.utils.formatter import strip_tags
+from app.utils.streaming import ReplyPage, reply_pipeline
+
+router = Router()
+
+
+@router.callback_query(ReplyPage.filter())
+async def show_page(callback: CallbackQuery, callback_data: ReplyPage):
+    # Страницы лежат в общем кэше: кнопки работают в любом воркере
+    page = await reply_pipeline.page(callback_data.reply_id, callback_data.page)
+    
+    if page is None:
+        await callback.answer("⌛ Ответ устарел. Запросите его заново.", show_alert=True)
+        return
+    
+    await callback.answer()
+    text, markup = page
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e).lower():
+            return
+        await callback.message.edit_text(strip_tags(text), parse_mode=None, reply_markup=markup)
@@ -2,34 +2,38 @@ from aiogram import Router, F
 from aiogram.types import Message
 from app.claude_api import claude_api
 from app.utils.scraping import trend_scraper
+from app.utils.streaming import reply_pipeline
+from app.utils.snapshots import trend_snapshots, format_age
+from app.utils.formatter import TREND_HEADER, format_trend_response
 
 router = Router()
 
 
-@router.message(F.text == "🔥 Сканер трендов")
+@router.message(F.text == "🔥 Сканер трендов", flags={"claude": "trends"})
 async def handle_trends(message: Message):
-    msg = await message.answer("🔍 <b>Сканирую тренды...</b>\n⏳ Собираю данные...", parse_mode="HTML")
+    # Свежий снимок готовит фоновая задача - отвечаем сразу
+    snapshot = await trend_snapshots.current()
+    if snapshot is not None:
+        footer = f"\n\n🕐 <i>Обновлено {format_age(snapshot.age)}</i>"
+        await reply_pipeline.send(message, format_trend_response(snapshot.analysis) + footer)
+        return
     
     try:
-        # Собираем тренды
-        raw_trends = await trend_scraper.get_all_trends()
-        
-        await msg.edit_text("🔍 <b>Сканирую тренды...</b>\n✅ Данные собраны\n⏳ Анализирую через Claude AI...", parse_mode="HTML")
-        
-        # Анализируем через Claude
-        response = await claude_api.analyze_trends(raw_trends)
-        
-        await msg.delete()
+        # Пока собираем тренды - индикатор набора вместо заглушки
+        async with reply_pipeline.typing(message) as action:
+            raw_trends = await trend_scraper.get_all_trends()
+            
+            # Снимок устарел - анализируем через Claude, показывая текст по мере генерации
+            response = await reply_pipeline.stream(
+                message,
+                claude_api.analyze_trends(raw_trends, stream=True),
+                TREND_HEADER,
+                error=format_trend_response(None),
+                action=action,
+            )
         
         if response:
-            # Обрезаем если слишком длинный
-            if len(response) > 4000:
-                response = response[:3900] + "\n\n... (обрезано)"
-            
-            await message.answer(f"🔥 <b>АНАЛИЗ ТРЕНДОВ</b>\n\n{response}", parse_mode="HTML")
-        else:
-            await message.answer("❌ Ошибка при анализе. Попробуйте позже.")
+            await trend_snapshots.store(raw_trends, response)
     
     except Exception as e:
-        await msg.delete()
         await message.answer(f"❌ Произошла ошибка. Попробуйте снова.")
@@ -1,16 +1,45 @@
+import asyncio
+import hmac
 import logging
 import os
+import time
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, Response
-from aiogram import Bot, Dispatcher
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
+from aiogram import Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.types import Update
 
 from app.config import settings
-from app.handlers import start, trends, copywriter, competitors, notifications
+from app.claude_api import claude_api
+from app.utils.cache import response_cache
+from app.utils.competitors import competitor_service
+from app.handlers import start, trends, copywriter, competitors, notifications, pages
 from app.utils.scheduler import scheduler
+from app.utils.scraping import trend_scraper
+from app.utils.snapshots import trend_snapshots
+from app.utils.tenants import Tenant, tenant_registry
+from app.utils.update_queue import UpdateQueue
+from app.utils.coordination import worker_coordinator
+from app.utils.fsm_storage import build_fsm_storage
+from app.utils.leader import leader_lock
+from app.utils.metrics import UPDATE_SECONDS, loop_lag_monitor, registry
+from app.utils.middlewares import (
+    BotAPICallsMiddleware,
+    ClaudeJobMiddleware,
+    MetricsMiddleware,
+    TracingMiddleware,
+)
+from app.utils.profiling import ProfilerBusy, profiler
+from app.utils.startup import StartupTimer
+from app.utils.tracing import BotAPITracingMiddleware
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,17 +47,126 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-bot = Bot(
-    token=settings.TELEGRAM_BOT_TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+startup = StartupTimer(_import_started)
+
+# Одна сессия Bot API (и пул соединений) на всех ботов-арендаторов
+bot_session = (
+    AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL))
+    if settings.TELEGRAM_API_URL else AiohttpSession()
+)
+bot_session.middleware(BotAPITracingMiddleware())
+bot_api_calls = BotAPICallsMiddleware(tenant_registry.name_of)
+bot_session.middleware(bot_api_calls)
+tenant_registry.connect(bot_session, DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+# Один диспетчер на всех ботов: ключи FSM уже содержат id бота.
+# FSM-состояния общие для всех воркеров uvicorn и истекают по TTL
+dp = Dispatcher(
+    storage=build_fsm_storage(
+        settings.FSM_STORAGE,
+        settings.FSM_DB_PATH,
+        settings.FSM_TTL,
+        redis_url=settings.REDIS_URL,
+    )
 )
-dp = Dispatcher()
 
 dp.include_router(start.router)
 dp.include_router(trends.router)
 dp.include_router(copywriter.router)
 dp.include_router(competitors.router)
 dp.include_router(notifications.router)
+dp.include_router(pages.router)
+
+# Трасса на апдейт; медленные апдейты пишутся в лог с разбивкой
+dp.update.outer_middleware(TracingMiddleware(settings.SLOW_UPDATE_THRESHOLD))
+
+# Inner-middleware диспетчера наследуют все дочерние роутеры
+dp.message.middleware(MetricsMiddleware())
+dp.callback_query.middleware(MetricsMiddleware())
+
+# Хендлеры с флагом claude: приоритет, дедупликация и лимит на пользователя
+claude_jobs = ClaudeJobMiddleware(
+    claude_api.limiter,
+    per_user=settings.CLAUDE_JOBS_PER_USER,
+    coordinator=worker_coordinator,
+)
+dp.message.middleware(claude_jobs)
+dp.callback_query.middleware(claude_jobs)
+
+
+async def process_update(update: Update, name: str):
+    tenant = tenant_registry.get(name)
+    started = time.perf_counter()
+    try:
+        # Хендлеры получают арендатора аргументом tenant
+        await dp.feed_update(tenant.bot, update, tenant=tenant)
+    finally:
+        UPDATE_SECONDS.observe(time.perf_counter() - started, tenant=tenant.name, event=update.event_type)
+
+
+# Вебхук только кладет апдейт в очередь, обработка идет в воркерах.
+# Очередь общая для всех ботов, доля каждого ограничена его квотой.
+# Источник апдейта - имя бота: оно одинаковое во всех воркерах uvicorn
+update_queue = UpdateQueue(
+    process_update,
+    workers=settings.WEBHOOK_WORKERS,
+    max_size=settings.WEBHOOK_QUEUE_SIZE,
+    coordinator=worker_coordinator,
+)
+
+
+background_tasks = set()
+
+# Мгновенные значения считываются при сборе /metrics
+registry.gauge("update_queue_depth", "Updates waiting in the webhook queue").set_function(
+    lambda: update_queue.depth
+)
+registry.gauge("claude_admission_queue_depth", "Claude requests waiting for admission").set_function(
+    lambda: claude_api.limiter.queue_depth
+)
+registry.gauge("claude_in_flight", "Claude requests in flight").set_function(
+    lambda: claude_api.limiter.in_flight
+)
+
+
+async def ensure_webhook(tenant: Tenant):
+    """
+    Вебхук ставится, только если Telegram знает другой адрес.
+    
+    Апдейты, пришедшие, пока сервис спал, остаются в очереди Telegram
+    и доставляются после пробуждения.
+    """
+    webhook_url = f"{settings.WEBHOOK_URL}{tenant.webhook_path}"
+    info = await tenant.bot.get_webhook_info()
+    if info.url == webhook_url:
+        logger.info(f"Webhook for {tenant.name} already set, {info.pending_update_count} pending updates")
+        return
+    await tenant.bot.set_webhook(url=webhook_url)
+    logger.info(f"Webhook for {tenant.name} set: {webhook_url}")
+
+
+async def start_leader_duties():
+    """Работа, которую в кластере воркеров выполняет ровно один процесс"""
+    with startup.phase("webhook"):
+        for tenant in tenant_registry:
+            try:
+                await ensure_webhook(tenant)
+            except Exception as e:
+                logger.error(f"Webhook setup for {tenant.name} failed: {e}")
+    
+    with startup.phase("scheduler"):
+        for tenant in tenant_registry:
+            tenant.delivery.schedule(scheduler, tenant.send_daily)
+        trend_snapshots.schedule(scheduler)
+        response_cache.schedule(scheduler, settings.CACHE_PURGE_INTERVAL)
+        scheduler.start()
+    startup.report()
+    
+    # Если процесс упал посреди рассылки - досылаем оставшимся
+    for tenant in tenant_registry:
+        task = asyncio.create_task(tenant.delivery.resume())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
 
 @asynccontextmanager
@@ -36,41 +174,73 @@ async def lifespan(app: FastAPI):
     """Lifecycle events"""
     logger.info("Starting bot...")
     
-    # Устанавливаем webhook
-    webhook_url = f"{settings.WEBHOOK_URL}{settings.WEBHOOK_PATH}"
-    await bot.set_webhook(url=webhook_url, drop_pending_updates=True)
-    logger.info(f"Webhook set: {webhook_url}")
-    
-    # Запускаем планировщик
-    async def daily_job():
-        await notifications.send_daily_notifications(bot)
+    # Пулы соединений к Claude и источникам трендов, база подписчиков и
+    # пул разбора лент открываются при первом обращении, а не здесь
+    with startup.phase("queue"):
+        update_queue.start()
+        loop_lag_monitor.start()
     
-    scheduler.add_daily_job(daily_job, settings.NOTIFICATION_TIME)
-    scheduler.start()
-    logger.info("Scheduler started")
+    # Вебхук и задачи по расписанию - только у одного воркера-лидера.
+    # Работают в фоне: очередь уже принимает апдейты
+    if leader_lock.try_acquire():
+        leader_task = asyncio.create_task(start_leader_duties())
+    else:
+        logger.info("Another worker is the leader, waiting in standby")
+        startup.report()
+        leader_task = asyncio.create_task(leader_lock.wait_for_leadership(start_leader_duties))
     
     yield
     
     # Shutdown
     logger.info("Shutting down...")
-    await bot.delete_webhook()
+    leader_task.cancel()
+    for task in background_tasks:
+        task.cancel()
+    loop_lag_monitor.stop()
+    await update_queue.stop()
     scheduler.shutdown()
-    await bot.session.close()
+    # Вебхук не снимаем: пока сервис спит, апдейты копятся у Telegram
+    # и будят его запросом на вебхук
+    leader_lock.release()
+    await dp.storage.close()
+    await claude_api.close()
+    await trend_scraper.close()
+    await competitor_service.close()
+    response_cache.close()
+    tenant_registry.close()
+    if worker_coordinator is not None:
+        worker_coordinator.close()
+    await bot_session.close()
     logger.info("Bot stopped")
 
 
 app = FastAPI(lifespan=lifespan)
 
 
-@app.post(settings.WEBHOOK_PATH)
-async def webhook_handler(request: Request):
-    try:
-        update = Update(**await request.json())
-        await dp.feed_update(bot, update)
+def webhook_handler(tenant: Tenant):
+    """Вебхук бота-арендатора на его собственном пути"""
+    
+    async def handle(request: Request):
+        try:
+            update = Update.model_validate_json(await request.body(), context={"bot": tenant.bot})
+        except ValidationError as e:
+            # Повторная доставка не исправит битый payload - подтверждаем и забываем
+            logger.error(f"Webhook payload for {tenant.name} rejected: {e}")
+            return Response(status_code=200)
+        
+        accepted = update_queue.submit(update, tenant.name, max_pending=tenant.quota.max_queued)
+        tenant.quota.record_update(accepted)
+        if not accepted:
+            logger.warning(f"Update queue is full for {tenant.name}, asking Telegram to retry")
+            return Response(status_code=503)
+        
         return Response(status_code=200)
-    except Exception as e:
-        logger.error(f"Webhook error: {e}")
-        return Response(status_code=500)
+    
+    return handle
+
+
+for _tenant in tenant_registry:
+    app.add_api_route(_tenant.webhook_path, webhook_handler(_tenant), methods=["POST"])
 
 
 @app.get("/")
@@ -84,4 +254,62 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "pid": os.getpid(),
+        "startup": startup.get_stats(),
+        "leader": leader_lock.is_leader,
+        "update_queue": update_queue.get_stats(),
+        "workers": {
+            "count": settings.WORKERS,
+            "coordination": worker_coordinator.get_stats() if worker_coordinator else None,
+        },
+        "claude_pool": claude_api.pool_stats(),
+        "claude_cache": response_cache.get_stats(),
+        "claude_admission": claude_api.limiter.get_stats(),
+        "claude_jobs": claude_jobs.get_stats(),
+        "bot_api": bot_api_calls.get_stats(),
+        "tenants": tenant_registry.get_stats(),
+        "claude_usage": claude_api.usage,
+        "claude_hedging": claude_api.hedging.get_stats() if claude_api.hedging else None,
+        "trend_snapshot": trend_snapshots.get_stats(),
+        "trend_sources": trend_scraper.get_stats(),
+        "trend_ranking": trend_scraper.ranker.get_stats() if trend_scraper.ranker else None,
+        "competitors": competitor_service.get_stats(),
+        "coalescing": {
+            "claude": claude_api.flight.get_stats(),
+            "trends": trend_scraper.flight.get_stats(),
+            "competitors": competitor_service.flight.get_stats(),
+        },
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profile")
+async def debug_profile(
+    seconds: float = 10,
+    interval: float = 0.005,
+    all_threads: bool = False,
+    x_admin_token: str = Header(default=""),
+):
+    """Сэмплирующий профиль процесса в формате folded stacks (для flamegraph)"""
+    if not settings.ADMIN_TOKEN or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=404)
+    
+    try:
+        folded = await profiler.capture(seconds, interval, all_threads)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    filename = f"profile-{os.getpid()}-{int(time.time())}.folded"
+    return PlainTextResponse(
+        folded,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+startup.mark("import", _import_started)
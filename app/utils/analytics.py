@@ -0,0 +1,241 @@
+import re
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+
+# Хэштег начинается с буквы: "Рендер #47" - это номер, а не тег
+HASHTAG_RE = re.compile(r"#([^\W\d_]\w{1,39})")
+
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+
+class PostTable:
+    """
+    Посты профиля в колоночном виде: по массиву NumPy на поле.
+
+    Вся арифметика (частота, гистограммы, доли форматов, топ) идет
+    векторно по колонкам, без цикла по постам на Python.
+    """
+
+    def __init__(
+        self,
+        published: np.ndarray,
+        likes: np.ndarray,
+        comments: np.ndarray,
+        views: np.ndarray,
+        media: np.ndarray,
+        media_names: List[str],
+        texts: List[str],
+    ):
+        self.published = published
+        self.likes = likes
+        self.comments = comments
+        self.views = views
+        self.media = media
+        self.media_names = media_names
+        self.texts = texts
+        self.engagement = likes + comments
+
+    @classmethod
+    def from_posts(cls, posts) -> "PostTable":
+        media_names = sorted({post.media for post in posts})
+        media_codes = {name: code for code, name in enumerate(media_names)}
+        return cls(
+            published=np.fromiter((post.published_at for post in posts), dtype=np.float64, count=len(posts)),
+            likes=np.fromiter((post.likes for post in posts), dtype=np.int64, count=len(posts)),
+            comments=np.fromiter((post.comments for post in posts), dtype=np.int64, count=len(posts)),
+            views=np.fromiter((post.views for post in posts), dtype=np.int64, count=len(posts)),
+            media=np.fromiter((media_codes[post.media] for post in posts), dtype=np.int16, count=len(posts)),
+            media_names=media_names,
+            texts=[post.text for post in posts],
+        )
+
+    def __len__(self) -> int:
+        return len(self.published)
+
+    def select(self, mask: np.ndarray) -> "PostTable":
+        indexes = np.flatnonzero(mask)
+        return PostTable(
+            self.published[mask],
+            self.likes[mask],
+            self.comments[mask],
+            self.views[mask],
+            self.media[mask],
+            self.media_names,
+            [self.texts[i] for i in indexes],
+        )
+
+
+def _mean_by(keys: np.ndarray, values: np.ndarray, size: int):
+    """Количество и среднее values по целочисленным ключам 0..size-1"""
+    counts = np.bincount(keys, minlength=size)
+    totals = np.bincount(keys, weights=values, minlength=size)
+    means = np.divide(totals, counts, out=np.zeros(size), where=counts > 0)
+    return counts, means
+
+
+def cadence(table: PostTable, now: float) -> dict:
+    """Частота публикаций: постов в неделю и интервалы между постами"""
+    published = np.sort(table.published)
+    # Период до текущего момента: затишье после последнего поста тоже снижает частоту
+    span_days = max((now - published[0]) / 86400, 1.0)
+    gaps = np.diff(published) / 3600
+    return {
+        "posts": len(table),
+        "span_days": round(float(span_days), 1),
+        "per_week": round(len(table) / span_days * 7, 1),
+        "gap_median_h": round(float(np.median(gaps)), 1) if len(gaps) else None,
+        "gap_p90_h": round(float(np.percentile(gaps, 90)), 1) if len(gaps) else None,
+        "last_30d": int(np.count_nonzero(published >= now - 30 * 86400)),
+        "days_since_last": round(float((now - published[-1]) / 86400), 1),
+    }
+
+
+def time_histograms(table: PostTable) -> dict:
+    """Посты и средние реакции по часу (UTC) и дню недели"""
+    seconds = table.published.astype(np.int64)
+    hours = (seconds // 3600) % 24
+    # 1970-01-01 - четверг: сдвигаем, чтобы 0 был понедельником
+    weekdays = (seconds // 86400 + 3) % 7
+
+    hour_counts, hour_means = _mean_by(hours, table.engagement, 24)
+    day_counts, day_means = _mean_by(weekdays, table.engagement, 7)
+
+    # Лучшие часы - только с достаточной выборкой, иначе один вирусный пост решает все
+    min_posts = max(2, len(table) // 50)
+    hour_rank = np.where(hour_counts >= min_posts, hour_means, -1)
+    best_hours = [int(h) for h in np.argsort(hour_rank)[::-1][:3] if hour_rank[h] >= 0]
+    day_rank = np.where(day_counts >= min_posts, day_means, -1)
+    best_days = [int(d) for d in np.argsort(day_rank)[::-1][:3] if day_rank[d] >= 0]
+
+    return {
+        "by_hour": {int(h): [int(hour_counts[h]), round(float(hour_means[h]))] for h in np.flatnonzero(hour_counts)},
+        "by_weekday": {WEEKDAYS[d]: [int(day_counts[d]), round(float(day_means[d]))] for d in range(7)},
+        "best_hours": best_hours,
+        "best_weekdays": [WEEKDAYS[d] for d in best_days],
+    }
+
+
+def format_mix(table: PostTable) -> dict:
+    """Доля каждого формата и его средние реакции"""
+    size = len(table.media_names)
+    counts, means = _mean_by(table.media, table.engagement, size)
+    order = np.argsort(counts)[::-1]
+    return {
+        table.media_names[i]: {
+            "share": round(float(counts[i] / len(table)), 3),
+            "avg_engagement": round(float(means[i])),
+        }
+        for i in order
+        if counts[i]
+    }
+
+
+def hashtags(table: PostTable, limit: int = 10) -> List[dict]:
+    """Частые хэштеги и средние реакции постов с ними"""
+    tags: List[str] = []
+    owners: List[int] = []
+    for index, text in enumerate(table.texts):
+        # set: хэштег, повторенный в посте дважды, считаем один раз
+        found = {tag.lower() for tag in HASHTAG_RE.findall(text)}
+        tags.extend(found)
+        owners.extend([index] * len(found))
+    if not tags:
+        return []
+
+    names, codes = np.unique(np.array(tags), return_inverse=True)
+    counts, means = _mean_by(codes, table.engagement[np.array(owners)], len(names))
+    order = np.lexsort((-means, -counts))
+    # Разовые теги на большом профиле - шум
+    if len(table) >= 10:
+        order = order[counts[order] >= 2]
+    return [
+        {"tag": f"#{names[i]}", "posts": int(counts[i]), "avg_engagement": round(float(means[i]))}
+        for i in order[:limit]
+    ]
+
+
+def top_posts(table: PostTable, limit: int = 5) -> List[dict]:
+    """Топ постов по реакциям (argpartition вместо полной сортировки)"""
+    limit = min(limit, len(table))
+    if limit == 0:
+        return []
+    top = np.argpartition(table.engagement, -limit)[-limit:]
+    top = top[np.argsort(table.engagement[top])[::-1]]
+    return [
+        {
+            "published_at": float(table.published[i]),
+            "media": table.media_names[table.media[i]],
+            "likes": int(table.likes[i]),
+            "comments": int(table.comments[i]),
+            "text": " ".join(table.texts[i].split())[:140],
+        }
+        for i in top
+    ]
+
+
+def summarize(table: PostTable, now: float, top_n: int = 5) -> dict:
+    """Сводка профиля: все, что раньше Claude считал по сырому списку постов"""
+    engagement = table.engagement
+    return {
+        "cadence": cadence(table, now),
+        "engagement": {
+            "mean": round(float(engagement.mean())),
+            "median": round(float(np.median(engagement))),
+            "p90": round(float(np.percentile(engagement, 90))),
+            "views_mean": round(float(table.views.mean())) if table.views.any() else None,
+        },
+        **time_histograms(table),
+        "formats": format_mix(table),
+        "hashtags": hashtags(table),
+        "top_posts": top_posts(table, top_n),
+    }
+
+
+def _format_date(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def format_summary(summary: dict, previous: Optional[dict] = None) -> str:
+    """
+    Компактный текст сводки для промпта.
+
+    previous - сводка старых постов: рядом с метриками показываем, как было.
+    """
+
+    def was(section: str, key: str) -> str:
+        if previous is None or previous.get(section, {}).get(key) is None:
+            return ""
+        return f" (было {previous[section][key]})"
+
+    c = summary["cadence"]
+    e = summary["engagement"]
+    gap = f", медианный интервал {c['gap_median_h']} ч" if c["gap_median_h"] is not None else ""
+    lines = [
+        f"ЧАСТОТА: {c['per_week']} постов/нед{was('cadence', 'per_week')}, "
+        f"за 30 дней {c['last_30d']}{gap}, последний пост {c['days_since_last']} дн назад",
+        f"РЕАКЦИИ: среднее {e['mean']}{was('engagement', 'mean')}, "
+        f"медиана {e['median']}{was('engagement', 'median')}, p90 {e['p90']}"
+        + (f", просмотры {e['views_mean']}" if e["views_mean"] is not None else ""),
+        "ФОРМАТЫ: " + ", ".join(
+            f"{name} {stats['share']:.0%} (ср. {stats['avg_engagement']})"
+            for name, stats in summary["formats"].items()
+        ),
+    ]
+    if summary["best_hours"]:
+        lines.append("ЛУЧШИЕ ЧАСЫ (UTC): " + ", ".join(f"{h:02d}:00" for h in summary["best_hours"]))
+    if summary["best_weekdays"]:
+        lines.append("ЛУЧШИЕ ДНИ: " + ", ".join(summary["best_weekdays"]))
+    if summary["hashtags"]:
+        lines.append("ХЭШТЕГИ: " + ", ".join(
+            f"{tag['tag']} ×{tag['posts']} (ср. {tag['avg_engagement']})" for tag in summary["hashtags"]
+        ))
+    if summary["top_posts"]:
+        lines.append("ТОП ПОСТОВ (дата | формат | реакции | текст):")
+        lines.extend(
+            f"{_format_date(post['published_at'])} | {post['media']} | "
+            f"👍 {post['likes']} 💬 {post['comments']} | {post['text']}"
+            for post in summary["top_posts"]
+        )
+    return "\n".join(lines)
@@ -0,0 +1,371 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from app.utils.metrics import BROADCAST_MESSAGES, BROADCAST_RATE, BROADCAST_SEND_SECONDS
+from app.utils.ratelimit import TokenBucket, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+SENT = "sent"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+class BroadcastReport:
+    """Итоги одного прогона рассылки"""
+
+    def __init__(self, run_id: str, total: int):
+        self.run_id = run_id
+        self.total = total
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.latencies: List[float] = []
+
+    @property
+    def duration(self) -> float:
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    def as_dict(self) -> dict:
+        duration = self.duration
+        return {
+            "run_id": self.run_id,
+            "total": self.total,
+            "sent": self.sent,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "retries": self.retries,
+            "duration": round(duration, 2),
+            "rate": round(self.sent / duration, 2) if duration > 0 else 0.0,
+            "latency_p50": _percentile(self.latencies, 0.5),
+            "latency_p95": _percentile(self.latencies, 0.95),
+        }
+
+
+class BroadcastEngine:
+    """
+    Массовая рассылка с ограничением скорости и возобновлением.
+
+    Отправка идет пулом воркеров под общим лимитом Telegram (~30 сообщений
+    в секунду). TelegramRetryAfter приостанавливает всех воркеров на
+    указанное время. Состояние доставки каждому получателю сохраняется в
+    SQLite, поэтому прерванный прогон с тем же run_id продолжается с места
+    остановки, а текст рассылки берется из сохраненного прогона.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        rate_per_second: float = 25,
+        concurrency: int = 10,
+        max_retries: int = 3,
+        flush_every: int = 50,
+        tenant: str = "default",
+    ):
+        self.db_path = db_path
+        self.rate_per_second = rate_per_second
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.flush_every = flush_every
+        # Лимит Telegram - на бота, поэтому у каждого бота-арендатора свой движок
+        self.tenant = tenant
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.last_report: Optional[dict] = None
+
+    # --- SQLite (вызывается из пула потоков) ---
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS broadcast_runs ("
+                "run_id TEXT PRIMARY KEY, content TEXT NOT NULL, "
+                "started_at REAL NOT NULL, finished_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS broadcast_deliveries ("
+                "run_id TEXT NOT NULL, user_id INTEGER NOT NULL, status TEXT NOT NULL, "
+                "error TEXT, updated_at REAL NOT NULL, PRIMARY KEY (run_id, user_id))"
+            )
+            # Выпуск - текст, заготовленный заранее для нескольких прогонов
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS broadcast_editions ("
+                "edition TEXT PRIMARY KEY, content TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _get_run_sync(self, run_id: str):
+        with self._lock:
+            return self._db().execute(
+                "SELECT content, finished_at FROM broadcast_runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+
+    def _start_run_sync(self, run_id: str, content: str):
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO broadcast_runs (run_id, content, started_at) VALUES (?, ?, ?)",
+                    (run_id, content, time.time()),
+                )
+
+    def _done_users_sync(self, run_id: str) -> set:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT user_id FROM broadcast_deliveries WHERE run_id = ? AND status IN (?, ?)",
+                (run_id, SENT, BLOCKED),
+            ).fetchall()
+        return {user_id for (user_id,) in rows}
+
+    def _flush_sync(self, run_id: str, results: List[tuple]):
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO broadcast_deliveries "
+                    "(run_id, user_id, status, error, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(run_id, user_id, status, error, now) for user_id, status, error in results],
+                )
+
+    def _delivered_sync(self, prefix: str) -> set:
+        # GLOB по префиксу идет по первичному ключу (run_id, user_id)
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT user_id FROM broadcast_deliveries WHERE run_id GLOB ? AND status IN (?, ?)",
+                (f"{prefix}*", SENT, BLOCKED),
+            ).fetchall()
+        return {user_id for (user_id,) in rows}
+
+    def _unfinished_sync(self, prefix: str, since: float) -> List[str]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT run_id FROM broadcast_runs "
+                "WHERE run_id GLOB ? AND finished_at IS NULL AND started_at >= ? ORDER BY started_at",
+                (f"{prefix}*", since),
+            ).fetchall()
+        return [run_id for (run_id,) in rows]
+
+    def _get_edition_sync(self, edition: str) -> Optional[str]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT content FROM broadcast_editions WHERE edition = ?", (edition,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _save_edition_sync(self, edition: str, content: str):
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO broadcast_editions (edition, content, created_at) VALUES (?, ?, ?)",
+                    (edition, content, time.time()),
+                )
+
+    def _finish_run_sync(self, run_id: str):
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "UPDATE broadcast_runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id)
+                )
+
+    # --- Публичный API ---
+
+    async def pending_content(self, run_id: str) -> Optional[str]:
+        """Текст незавершенного прогона, если он был прерван"""
+        row = await asyncio.to_thread(self._get_run_sync, run_id)
+        if row is None:
+            return None
+        content, finished_at = row
+        return content if finished_at is None else None
+
+    async def is_finished(self, run_id: str) -> bool:
+        row = await asyncio.to_thread(self._get_run_sync, run_id)
+        return row is not None and row[1] is not None
+
+    async def delivered(self, prefix: str) -> set:
+        """Получатели, уже обработанные любым прогоном с этим префиксом run_id"""
+        return await asyncio.to_thread(self._delivered_sync, prefix)
+
+    async def unfinished(self, prefix: str, since: float) -> List[str]:
+        """Прерванные прогоны с префиксом run_id, начатые не раньше since"""
+        return await asyncio.to_thread(self._unfinished_sync, prefix, since)
+
+    async def edition(self, edition: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get_edition_sync, edition)
+
+    async def save_edition(self, edition: str, content: str) -> str:
+        """Сохраняет выпуск; если он уже был, возвращает сохраненный текст"""
+        await asyncio.to_thread(self._save_edition_sync, edition, content)
+        return await self.edition(edition) or content
+
+    async def run(
+        self,
+        run_id: str,
+        content: str,
+        user_ids: Iterable[int],
+        send: Callable[[int, str], Awaitable[None]],
+        on_blocked: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> dict:
+        await asyncio.to_thread(self._start_run_sync, run_id, content)
+        done = await asyncio.to_thread(self._done_users_sync, run_id)
+
+        user_ids = list(user_ids)
+        report = BroadcastReport(run_id, len(user_ids))
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in user_ids:
+            if user_id in done:
+                report.skipped += 1
+            else:
+                queue.put_nowait(user_id)
+
+        if report.skipped:
+            logger.info(f"Resuming broadcast {run_id}: {report.skipped} already delivered")
+
+        # Небольшой запас емкости, чтобы не было рывка на старте
+        bucket = TokenBucket(self.rate_per_second * 60, capacity=self.rate_per_second)
+        bucket_lock = asyncio.Lock()
+        paused_until = 0.0
+        pending: List[tuple] = []
+
+        async def flush():
+            if not pending:
+                return
+            batch = pending[:]
+            pending.clear()
+            try:
+                await asyncio.to_thread(self._flush_sync, run_id, batch)
+            except Exception as e:
+                logger.error(f"Broadcast checkpoint failed: {e}")
+
+        async def record(user_id: int, status: str, error: Optional[str] = None):
+            pending.append((user_id, status, error))
+            BROADCAST_MESSAGES.inc(tenant=self.tenant, status=status)
+            if len(pending) >= self.flush_every:
+                await flush()
+
+        async def admit():
+            async with bucket_lock:
+                while True:
+                    delay = max(paused_until - time.monotonic(), bucket.delay_for(1))
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                bucket.take(1)
+
+        async def deliver(user_id: int):
+            nonlocal paused_until
+            for attempt in range(self.max_retries + 1):
+                await admit()
+                started = time.monotonic()
+                try:
+                    await send(user_id, content)
+                    latency = time.monotonic() - started
+                    report.latencies.append(latency)
+                    BROADCAST_SEND_SECONDS.observe(latency)
+                    report.sent += 1
+                    await record(user_id, SENT)
+                    return
+                except TelegramRetryAfter as e:
+                    # Флуд-лимит общий для бота - тормозим всех воркеров
+                    paused_until = max(paused_until, time.monotonic() + e.retry_after)
+                    BROADCAST_MESSAGES.inc(tenant=self.tenant, status="throttled")
+                    logger.warning(f"Broadcast throttled by Telegram for {e.retry_after}s")
+                except TelegramForbiddenError as e:
+                    report.blocked += 1
+                    await record(user_id, BLOCKED, str(e))
+                    if on_blocked is not None:
+                        await on_blocked(user_id)
+                    return
+                except TelegramBadRequest as e:
+                    report.failed += 1
+                    await record(user_id, FAILED, str(e))
+                    return
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    if attempt == self.max_retries:
+                        report.failed += 1
+                        await record(user_id, FAILED, str(e))
+                        return
+                    await asyncio.sleep(backoff_delay(attempt))
+                except Exception as e:
+                    logger.error(f"Failed to send to {user_id}: {e}")
+                    report.failed += 1
+                    await record(user_id, FAILED, str(e))
+                    return
+                report.retries += 1
+
+            report.failed += 1
+            await record(user_id, FAILED, "retries exhausted")
+
+        async def worker():
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await deliver(user_id)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Сохраняем прогресс и при отмене, чтобы следующий запуск продолжил
+            await flush()
+
+        await asyncio.to_thread(self._finish_run_sync, run_id)
+        report.finished = time.monotonic()
+
+        self.last_report = report.as_dict()
+        BROADCAST_RATE.set(self.last_report["rate"])
+        logger.info(f"Broadcast {run_id} completed: {self.last_report}")
+        return self.last_report
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+from app.config import settings
+
+# Singleton экземпляр
+broadcast_engine = BroadcastEngine(
+    settings.SUBSCRIBERS_DB_PATH,
+    rate_per_second=settings.BROADCAST_RATE,
+    concurrency=settings.BROADCAST_CONCURRENCY,
+)
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(*parts) -> str:
+    """Стабильный ключ кэша из произвольных JSON-совместимых частей"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов: LRU в памяти + SQLite на диске.
+
+    Память отдает ответ за микросекунды, диск переживает рестарты.
+    Каждая запись хранит собственный срок жизни (expires_at). Просроченные
+    строки, которые больше никто не прочитает (страницы ответов, сессии
+    копирайтера), удаляет периодическая задача purge; сверх max_rows
+    вытесняются строки, которые истекли бы раньше всех.
+    """
+
+    JOB_ID = "cache_purge"
+
+    def __init__(self, db_path: Optional[str], max_items: int = 1000, max_rows: int = 0):
+        self.db_path = db_path
+        self.max_items = max_items
+        self.max_rows = max_rows
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+            "writes": 0,
+            "purged": 0,
+        }
+
+    # --- SQLite (вызывается из пула потоков) ---
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            conn = self._db()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            return row
+
+    def _disk_set(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            conn = self._db()
+            if conn is None:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            conn.commit()
+
+    def _disk_delete(self, key: str):
+        with self._lock:
+            conn = self._db()
+            if conn is None:
+                return
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+
+    def _disk_purge(self) -> int:
+        with self._lock:
+            conn = self._db()
+            if conn is None:
+                return 0
+            removed = conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),)).rowcount
+            if self.max_rows > 0:
+                excess = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_rows
+                if excess > 0:
+                    removed += conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY expires_at LIMIT ?)",
+                        (excess,),
+                    ).rowcount
+            conn.commit()
+            return removed
+
+    # --- Память ---
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    # --- Публичный API ---
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return value
+            del self._memory[key]
+            self.stats["expired"] += 1
+
+        try:
+            row = await asyncio.to_thread(self._disk_get, key)
+        except Exception as e:
+            logger.error(f"Cache read error: {e}")
+            row = None
+
+        if row is not None:
+            value, expires_at = row
+            if expires_at > now:
+                self._remember(key, value, expires_at)
+                self.stats["disk_hits"] += 1
+                return value
+            self.stats["expired"] += 1
+            try:
+                await asyncio.to_thread(self._disk_delete, key)
+            except Exception as e:
+                logger.error(f"Cache delete error: {e}")
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str, ttl: float):
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+        self.stats["writes"] += 1
+        try:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at)
+        except Exception as e:
+            logger.error(f"Cache write error: {e}")
+
+    async def purge_expired(self) -> int:
+        """Удаление просроченных записей из обоих уровней"""
+        now = time.time()
+        stale = [key for key, (_, expires_at) in self._memory.items() if expires_at <= now]
+        for key in stale:
+            del self._memory[key]
+        try:
+            removed = await asyncio.to_thread(self._disk_purge)
+        except Exception as e:
+            logger.error(f"Cache purge error: {e}")
+            removed = 0
+        return len(stale) + removed
+
+    async def purge(self):
+        """Периодическая чистка (задача планировщика)"""
+        removed = await self.purge_expired()
+        self.stats["purged"] += removed
+        if removed:
+            logger.info(f"Cache purge removed {removed} entries")
+
+    def schedule(self, scheduler, interval: float):
+        """Регистрация чистки в NotificationScheduler"""
+        scheduler.add_interval_job(self.purge, interval, self.JOB_ID)
+
+    def get_stats(self) -> dict:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hits": hits,
+            "hit_ratio": round(hits / total, 3) if total else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+from app.config import settings
+
+# Singleton экземпляр
+response_cache = ResponseCache(
+    settings.CACHE_DB_PATH,
+    settings.CACHE_MAX_ITEMS,
+    max_rows=settings.CACHE_MAX_ROWS,
+)
@@ -0,0 +1,611 @@
+import aiohttp
+import asyncio
+import calendar
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from app.utils.singleflight import SingleFlight
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class Post:
+    """Пост конкурента в нормализованном виде, общем для всех провайдеров"""
+
+    __slots__ = ("post_id", "published_at", "text", "url", "likes", "comments", "views", "media")
+
+    def __init__(
+        self,
+        post_id: str,
+        published_at: float,
+        text: str = "",
+        url: str = "",
+        likes: int = 0,
+        comments: int = 0,
+        views: int = 0,
+        media: str = "text",
+    ):
+        self.post_id = post_id
+        self.published_at = published_at
+        self.text = text
+        self.url = url
+        self.likes = likes
+        self.comments = comments
+        self.views = views
+        self.media = media
+
+    @property
+    def engagement(self) -> int:
+        return self.likes + self.comments
+
+    def to_row(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Post":
+        return cls(**{field: data[field] for field in cls.__slots__ if field in data})
+
+
+USERNAME_RE = re.compile(r"^[A-Za-z0-9_.-]{2,64}$")
+
+
+def is_valid_username(username: str) -> bool:
+    # Никнейм попадает в URL и имя файла - пропускаем только безопасные символы
+    return bool(USERNAME_RE.match(username)) and ".." not in username
+
+
+# --- Провайдеры данных ---
+
+
+class CompetitorProvider:
+    """
+    Источник постов профиля.
+
+    fetch возвращает посты новее since (unix time) - провайдер сам решает,
+    как не тянуть уже сохраненное (пагинация до since, фильтр ленты).
+    """
+
+    name = "base"
+
+    async def fetch(self, username: str, since: Optional[float] = None) -> List[Post]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class _HTTPProvider(CompetitorProvider):
+    def __init__(self, timeout: float = 15.0):
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"User-Agent": "3d-smm-bot/1.0 (competitor analysis)"},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class RedditProvider(_HTTPProvider):
+    """Публичный JSON профиля Reddit: посты с очками и комментариями"""
+
+    name = "reddit"
+
+    def __init__(self, base_url: str = "https://www.reddit.com", timeout: float = 15.0, max_pages: int = 10):
+        super().__init__(timeout)
+        self.base_url = base_url.rstrip("/")
+        self.max_pages = max_pages
+
+    @staticmethod
+    def _media(data: dict) -> str:
+        if data.get("is_video"):
+            return "video"
+        if data.get("is_gallery"):
+            return "carousel"
+        if data.get("post_hint") == "image":
+            return "image"
+        if data.get("is_self", True):
+            return "text"
+        return "link"
+
+    def _post(self, data: dict) -> Post:
+        return Post(
+            post_id=data["id"],
+            published_at=float(data.get("created_utc") or 0),
+            text=data.get("title") or "",
+            url=f"{self.base_url}{data.get('permalink', '')}",
+            likes=int(data.get("score") or 0),
+            comments=int(data.get("num_comments") or 0),
+            views=int(data.get("view_count") or 0),
+            media=self._media(data),
+        )
+
+    async def fetch(self, username: str, since: Optional[float] = None) -> List[Post]:
+        session = await self._get_session()
+        url = f"{self.base_url}/user/{username}/submitted.json"
+        posts: List[Post] = []
+        after = None
+
+        # Лента отсортирована по новизне: листаем, пока не дошли до сохраненного
+        for _ in range(self.max_pages):
+            params = {"limit": 100, "sort": "new", "raw_json": 1}
+            if after:
+                params["after"] = after
+            async with session.get(url, params=params) as response:
+                if response.status == 404:
+                    return []
+                response.raise_for_status()
+                listing = (await response.json()).get("data", {})
+
+            for child in listing.get("children", []):
+                post = self._post(child.get("data", {}))
+                if since is not None and post.published_at <= since:
+                    return posts
+                posts.append(post)
+
+            after = listing.get("after")
+            if not after:
+                break
+        return posts
+
+
+class FeedProvider(_HTTPProvider):
+    """RSS/Atom профиля по шаблону адреса (Mastodon, Bluesky, блоги)"""
+
+    name = "feed"
+
+    def __init__(self, url_template: str, timeout: float = 15.0):
+        super().__init__(timeout)
+        self.url_template = url_template
+
+    @staticmethod
+    def _media(entry) -> str:
+        types = [item.get("type", "") for item in entry.get("media_content", []) + entry.get("enclosures", [])]
+        if any(t.startswith("video") for t in types):
+            return "video"
+        if len([t for t in types if t.startswith("image")]) > 1:
+            return "carousel"
+        if any(t.startswith("image") for t in types):
+            return "image"
+        return "text"
+
+    async def fetch(self, username: str, since: Optional[float] = None) -> List[Post]:
+        import feedparser
+
+        session = await self._get_session()
+        async with session.get(self.url_template.format(username=username)) as response:
+            if response.status == 404:
+                return []
+            response.raise_for_status()
+            content = await response.read()
+
+        feed = await asyncio.to_thread(feedparser.parse, content)
+        posts = []
+        for entry in feed.entries:
+            published = entry.get("published_parsed") or entry.get("updated_parsed")
+            published_at = float(calendar.timegm(published)) if published else time.time()
+            if since is not None and published_at <= since:
+                continue
+            posts.append(Post(
+                post_id=entry.get("id") or entry.get("link", ""),
+                published_at=published_at,
+                text=entry.get("title") or entry.get("summary", "")[:300],
+                url=entry.get("link", ""),
+                media=self._media(entry),
+            ))
+        return posts
+
+
+class FixtureProvider(CompetitorProvider):
+    """Локальные JSON-файлы {username}.json - для разработки и тестов без сети"""
+
+    name = "fixture"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _read(self, username: str) -> List[Post]:
+        path = os.path.join(self.directory, f"{username}.json")
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [Post.from_dict(item) for item in json.load(f)]
+
+    async def fetch(self, username: str, since: Optional[float] = None) -> List[Post]:
+        posts = await asyncio.to_thread(self._read, username)
+        if since is not None:
+            posts = [post for post in posts if post.published_at > since]
+        return posts
+
+
+def build_provider(
+    backend: str,
+    reddit_url: str,
+    feed_url: Optional[str],
+    fixtures_dir: str,
+    timeout: float,
+) -> CompetitorProvider:
+    """Провайдер по настройке COMPETITOR_PROVIDER: reddit, feed или fixture"""
+    if backend == "fixture":
+        return FixtureProvider(fixtures_dir)
+    if backend == "feed":
+        if feed_url:
+            return FeedProvider(feed_url, timeout=timeout)
+        logger.error("COMPETITOR_PROVIDER=feed requires COMPETITOR_FEED_URL, falling back to reddit")
+    return RedditProvider(reddit_url, timeout=timeout)
+
+
+# --- Хранилище снимков ---
+
+
+class CompetitorProfile:
+    """Состояние профиля: последняя проверка и закэшированный анализ"""
+
+    def __init__(
+        self,
+        username: str,
+        checked_at: Optional[float] = None,
+        analysis: Optional[str] = None,
+        analysis_fingerprint: Optional[str] = None,
+        analyzed_at: Optional[float] = None,
+        changes: Optional[str] = None,
+    ):
+        self.username = username
+        self.checked_at = checked_at
+        self.analysis = analysis
+        self.analysis_fingerprint = analysis_fingerprint
+        self.analyzed_at = analyzed_at
+        self.changes = changes
+
+
+class CompetitorStore:
+    """
+    Снимки постов по профилям в SQLite (WAL).
+
+    Посты копятся от проверки к проверке, поэтому каждая следующая
+    загрузка запрашивает у провайдера только новое.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS competitor_posts ("
+                "username TEXT NOT NULL, post_id TEXT NOT NULL, published_at REAL NOT NULL, "
+                "text TEXT, url TEXT, likes INTEGER, comments INTEGER, views INTEGER, media TEXT, "
+                "fetched_at REAL NOT NULL, PRIMARY KEY (username, post_id))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS competitor_posts_time "
+                "ON competitor_posts (username, published_at)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS competitor_profiles ("
+                "username TEXT PRIMARY KEY, checked_at REAL, analysis TEXT, "
+                "analysis_fingerprint TEXT, analyzed_at REAL, changes TEXT)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _latest_sync(self, username: str) -> Optional[float]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT MAX(published_at) FROM competitor_posts WHERE username = ?", (username,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _save_posts_sync(self, username: str, posts: List[Post]):
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO competitor_posts "
+                    "(username, post_id, published_at, text, url, likes, comments, views, media, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(username, post_id) DO UPDATE SET "
+                    "likes = excluded.likes, comments = excluded.comments, views = excluded.views, "
+                    "fetched_at = excluded.fetched_at",
+                    [(username, *post.to_row(), now) for post in posts],
+                )
+                conn.execute(
+                    "INSERT INTO competitor_profiles (username, checked_at) VALUES (?, ?) "
+                    "ON CONFLICT(username) DO UPDATE SET checked_at = excluded.checked_at",
+                    (username, now),
+                )
+
+    def _posts_sync(self, username: str, limit: int) -> List[Post]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT post_id, published_at, text, url, likes, comments, views, media "
+                "FROM competitor_posts WHERE username = ? ORDER BY published_at DESC LIMIT ?",
+                (username, limit),
+            ).fetchall()
+        return [Post(*row) for row in rows]
+
+    def _profile_sync(self, username: str) -> CompetitorProfile:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT checked_at, analysis, analysis_fingerprint, analyzed_at, changes "
+                "FROM competitor_profiles WHERE username = ?",
+                (username,),
+            ).fetchone()
+        return CompetitorProfile(username, *row) if row else CompetitorProfile(username)
+
+    def _save_analysis_sync(self, username: str, fingerprint: str, analysis: Optional[str], changes: Optional[str]):
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT INTO competitor_profiles "
+                    "(username, analysis, analysis_fingerprint, analyzed_at, changes) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(username) DO UPDATE SET "
+                    "analysis = COALESCE(excluded.analysis, analysis), "
+                    "analysis_fingerprint = excluded.analysis_fingerprint, "
+                    "analyzed_at = excluded.analyzed_at, changes = excluded.changes",
+                    (username, analysis, fingerprint, time.time(), changes),
+                )
+
+    async def latest(self, username: str) -> Optional[float]:
+        return await asyncio.to_thread(self._latest_sync, username)
+
+    async def save_posts(self, username: str, posts: List[Post]):
+        await asyncio.to_thread(self._save_posts_sync, username, posts)
+
+    async def posts(self, username: str, limit: int = 1000) -> List[Post]:
+        return await asyncio.to_thread(self._posts_sync, username, limit)
+
+    async def profile(self, username: str) -> CompetitorProfile:
+        return await asyncio.to_thread(self._profile_sync, username)
+
+    async def save_analysis(
+        self,
+        username: str,
+        fingerprint: str,
+        analysis: Optional[str] = None,
+        changes: Optional[str] = None,
+    ):
+        """analysis=None сохраняет прежний полный анализ и обновляет только изменения"""
+        await asyncio.to_thread(self._save_analysis_sync, username, fingerprint, analysis, changes)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# --- Сервис анализа ---
+
+FULL = "full"
+CHANGES = "changes"
+CACHED = "cached"
+EMPTY = "empty"
+# Провайдер недоступен, а сохраненного снимка нет - никнейм не проверен
+ERROR = "error"
+
+
+def _format_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
+def format_posts(posts: List[Post], limit: int = 30) -> str:
+    """Компактная таблица постов для промпта: самые свежие сверху"""
+    lines = []
+    for post in posts[:limit]:
+        text = " ".join(post.text.split())[:140]
+        lines.append(
+            f"{_format_time(post.published_at)} | {post.media} | "
+            f"👍 {post.likes} 💬 {post.comments} | {text}"
+        )
+    return "\n".join(lines)
+
+
+class CompetitorCheck:
+    """Результат проверки профиля: что показать и что отправить в Claude"""
+
+    def __init__(
+        self,
+        username: str,
+        kind: str,
+        fingerprint: str = "",
+        data: str = "",
+        posts: Optional[List[Post]] = None,
+        new_posts: Optional[List[Post]] = None,
+        profile: Optional[CompetitorProfile] = None,
+    ):
+        self.username = username
+        self.kind = kind
+        self.fingerprint = fingerprint
+        self.data = data
+        self.posts = posts or []
+        self.new_posts = new_posts or []
+        self.profile = profile
+
+
+class CompetitorService:
+    """
+    Анализ конкурента поверх снимков.
+
+    Первый раз - полный анализ всех постов. Дальше провайдер отдает только
+    новые посты: если их нет, возвращаем сохраненный анализ без Claude,
+    если есть - Claude разбирает только изменения относительно прошлого раза.
+    """
+
+    def __init__(self, provider: CompetitorProvider, store: CompetitorStore, max_posts: int = 1000):
+        self.provider = provider
+        self.store = store
+        self.max_posts = max_posts
+
+        # Одновременные проверки одного профиля не должны качать его дважды
+        self.flight = SingleFlight("competitors")
+
+        self.stats = {
+            "checks": 0,
+            "full": 0,
+            "changes": 0,
+            "cached": 0,
+            "empty": 0,
+            "errors": 0,
+            "fetched_posts": 0,
+            "fetch_errors": 0,
+        }
+
+    @staticmethod
+    def fingerprint(posts: List[Post]) -> str:
+        if not posts:
+            return ""
+        return f"{len(posts)}:{posts[0].published_at:.0f}:{posts[0].post_id}"
+
+    @staticmethod
+    def _fingerprint_time(fingerprint: Optional[str]) -> Optional[float]:
+        # Время самого свежего поста на момент прошлого анализа
+        try:
+            return float(fingerprint.split(":", 2)[1])
+        except (AttributeError, IndexError, ValueError):
+            return None
+
+    async def _sync(self, username: str) -> Optional[List[Post]]:
+        """Догрузка постов новее последнего снимка; None - провайдер недоступен"""
+        since = await self.store.latest(username)
+        try:
+            with span("competitor.fetch", provider=self.provider.name):
+                fresh = await self.provider.fetch(username, since)
+        except Exception as e:
+            # Сеть недоступна - работаем по сохраненному снимку
+            self.stats["fetch_errors"] += 1
+            logger.error(f"Competitor fetch failed for {username}: {e}")
+            return None
+        if fresh:
+            await self.store.save_posts(username, fresh)
+            self.stats["fetched_posts"] += len(fresh)
+        return fresh
+
+    async def check(self, username: str) -> CompetitorCheck:
+        username = username.lower()
+        self.stats["checks"] += 1
+        fresh = await self.flight.do(username, lambda: self._sync(username))
+        posts = await self.store.posts(username, self.max_posts)
+        profile = await self.store.profile(username)
+
+        if not posts and fresh is None:
+            self.stats["errors"] += 1
+            return CompetitorCheck(username, ERROR, profile=profile)
+
+        if not posts:
+            self.stats["empty"] += 1
+            return CompetitorCheck(username, EMPTY, profile=profile)
+
+        fingerprint = self.fingerprint(posts)
+        if profile.analysis and profile.analysis_fingerprint == fingerprint:
+            self.stats["cached"] += 1
+            return CompetitorCheck(username, CACHED, fingerprint, posts=posts, profile=profile)
+
+        boundary = self._fingerprint_time(profile.analysis_fingerprint)
+        if profile.analysis and boundary is not None:
+            new_posts = [post for post in posts if post.published_at > boundary]
+            # Снимок изменился без новых постов (например, догрузили историю) - полный анализ
+            if new_posts:
+                self.stats["changes"] += 1
+                return CompetitorCheck(
+                    username,
+                    CHANGES,
+                    fingerprint,
+                    data=await asyncio.to_thread(self._changes_data, username, posts, new_posts, boundary, profile),
+                    posts=posts,
+                    new_posts=new_posts,
+                    profile=profile,
+                )
+
+        self.stats["full"] += 1
+        # Сводка по тысячам постов считается вне event loop
+        data = await asyncio.to_thread(self._full_data, username, posts)
+        return CompetitorCheck(username, FULL, fingerprint, data=data, posts=posts, profile=profile)
+
+    def _full_data(self, username: str, posts: List[Post]) -> str:
+        # NumPy грузится при первом анализе, а не на холодном старте
+        from app.utils.analytics import PostTable, format_summary, summarize
+
+        table = PostTable.from_posts(posts)
+        return (
+            f"📊 ПРОФИЛЬ: @{username} ({self.provider.name})\n"
+            f"Постов в снимке: {len(posts)}, "
+            f"с {_format_time(posts[-1].published_at)} по {_format_time(posts[0].published_at)}\n\n"
+            f"{format_summary(summarize(table, time.time()))}"
+        )
+
+    def _changes_data(
+        self,
+        username: str,
+        posts: List[Post],
+        new_posts: List[Post],
+        boundary: float,
+        profile: CompetitorProfile,
+    ) -> str:
+        from app.utils.analytics import PostTable, format_summary, summarize
+
+        table = PostTable.from_posts(posts)
+        is_new = table.published > boundary
+        now = time.time()
+        previous = summarize(table.select(~is_new), now) if not is_new.all() else None
+        return (
+            f"📊 ПРОФИЛЬ: @{username} ({self.provider.name})\n"
+            f"Прошлый анализ: {_format_time(profile.analyzed_at)}\n"
+            f"Новых постов: {len(new_posts)}\n\n"
+            f"ПРОШЛЫЙ АНАЛИЗ (кратко):\n{profile.analysis[:1500]}\n\n"
+            f"НОВЫЕ ПОСТЫ, СВОДКА (в скобках - до них):\n"
+            f"{format_summary(summarize(table.select(is_new), now), previous)}\n\n"
+            f"НОВЫЕ ПОСТЫ (дата | формат | реакции | текст):\n{format_posts(new_posts)}"
+        )
+
+    async def save(self, check: CompetitorCheck, response: str):
+        """Сохранение ответа Claude: полный анализ или отчет об изменениях"""
+        if check.kind == FULL:
+            await self.store.save_analysis(check.username, check.fingerprint, analysis=response)
+        elif check.kind == CHANGES:
+            await self.store.save_analysis(check.username, check.fingerprint, changes=response)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "provider": self.provider.name}
+
+    async def close(self):
+        await self.provider.close()
+        self.store.close()
+
+
+from app.config import settings
+
+# Singleton экземпляр
+competitor_service = CompetitorService(
+    build_provider(
+        settings.COMPETITOR_PROVIDER,
+        settings.COMPETITOR_REDDIT_URL,
+        settings.COMPETITOR_FEED_URL,
+        settings.COMPETITOR_FIXTURES_DIR,
+        settings.COMPETITOR_FETCH_TIMEOUT,
+    ),
+    CompetitorStore(settings.COMPETITOR_DB_PATH),
+    max_posts=settings.COMPETITOR_MAX_POSTS,
+)
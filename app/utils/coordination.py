@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Исходы проверки задачи Claude (см. ClaudeJobMiddleware)
+RUNNING = "running"
+ANSWERED = "answered"
+USER_LIMIT = "user_limit"
+
+
+def shared_key(*parts) -> str:
+    """Ключ строки в общей базе: одинаковый во всех процессах"""
+    return hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class WorkerCoordinator:
+    """
+    Состояние, общее для воркеров uvicorn одного хоста (SQLite в режиме WAL).
+
+    Вебхук Telegram попадает в случайный воркер, поэтому память процесса
+    не видит ни повторную доставку апдейта, ни параллельный апдейт того же
+    чата в соседнем воркере. Здесь хранятся:
+    - взятые в обработку апдейты - повтор отбрасывается в любом воркере;
+    - аренда чата - апдейты одного чата обрабатывает один процесс за раз,
+      аренда продлевается, пока идет обработка, и истекает, если процесс умер;
+    - задачи Claude - дубликаты и лимит на пользователя считаются по всем
+      воркерам.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        lease_ttl: float = 60,
+        poll_interval: float = 0.05,
+        job_ttl: float = 600,
+        retention: float = 3600,
+        purge_every: int = 500,
+    ):
+        self.db_path = db_path
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.job_ttl = job_ttl
+        self.retention = retention
+        self.purge_every = purge_every
+        self.owner = str(os.getpid())
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self.stats = {
+            "claimed": 0,
+            "duplicates": 0,
+            "lease_waits": 0,
+        }
+
+    # --- SQLite (вызывается из пула потоков) ---
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Транзакции - явные: проверка и запись должны идти под одной блокировкой
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS updates (key TEXT PRIMARY KEY, claimed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_leases ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS claude_jobs ("
+                "key TEXT PRIMARY KEY, user TEXT NOT NULL, started_at REAL NOT NULL, finished_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS claude_jobs_user ON claude_jobs (user)")
+        return self._conn
+
+    def _write(self, fn, *args):
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, time.time(), *args)
+                self._writes += 1
+                if self._writes % self.purge_every == 0:
+                    self._purge(conn, time.time())
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _purge(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM updates WHERE claimed_at < ?", (now - self.retention,))
+        conn.execute("DELETE FROM chat_leases WHERE expires_at < ?", (now,))
+        conn.execute(
+            "DELETE FROM claude_jobs WHERE COALESCE(finished_at, started_at + ?) < ?",
+            (self.job_ttl, now - self.retention),
+        )
+
+    @staticmethod
+    def _claim_update_tx(conn: sqlite3.Connection, now: float, key: str) -> bool:
+        cursor = conn.execute("INSERT OR IGNORE INTO updates (key, claimed_at) VALUES (?, ?)", (key, now))
+        return cursor.rowcount == 1
+
+    def _acquire_chat_tx(self, conn: sqlite3.Connection, now: float, key: str) -> bool:
+        conn.execute(
+            "DELETE FROM chat_leases WHERE key = ? AND (expires_at < ? OR owner = ?)",
+            (key, now, self.owner),
+        )
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO chat_leases (key, owner, expires_at) VALUES (?, ?, ?)",
+            (key, self.owner, now + self.lease_ttl),
+        )
+        return cursor.rowcount == 1
+
+    def _renew_chat_tx(self, conn: sqlite3.Connection, now: float, key: str):
+        conn.execute(
+            "UPDATE chat_leases SET expires_at = ? WHERE key = ? AND owner = ?",
+            (now + self.lease_ttl, key, self.owner),
+        )
+
+    def _release_chat_tx(self, conn: sqlite3.Connection, now: float, key: str):
+        conn.execute("DELETE FROM chat_leases WHERE key = ? AND owner = ?", (key, self.owner))
+
+    def _start_job_tx(
+        self,
+        conn: sqlite3.Connection,
+        now: float,
+        key: str,
+        user: str,
+        per_user: int,
+        arrived: Optional[float],
+    ) -> Optional[str]:
+        row = conn.execute("SELECT started_at, finished_at FROM claude_jobs WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            started_at, finished_at = row
+            if finished_at is None and started_at + self.job_ttl > now:
+                return RUNNING
+            # Повтор, отправленный, пока первый запрос выполнялся
+            if finished_at is not None and arrived is not None and arrived < finished_at:
+                return ANSWERED
+        running = conn.execute(
+            "SELECT COUNT(*) FROM claude_jobs WHERE user = ? AND finished_at IS NULL AND started_at > ?",
+            (user, now - self.job_ttl),
+        ).fetchone()[0]
+        if running >= per_user:
+            return USER_LIMIT
+        conn.execute(
+            "INSERT INTO claude_jobs (key, user, started_at, finished_at) VALUES (?, ?, ?, NULL) "
+            "ON CONFLICT(key) DO UPDATE SET started_at = excluded.started_at, finished_at = NULL",
+            (key, user, now),
+        )
+        return None
+
+    @staticmethod
+    def _cancel_job_tx(conn: sqlite3.Connection, now: float, key: str):
+        conn.execute("DELETE FROM claude_jobs WHERE key = ? AND finished_at IS NULL", (key,))
+
+    @staticmethod
+    def _finish_job_tx(conn: sqlite3.Connection, now: float, key: str):
+        conn.execute("UPDATE claude_jobs SET finished_at = ? WHERE key = ?", (now, key))
+
+    # --- Публичный API ---
+
+    async def claim_update(self, key: str) -> bool:
+        """True - апдейт еще никто не брал; False - повторная доставка"""
+        claimed = await asyncio.to_thread(self._write, self._claim_update_tx, key)
+        self.stats["claimed" if claimed else "duplicates"] += 1
+        return claimed
+
+    async def _renew(self, key: str):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await asyncio.to_thread(self._write, self._renew_chat_tx, key)
+            except Exception as e:
+                logger.warning(f"Chat lease renewal failed: {e}")
+
+    @asynccontextmanager
+    async def chat(self, key: str):
+        """Аренда чата на время обработки его апдейтов"""
+        waited = False
+        while not await asyncio.to_thread(self._write, self._acquire_chat_tx, key):
+            if not waited:
+                waited = True
+                self.stats["lease_waits"] += 1
+            await asyncio.sleep(self.poll_interval)
+
+        renewal = asyncio.create_task(self._renew(key))
+        try:
+            yield
+        finally:
+            renewal.cancel()
+            try:
+                await asyncio.to_thread(self._write, self._release_chat_tx, key)
+            except Exception as e:
+                # Аренда истечет сама через lease_ttl
+                logger.warning(f"Chat lease release failed: {e}")
+
+    async def start_job(self, key: str, user: str, per_user: int, arrived: Optional[float]) -> Optional[str]:
+        """Регистрация задачи Claude; исход RUNNING/ANSWERED/USER_LIMIT или None - можно начинать"""
+        return await asyncio.to_thread(self._write, self._start_job_tx, key, user, per_user, arrived)
+
+    async def finish_job(self, key: str):
+        await asyncio.to_thread(self._write, self._finish_job_tx, key)
+
+    async def cancel_job(self, key: str):
+        """Задача не началась (отказ лимитера или квоты) - повтор не считается дубликатом"""
+        await asyncio.to_thread(self._write, self._cancel_job_tx, key)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "owner": self.owner}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+from app.config import settings
+
+# Singleton экземпляр: общее состояние нужно, только если воркеров несколько
+worker_coordinator = (
+    WorkerCoordinator(settings.COORDINATION_DB_PATH, lease_ttl=settings.CHAT_LEASE_TTL)
+    if settings.WORKERS > 1 else None
+)
@@ -0,0 +1,372 @@
+import asyncio
+import logging
+import re
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import pytz
+
+from app.utils.formatter import format_daily_notification
+from app.utils.ratelimit import SCHEDULED, priority_class
+from app.utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+TIME_RE = re.compile(r"^(\d{1,2})[:.](\d{2})$")
+OFFSET_RE = re.compile(r"^(?:UTC|GMT)?\s*([+-])(\d{1,2})(?::?(\d{2}))?$", re.IGNORECASE)
+TIMEZONE_ALIASES = {"мск": "Europe/Moscow", "msk": "Europe/Moscow", "utc": "UTC", "gmt": "UTC"}
+
+
+def parse_delivery_time(value: str) -> Optional[str]:
+    """"9:30" / "09.30" -> "09:30"; None, если это не время суток"""
+    match = TIME_RE.match(value.strip())
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+@lru_cache(maxsize=1)
+def _timezone_names() -> Dict[str, str]:
+    return {name.lower(): name for name in pytz.all_timezones}
+
+
+def parse_timezone(value: str) -> Optional[str]:
+    """
+    Название пояса в каноническом виде: IANA ("europe/berlin" ->
+    "Europe/Berlin"), смещение ("+3", "UTC+05:30" -> "UTC+05:30") или
+    псевдоним ("МСК"). None, если пояс не распознан.
+    """
+    value = value.strip()
+    match = OFFSET_RE.match(value)
+    if match:
+        sign, hours, minutes = match.group(1), int(match.group(2)), int(match.group(3) or 0)
+        if minutes > 59 or hours * 60 + minutes > 14 * 60:
+            return None
+        return f"UTC{sign}{hours:02d}:{minutes:02d}"
+    return TIMEZONE_ALIASES.get(value.lower()) or _timezone_names().get(value.lower())
+
+
+@lru_cache(maxsize=1024)
+def resolve_timezone(name: Optional[str]):
+    """tzinfo по названию из parse_timezone; None для неизвестного пояса"""
+    if not name:
+        return None
+    match = OFFSET_RE.match(name)
+    if match:
+        minutes = int(match.group(2)) * 60 + int(match.group(3) or 0)
+        return pytz.FixedOffset(minutes if match.group(1) == "+" else -minutes)
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        return None
+
+
+def format_slot(slot: int, separator: str = ":") -> str:
+    return f"{slot // 60:02d}{separator}{slot % 60:02d}"
+
+
+def parse_slot(value: str) -> int:
+    """"0930" -> 570 (минута суток)"""
+    if len(value) != 4 or not value.isdigit():
+        raise ValueError(f"Bad slot: {value}")
+    return int(value[:2]) * 60 + int(value[2:])
+
+
+class DeliveryPlanner:
+    """
+    Раскладка подписчиков по слотам доставки.
+
+    Слот - минута суток по UTC, округленная вниз до slot_minutes. Локальное
+    время и пояс подписчика переводятся в UTC на конкретную дату, поэтому
+    переход на летнее время сдвигает подписчика в соседний слот.
+    """
+
+    def __init__(self, default_time: str = "09:00", default_timezone: str = "UTC", slot_minutes: int = 15):
+        self.default_time = parse_delivery_time(default_time) or "09:00"
+        self.default_timezone = default_timezone
+        self.slot_minutes = max(1, min(slot_minutes, 60))
+
+    def delivery_time(self, sub) -> str:
+        return sub.delivery_time or self.default_time
+
+    def timezone(self, sub) -> str:
+        return sub.timezone or self.default_timezone
+
+    def _tzinfo(self, name: Optional[str]):
+        return resolve_timezone(name) or resolve_timezone(self.default_timezone) or pytz.UTC
+
+    def slot(self, delivery_time: str, timezone: Optional[str], day: date) -> int:
+        hour, minute = map(int, delivery_time.split(":"))
+        local = self._tzinfo(timezone).localize(datetime(day.year, day.month, day.day, hour, minute))
+        utc = local.astimezone(pytz.UTC)
+        minutes = utc.hour * 60 + utc.minute
+        return minutes - minutes % self.slot_minutes
+
+    def local_time(self, sub, day: date) -> str:
+        """Фактическое локальное время доставки с учетом округления до слота"""
+        slot = self.slot(self.delivery_time(sub), sub.timezone, day)
+        utc = pytz.UTC.localize(datetime(day.year, day.month, day.day, slot // 60, slot % 60))
+        return utc.astimezone(self._tzinfo(sub.timezone)).strftime("%H:%M")
+
+    def shards(self, subscribers: Iterable, day: date) -> Dict[int, List[int]]:
+        """Слот -> user_id; перевод в UTC считается раз на пару (время, пояс)"""
+        slots: Dict[tuple, int] = {}
+        shards: Dict[int, List[int]] = defaultdict(list)
+        for sub in subscribers:
+            key = (self.delivery_time(sub), sub.timezone)
+            slot = slots.get(key)
+            if slot is None:
+                slot = slots[key] = self.slot(key[0], key[1], day)
+            shards[slot].append(sub.user_id)
+        return dict(shards)
+
+
+class DailyDelivery:
+    """
+    Ежедневная рассылка по шардам.
+
+    Подписчики делятся на шарды по слоту доставки, на каждый шард - своя
+    задача планировщика. Текст выпуска готовится за lead_time до первого
+    шарда дня и сохраняется, поэтому шард начинает отправку в свою минуту,
+    а не после ответа Claude. Задача sync раз в sync_interval перечитывает
+    подписчиков и приводит набор задач к текущей раскладке.
+
+    У бота-арендатора (tenant) задачи планировщика получают префикс
+    с его именем: планировщик общий для всех ботов процесса.
+    """
+
+    RUN_PREFIX = "daily-"
+    SHARD_JOB_PREFIX = "daily_slot_"
+    PREPARE_JOB_ID = "daily_prepare"
+    SYNC_JOB_ID = "daily_shards"
+
+    def __init__(
+        self,
+        planner: DeliveryPlanner,
+        subscribers,
+        broadcast,
+        claude,
+        lead_time: float = 600,
+        sync_interval: float = 600,
+        tenant: Optional[str] = None,
+    ):
+        self.planner = planner
+        self.subscribers = subscribers
+        self.broadcast = broadcast
+        self.claude = claude
+        self.lead_time = lead_time
+        self.sync_interval = sync_interval
+        self.tenant = tenant
+
+        namespace = f"{tenant}:" if tenant else ""
+        self.shard_job_prefix = f"{namespace}{self.SHARD_JOB_PREFIX}"
+        self.prepare_job_id = f"{namespace}{self.PREPARE_JOB_ID}"
+        self.sync_job_id = f"{namespace}{self.SYNC_JOB_ID}"
+
+        self._scheduler = None
+        self._send: Optional[Callable[[int, str], Awaitable[None]]] = None
+        self._prepare_at: Optional[int] = None
+        # Шарды делят лимит Telegram: затянувшийся шард и следующий идут по очереди
+        self._sending = asyncio.Lock()
+        self.flight = SingleFlight(f"{namespace}daily")
+        self.shard_sizes: Dict[int, int] = {}
+
+        self.stats = {
+            "prepared": 0,
+            "generated_late": 0,
+            "shards_run": 0,
+            "failures": 0,
+        }
+
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.now(pytz.UTC)
+
+    def _for(self) -> str:
+        return f" for {self.tenant}" if self.tenant else ""
+
+    def run_id(self, day: date, slot: int) -> str:
+        return f"{self.RUN_PREFIX}{day.isoformat()}-{format_slot(slot, '')}"
+
+    def edition_id(self, day: date) -> str:
+        return f"{self.RUN_PREFIX}{day.isoformat()}"
+
+    def schedule(self, scheduler, send: Callable[[int, str], Awaitable[None]]):
+        """Регистрация в NotificationScheduler; задачи шардов создает sync"""
+        self._scheduler = scheduler
+        self._send = send
+        scheduler.add_interval_job(self.sync, self.sync_interval, self.sync_job_id, run_now=True)
+
+    async def sync(self):
+        try:
+            await self.subscribers.reload()
+            now = self._now()
+            receivers = [sub for batch in self.subscribers.iter_batches() for sub in batch]
+            shards = self.planner.shards(receivers, now.date())
+            self.shard_sizes = {slot: len(user_ids) for slot, user_ids in sorted(shards.items())}
+            self._sync_jobs(shards)
+
+            # Старт посреди дня: до ближайшего шарда меньше lead_time, а выпуска еще нет
+            minute = now.hour * 60 + now.minute
+            if shards and min((slot - minute) % 1440 for slot in shards) * 60 <= self.lead_time:
+                await self.prepare()
+        except Exception as e:
+            self.stats["failures"] += 1
+            logger.error(f"Daily delivery sync failed{self._for()}: {e}")
+
+    def _sync_jobs(self, shards: Dict[int, List[int]]):
+        wanted = {f"{self.shard_job_prefix}{format_slot(slot, '')}": slot for slot in shards}
+        existing = set(self._scheduler.job_ids(self.shard_job_prefix))
+        for job_id in existing - set(wanted):
+            self._scheduler.remove_job(job_id)
+        for job_id, slot in wanted.items():
+            if job_id not in existing:
+                self._scheduler.add_daily_job(
+                    self.deliver,
+                    format_slot(slot),
+                    job_id=job_id,
+                    timezone=pytz.UTC,
+                    args=(slot,),
+                    misfire_grace_time=int(self.sync_interval),
+                )
+
+        prepare_at = None
+        if shards:
+            lead_minutes = -(-int(self.lead_time) // 60)
+            prepare_at = (min(shards) - lead_minutes) % 1440
+        if prepare_at == self._prepare_at:
+            return
+        if prepare_at is None:
+            self._scheduler.remove_job(self.prepare_job_id)
+        else:
+            self._scheduler.add_daily_job(
+                self.prepare,
+                format_slot(prepare_at),
+                job_id=self.prepare_job_id,
+                timezone=pytz.UTC,
+                misfire_grace_time=int(self.lead_time),
+            )
+        self._prepare_at = prepare_at
+
+    async def edition(self, day: date) -> Optional[str]:
+        """Текст выпуска на день: сохраненный или сгенерированный сейчас"""
+        edition = self.edition_id(day)
+        text = await self.broadcast.edition(edition)
+        if text is not None:
+            return text
+        return await self.flight.do(edition, lambda: self._generate(edition))
+
+    async def _generate(self, edition: str) -> Optional[str]:
+        # Рассылка уступает очередь запросам пользователей
+        with priority_class(SCHEDULED):
+            content = await self.claude.generate_daily_content()
+        if not content:
+            self.stats["failures"] += 1
+            logger.error(f"Daily content for {edition}{self._for()} was not generated")
+            return None
+        return await self.broadcast.save_edition(edition, format_daily_notification(content))
+
+    async def prepare(self):
+        """Заготовка выпуска для ближайшего шарда"""
+        day = (self._now() + timedelta(seconds=self.lead_time)).date()
+        if await self.broadcast.edition(self.edition_id(day)) is not None:
+            return
+        started = time.monotonic()
+        if await self.edition(day):
+            self.stats["prepared"] += 1
+            logger.info(f"Daily edition {day}{self._for()} prepared in {time.monotonic() - started:.1f}s")
+
+    async def deliver(self, slot: int, day: Optional[date] = None, resume_only: bool = False):
+        """Отправка одного шарда (или продолжение прерванной)"""
+        if day is None:
+            # Последнее наступление слота: запуск мог опоздать за полночь
+            now = self._now()
+            minute = now.hour * 60 + now.minute
+            day = (now - timedelta(minutes=(minute - slot) % 1440)).date()
+        run_id = self.run_id(day, slot)
+
+        try:
+            if await self.broadcast.is_finished(run_id):
+                return
+            # Прерванный прогон продолжаем с тем же текстом
+            text = await self.broadcast.pending_content(run_id)
+            if text is None and resume_only:
+                return
+
+            # Подписки могли меняться в других воркерах
+            await self.subscribers.reload()
+            receivers = [sub for batch in self.subscribers.iter_batches() for sub in batch]
+            user_ids = self.planner.shards(receivers, day).get(slot, [])
+            # Сменившие время после доставки не получают выпуск второй раз
+            delivered = await self.broadcast.delivered(f"{self.edition_id(day)}-")
+            user_ids = [user_id for user_id in user_ids if user_id not in delivered]
+            if not user_ids and text is None:
+                return
+
+            if text is None:
+                if await self.broadcast.edition(self.edition_id(day)) is None:
+                    self.stats["generated_late"] += 1
+                text = await self.edition(day)
+                if not text:
+                    return
+
+            logger.info(f"Daily shard {format_slot(slot)} UTC{self._for()}: {len(user_ids)} users")
+            async with self._sending:
+                await self.broadcast.run(
+                    run_id,
+                    text,
+                    user_ids,
+                    self._send,
+                    on_blocked=self.subscribers.mark_blocked,
+                )
+            self.stats["shards_run"] += 1
+        except Exception as e:
+            self.stats["failures"] += 1
+            logger.error(f"Daily shard {run_id}{self._for()} failed: {e}")
+
+    async def resume(self):
+        """Досылка шардов, прерванных падением процесса за последние сутки"""
+        for run_id in await self.broadcast.unfinished(self.RUN_PREFIX, time.time() - 86400):
+            try:
+                day, slot = run_id[len(self.RUN_PREFIX):].rsplit("-", 1)
+                await self.deliver(parse_slot(slot), date.fromisoformat(day), resume_only=True)
+            except ValueError:
+                continue
+
+    def get_stats(self) -> dict:
+        sizes = self.shard_sizes
+        return {
+            **self.stats,
+            "shards": len(sizes),
+            "subscribers": sum(sizes.values()),
+            "largest_shard": max(sizes.values()) if sizes else 0,
+            "slots_utc": {format_slot(slot): size for slot, size in sizes.items()},
+            "prepare_at_utc": format_slot(self._prepare_at) if self._prepare_at is not None else None,
+        }
+
+
+from app.config import settings
+from app.claude_api import claude_api
+from app.utils.broadcast import broadcast_engine
+from app.utils.subscribers import subscriber_store
+
+# Singleton экземпляры
+delivery_planner = DeliveryPlanner(
+    settings.NOTIFICATION_TIME,
+    settings.TIMEZONE,
+    slot_minutes=settings.NOTIFICATION_SLOT_MINUTES,
+)
+daily_delivery = DailyDelivery(
+    delivery_planner,
+    subscriber_store,
+    broadcast_engine,
+    claude_api,
+    lead_time=settings.NOTIFICATION_LEAD_TIME,
+    sync_interval=settings.NOTIFICATION_SYNC_INTERVAL,
+)
@@ -1,4 +1,16 @@
-from typing import Optional
+import html
+import re
+from typing import List, Optional
+
+# Лимит Telegram - 4096 символов; запас под закрывающие теги страницы
+TELEGRAM_LIMIT = 4000
+
+TREND_HEADER = "🔥 <b>АНАЛИЗ ТРЕНДОВ ДЛЯ 3D-ХУДОЖНИКА</b>\n\n"
+COPY_HEADER = "✍️ <b>ВАРИАНТЫ ТЕКСТА</b>\n\n"
+COMPETITOR_HEADER = "🔎 <b>АНАЛИЗ КОНКУРЕНТА</b>\n\n"
+DAILY_HEADER = "🌅 <b>ДОБРОЕ УТРО, 3D-ХУДОЖНИК!</b>\n\n"
+
+TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^<>]*>")
 
 
 def format_trend_response(claude_response: Optional[str]) -> str:
@@ -6,7 +18,7 @@ def format_trend_response(claude_response: Optional[str]) -> str:
     if not claude_response:
         return "❌ Ошибка при анализе трендов. Попробуйте позже."
     
-    return f"🔥 <b>АНАЛИЗ ТРЕНДОВ ДЛЯ 3D-ХУДОЖНИКА</b>\n\n{claude_response}"
+    return f"{TREND_HEADER}{claude_response}"
 
 
 def format_copy_response(claude_response: Optional[str]) -> str:
@@ -14,7 +26,7 @@ def format_copy_response(claude_response: Optional[str]) -> str:
     if not claude_response:
         return "❌ Ошибка при обработке текста. Попробуйте позже."
     
-    return f"✍️ <b>ВАРИАНТЫ ТЕКСТА</b>\n\n{claude_response}"
+    return f"{COPY_HEADER}{claude_response}"
 
 
 def format_competitor_response(claude_response: Optional[str]) -> str:
@@ -22,7 +34,7 @@ def format_competitor_response(claude_response: Optional[str]) -> str:
     if not claude_response:
         return "❌ Ошибка при анализе конкурента. Попробуйте позже."
     
-    return f"🔎 <b>АНАЛИЗ КОНКУРЕНТА</b>\n\n{claude_response}"
+    return f"{COMPETITOR_HEADER}{claude_response}"
 
 
 def format_daily_notification(claude_response: Optional[str]) -> str:
@@ -30,21 +42,95 @@ def format_daily_notification(claude_response: Optional[str]) -> str:
     if not claude_response:
         return "❌ Ошибка при генерации контента."
     
-    return f"🌅 <b>ДОБРОЕ УТРО, 3D-ХУДОЖНИК!</b>\n\n{claude_response}"
+    return f"{DAILY_HEADER}{claude_response}"
+
+
+def strip_tags(text: str) -> str:
+    """Текст без HTML-разметки - на случай, если Telegram ее не принял"""
+    return html.unescape(TAG_RE.sub("", text))
+
+
+def _open_tags(text: str) -> List[tuple]:
+    """Незакрытые теги в конце текста: (имя, открывающий тег)"""
+    stack = []
+    for match in TAG_RE.finditer(text):
+        name = match.group(2).lower()
+        if not match.group(1):
+            stack.append((name, match.group(0)))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                del stack[i:]
+                break
+    return stack
+
 
+def _closing(open_tags: List[tuple]) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(open_tags))
 
-def truncate_text(text: str, max_length: int = 4000) -> str:
+
+def close_tags(text: str) -> str:
+    """Оборванный HTML: без недописанного тега в конце и с закрытыми тегами"""
+    tag_start = text.rfind("<")
+    if tag_start > text.rfind(">"):
+        text = text[:tag_start]
+    return text + _closing(_open_tags(text))
+
+
+def _split_point(text: str, budget: int) -> int:
     """
-    Обрезка текста до максимальной длины (лимит Telegram)
-    
-    Args:
-        text: Исходный текст
-        max_length: Максимальная длина
+    Где резать страницу: по границе раздела (пустая строка), иначе по
+    строке, иначе по пробелу - и никогда внутри тега или сущности.
+    """
+    cut = budget
+    for separator in ("\n\n", "\n", " "):
+        index = text.rfind(separator, budget // 2, budget)
+        if index > 0:
+            cut = index
+            break
     
-    Returns:
-        Обрезанный текст
+    # Не разрываем <b ...> и &amp;
+    tag_start = text.rfind("<", 0, cut)
+    if tag_start > text.rfind(">", 0, cut):
+        cut = tag_start
+    entity_start = text.rfind("&", 0, cut)
+    if entity_start >= 0 and ";" not in text[entity_start:cut] and cut - entity_start < 10:
+        cut = entity_start
+    # Тег длиннее страницы целиком не сохранить - режем как есть
+    return cut if cut > 0 else budget
+
+
+def paginate(text: str, limit: int = TELEGRAM_LIMIT) -> List[str]:
     """
-    if len(text) <= max_length:
-        return text
+    Разбивка длинного HTML-ответа на страницы не длиннее limit.
     
-    return text[:max_length - 100] + "\n\n... (текст обрезан из-за лимита Telegram)"
+    Теги, открытые на границе страницы, закрываются в ее конце и снова
+    открываются в начале следующей, поэтому каждая страница - валидный HTML.
+    Если переоткрытые теги занимают больше половины страницы, продолжение
+    идет без них. Каждая страница съедает хотя бы символ текста, так что
+    разбивка всегда заканчивается.
+    """
+    pages = []
+    prefix = ""
+    while len(prefix) + len(text) > limit:
+        if 2 * (len(prefix) + len(_closing(_open_tags(prefix)))) > limit:
+            prefix = ""
+        budget = limit - len(prefix) - len(_closing(_open_tags(prefix)))
+        while True:
+            cut = _split_point(text, budget)
+            open_tags = _open_tags(prefix + text[:cut])
+            page = (prefix + text[:cut]).rstrip() + _closing(open_tags)
+            if len(page) <= limit or budget == 1:
+                break
+            # На странице открылись новые теги - им тоже нужно место
+            budget = max(1, budget - (len(page) - limit))
+        if len(page) > limit:
+            # Разметка не помещается ни при каком разрезе - режем без нее
+            cut, open_tags = limit, []
+            page = text[:cut]
+        pages.append(page)
+        text = text[cut:].lstrip()
+        prefix = "".join(tag for _, tag in open_tags)
+    if text or not pages:
+        pages.append(prefix + text)
+    return pages
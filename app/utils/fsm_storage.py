@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в SQLite, общее для всех воркеров на одном хосте.
+
+    Состояния живут не дольше ttl секунд с последнего изменения:
+    брошенный диалог копирайтера не висит в памяти вечно.
+    """
+
+    def __init__(self, db_path: str, ttl: float = 3600, purge_every: int = 200):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.purge_every = purge_every
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.destiny}"
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', "
+                "expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _read_sync(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT state, data, expires_at FROM fsm WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[2] <= time.time():
+            return None
+        return row
+
+    def _write_sync(self, key: str, column: str, value: Optional[str]):
+        with self._lock:
+            conn = self._db()
+            with conn:
+                # Просроченная строка начинается с чистого листа
+                conn.execute("DELETE FROM fsm WHERE key = ? AND expires_at <= ?", (key, time.time()))
+                conn.execute(
+                    f"INSERT INTO fsm (key, {column}, expires_at) VALUES (?, ?, ?) "
+                    f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, "
+                    "expires_at = excluded.expires_at",
+                    (key, value, time.time() + self.ttl),
+                )
+                self._writes += 1
+                if self._writes % self.purge_every == 0:
+                    conn.execute("DELETE FROM fsm WHERE expires_at <= ?", (time.time(),))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(self._write_sync, self._key(key), "state", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await asyncio.to_thread(self._read_sync, self._key(key))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        payload = json.dumps(data, ensure_ascii=False)
+        await asyncio.to_thread(self._write_sync, self._key(key), "data", payload)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await asyncio.to_thread(self._read_sync, self._key(key))
+        return json.loads(row[1]) if row else {}
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def build_fsm_storage(backend: str, db_path: str, ttl: float, redis_url: Optional[str] = None) -> BaseStorage:
+    """
+    FSM-хранилище по настройке FSM_STORAGE
+
+    memory - только для одного процесса, sqlite - общее для воркеров
+    одного хоста, redis - для нескольких хостов (нужен пакет redis).
+    """
+    if backend == "redis" and redis_url:
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            logger.error("FSM_STORAGE=redis requires the redis package, falling back to sqlite")
+        else:
+            return RedisStorage.from_url(redis_url, state_ttl=int(ttl), data_ttl=int(ttl))
+
+    if backend == "memory":
+        return MemoryStorage()
+
+    return SQLiteStorage(db_path, ttl=ttl)
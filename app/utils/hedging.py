@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from app.utils.metrics import CLAUDE_HEDGES
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class HedgePolicy:
+    """
+    Когда отправлять страхующий запрос.
+
+    Порог - перцентиль времени до первого токена (или до ответа целиком)
+    по последним запросам задачи; пока замеров меньше min_samples, порога
+    нет и страховки тоже. Доля застрахованных запросов в скользящем окне
+    не превышает max_rate - хеджирование не удваивает нагрузку на API.
+    Пока лимитер держит очередь, страховки нет: задержка - это ожидание
+    слота, и второй запрос встал бы в ту же очередь.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        max_rate: float = 0.1,
+        min_samples: int = 20,
+        min_delay: float = 1.0,
+        window: int = 500,
+    ):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+
+        self._latencies: Dict[str, deque] = {}
+        self._hedged: Dict[str, deque] = {}
+        self.outcomes: Dict[str, Dict[str, int]] = {}
+
+    def observe(self, key: str, seconds: float):
+        self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def threshold(self, key: str) -> Optional[float]:
+        samples = self._latencies.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def _history(self, key: str) -> deque:
+        return self._hedged.setdefault(key, deque(maxlen=self.window))
+
+    def allow(self, key: str) -> bool:
+        history = self._history(key)
+        # Окно не меньше min_samples: иначе первые же запросы упираются в лимит
+        return sum(history) + 1 <= self.max_rate * max(len(history) + 1, self.min_samples)
+
+    def record(self, key: str, outcome: str, hedged: bool):
+        self._history(key).append(1 if hedged else 0)
+        counts = self.outcomes.setdefault(key, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+        task, _, mode = key.partition(":")
+        CLAUDE_HEDGES.inc(task=task, mode=mode, outcome=outcome)
+
+    def get_stats(self) -> dict:
+        stats = {}
+        for key in set(self._latencies) | set(self.outcomes):
+            history = self._hedged.get(key) or ()
+            threshold = self.threshold(key)
+            stats[key] = {
+                "samples": len(self._latencies.get(key) or ()),
+                "threshold": round(threshold, 3) if threshold is not None else None,
+                "hedge_rate": round(sum(history) / len(history), 3) if history else 0.0,
+                "outcomes": dict(self.outcomes.get(key, {})),
+            }
+        return stats
+
+
+async def _pump(factory: Callable[[], AsyncIterator[str]], queue: asyncio.Queue):
+    iterator = factory()
+    try:
+        async for chunk in iterator:
+            queue.put_nowait(chunk)
+    except Exception as e:
+        logger.error(f"Hedged request failed: {e}")
+        # Обрыв после текста доходит до читателя; до текста - просто выбывание
+        queue.put_nowait(e)
+    finally:
+        try:
+            # Отмена проигравшего закрывает его HTTP-ответ и слот в лимитере
+            await iterator.aclose()
+        finally:
+            queue.put_nowait(_DONE)
+
+
+def _text_or_done(chunk):
+    # Ошибка вместо первого фрагмента - запрос выбыл, не дав текста
+    return _DONE if isinstance(chunk, Exception) else chunk
+
+
+def _single(factory: Callable[[], Awaitable[Optional[str]]]) -> Callable[[], AsyncIterator[str]]:
+    async def iterate():
+        text = await factory()
+        if text:
+            yield text
+    return iterate
+
+
+async def hedged_stream(
+    key: str,
+    primary: Callable[[], AsyncIterator[str]],
+    backup: Optional[Callable[[], AsyncIterator[str]]],
+    policy: HedgePolicy,
+    saturated: Optional[Callable[[], bool]] = None,
+    on_winner: Optional[Callable[[str], None]] = None,
+) -> AsyncIterator[str]:
+    """
+    Поток основного запроса со страховкой.
+
+    Если основной запрос не выдал первый фрагмент за порог политики,
+    параллельно стартует backup; дальше читается тот, кто ответил первым,
+    а второй отменяется. saturated() - есть ли очередь к лимитеру: тогда
+    страховка не стартует, а время ответа не учит порог. on_winner
+    получает имя победителя ("primary" или "backup").
+    """
+    started = time.monotonic()
+    queues = {"primary": asyncio.Queue()}
+    pumps = {"primary": asyncio.create_task(_pump(primary, queues["primary"]))}
+    getters: Dict[str, asyncio.Task] = {}
+    queued = saturated is not None and saturated()
+    threshold = policy.threshold(key) if backup is not None and not queued else None
+    winner = None
+    first = _DONE
+
+    try:
+        getters["primary"] = asyncio.create_task(queues["primary"].get())
+        done, _ = await asyncio.wait({getters["primary"]}, timeout=threshold)
+
+        if done:
+            winner, first = "primary", _text_or_done(getters.pop("primary").result())
+            if backup is None:
+                outcome = "off"
+            elif queued:
+                outcome = "queued"
+            else:
+                outcome = "fast" if threshold is not None else "cold"
+            policy.record(key, outcome, hedged=False)
+        elif saturated is not None and saturated():
+            # Очередь выросла, пока ждали: основной запрос, скорее всего, в ней
+            queued = True
+            winner, first = "primary", _text_or_done(await getters.pop("primary"))
+            policy.record(key, "queued", hedged=False)
+        elif not policy.allow(key):
+            winner, first = "primary", _text_or_done(await getters.pop("primary"))
+            policy.record(key, "capped", hedged=False)
+        else:
+            logger.info(f"Hedging {key}: no first token after {threshold:.2f}s")
+            queues["backup"] = asyncio.Queue()
+            pumps["backup"] = asyncio.create_task(_pump(backup, queues["backup"]))
+            getters["backup"] = asyncio.create_task(queues["backup"].get())
+
+            # Побеждает первый, кто выдал текст; упавший без текста выбывает
+            while getters:
+                done, _ = await asyncio.wait(set(getters.values()), return_when=asyncio.FIRST_COMPLETED)
+                for name in ("primary", "backup"):
+                    getter = getters.get(name)
+                    if getter is None or getter not in done:
+                        continue
+                    del getters[name]
+                    chunk = _text_or_done(getter.result())
+                    if chunk is not _DONE and winner is None:
+                        winner, first = name, chunk
+                if winner is not None:
+                    break
+            policy.record(key, f"{winner or 'none'}_won", hedged=True)
+
+        # Время до первого фрагмента основного запроса учит порог; если он
+        # проиграл, его время - не меньше прошедшего. Ожидание в очереди
+        # лимитера порог не учит
+        if not queued and (winner == "backup" or (winner == "primary" and first is not _DONE)):
+            policy.observe(key, time.monotonic() - started)
+
+        for name, task in pumps.items():
+            if name != winner:
+                task.cancel()
+
+        if winner is None or first is _DONE:
+            return
+        if on_winner is not None:
+            on_winner(winner)
+        yield first
+        while True:
+            chunk = await queues[winner].get()
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        for task in list(getters.values()) + list(pumps.values()):
+            task.cancel()
+
+
+async def hedged_call(
+    key: str,
+    primary: Callable[[], Awaitable[Optional[str]]],
+    backup: Optional[Callable[[], Awaitable[Optional[str]]]],
+    policy: HedgePolicy,
+    saturated: Optional[Callable[[], bool]] = None,
+    on_winner: Optional[Callable[[str], None]] = None,
+) -> Optional[str]:
+    """Обычный (не потоковый) запрос со страховкой: первый фрагмент - весь ответ"""
+    stream = hedged_stream(
+        key, _single(primary), _single(backup) if backup else None, policy, saturated, on_winner
+    )
+    parts = [chunk async for chunk in stream]
+    return "".join(parts) or None
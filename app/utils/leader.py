@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировок нет, процесс всегда лидер
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    Выбор лидера среди воркеров одного хоста через flock.
+
+    Лидер держит эксклюзивную блокировку файла, пока жив. Если процесс
+    умирает, ОС снимает блокировку, и ее забирает следующий воркер.
+    Только лидер выполняет задачи планировщика и управляет вебхуком.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        logger.info(f"Process {os.getpid()} became leader")
+        return True
+
+    async def wait_for_leadership(self, on_acquire: Callable[[], Awaitable[None]], interval: float = 30.0):
+        """Фоновое ожидание: как только лидер пропадет, берем его роль"""
+        while not self.try_acquire():
+            await asyncio.sleep(interval)
+        await on_acquire()
+
+    def release(self):
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+
+from app.config import settings
+
+# Singleton экземпляр
+leader_lock = LeaderLock(settings.LEADER_LOCK_PATH)
@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Значение вычисляется в момент сбора метрик"""
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception as e:
+                logger.error(f"Gauge {self.name} failed: {e}")
+                return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счетчики по бакетам (не накопительные), сумма, количество
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4"""
+        lines = []
+        for metric in self._metrics.values():
+            samples = metric.samples()
+            if samples:
+                lines.extend(metric.header())
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Задержка event loop: насколько позже запланированного просыпается sleep"""
+
+    def __init__(self, histogram: Histogram, gauge: Gauge, interval: float = 0.5):
+        self.histogram = histogram
+        self.gauge = gauge
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.histogram.observe(lag)
+            self.gauge.set(lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# Singleton реестр и метрики горячих путей
+registry = Registry()
+
+UPDATE_SECONDS = registry.histogram(
+    "bot_update_handling_seconds", "Time to process one Telegram update", ["tenant", "event"]
+)
+TENANT_UPDATES = registry.counter(
+    "bot_tenant_updates_total", "Webhook updates per tenant bot by result", ["tenant", "result"]
+)
+TENANT_CLAUDE_JOBS = registry.counter(
+    "bot_tenant_claude_jobs_total", "Claude-bound jobs per tenant bot against its quota", ["tenant", "result"]
+)
+HANDLER_SECONDS = registry.histogram(
+    "bot_handler_seconds", "Handler execution time", ["router", "handler"]
+)
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "Handler exceptions", ["router", "handler"]
+)
+BOT_API_CALLS = registry.counter(
+    "bot_api_calls_total", "Telegram Bot API calls by tenant bot and method", ["tenant", "method"]
+)
+BOT_API_CALLS_PER_HANDLER = registry.histogram(
+    "bot_api_calls_per_handler",
+    "Telegram Bot API calls made while handling one update",
+    ["router", "handler"],
+    buckets=(1, 2, 3, 4, 5, 8, 13, 21),
+)
+
+CLAUDE_SECONDS = registry.histogram(
+    "claude_request_seconds", "Claude API request latency including retries", ["task", "mode"]
+)
+CLAUDE_RESPONSES = registry.counter(
+    "claude_responses_total", "Claude API responses by HTTP status", ["task", "status"]
+)
+CLAUDE_RETRIES = registry.counter("claude_retries_total", "Claude API retry attempts", ["task"])
+CLAUDE_HEDGES = registry.counter(
+    "claude_hedges_total", "Hedging decisions and winners per task", ["task", "mode", "outcome"]
+)
+CLAUDE_ADMISSION_WAIT = registry.histogram(
+    "claude_admission_wait_seconds", "Time waiting for a Claude admission slot", ["priority"]
+)
+CLAUDE_ADMISSIONS = registry.counter(
+    "claude_admissions_total", "Claude admission outcomes by priority class", ["priority", "result"]
+)
+CLAUDE_QUEUE_DEPTH = registry.gauge(
+    "claude_admission_waiting", "Claude requests waiting for admission by priority class", ["priority"]
+)
+CLAUDE_JOBS = registry.counter(
+    "bot_claude_jobs_total", "Claude-bound handler jobs by outcome", ["job", "outcome"]
+)
+
+SCRAPE_FETCH_SECONDS = registry.histogram(
+    "trend_fetch_seconds", "Trend source fetch time", ["source"]
+)
+SCRAPE_PARSE_SECONDS = registry.histogram(
+    "trend_parse_seconds", "Trend source parse time", ["source"]
+)
+SCRAPE_RESULTS = registry.counter(
+    "trend_fetch_total", "Trend source fetch outcomes", ["source", "result"]
+)
+
+BROADCAST_MESSAGES = registry.counter(
+    "broadcast_messages_total", "Broadcast deliveries by tenant bot and status", ["tenant", "status"]
+)
+BROADCAST_SEND_SECONDS = registry.histogram(
+    "broadcast_send_seconds", "Broadcast single send latency"
+)
+BROADCAST_RATE = registry.gauge("broadcast_last_rate", "Messages per second in the last broadcast")
+
+LOOP_LAG_SECONDS = registry.histogram(
+    "event_loop_lag_seconds",
+    "Event loop scheduling lag",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+LOOP_LAG_LAST = registry.gauge("event_loop_lag_last_seconds", "Last measured event loop lag")
+
+loop_lag_monitor = LoopLagMonitor(LOOP_LAG_SECONDS, LOOP_LAG_LAST)
@@ -0,0 +1,306 @@
+import logging
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.flags import get_flag
+from aiogram.methods.base import Response, TelegramMethod, TelegramType
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+
+from app.utils.coordination import ANSWERED, RUNNING, USER_LIMIT, shared_key
+from app.utils.metrics import (
+    BOT_API_CALLS,
+    BOT_API_CALLS_PER_HANDLER,
+    CLAUDE_JOBS,
+    HANDLER_ERRORS,
+    HANDLER_SECONDS,
+)
+from app.utils.ratelimit import INTERACTIVE, AdmissionController, priority_class
+from app.utils.tracing import annotate, start_trace
+from app.utils.update_queue import received_at
+
+logger = logging.getLogger(__name__)
+
+# Счетчик вызовов Bot API текущего хендлера; список, чтобы его видели
+# и фоновые задачи хендлера (индикатор набора)
+_api_calls: ContextVar[Optional[List[int]]] = ContextVar("bot_api_calls", default=None)
+
+
+def handler_labels(data: Dict[str, Any]) -> Dict[str, str]:
+    """Роутер (модуль хендлера) и имя функции-хендлера"""
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    if callback is None:
+        return {"router": "unknown", "handler": "unknown"}
+    module = getattr(callback, "__module__", "") or ""
+    return {
+        "router": module.rsplit(".", 1)[-1] or "unknown",
+        "handler": getattr(callback, "__name__", "unknown"),
+    }
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Время работы хендлеров и число вызовов Bot API на один апдейт.
+
+    Регистрируется как inner-middleware на диспетчере, поэтому срабатывает
+    уже после выбора хендлера во всех дочерних роутерах.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        labels = handler_labels(data)
+        annotate(handler=f"{labels['router']}.{labels['handler']}")
+        started = time.perf_counter()
+        calls = [0]
+        token = _api_calls.set(calls)
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(**labels)
+            raise
+        finally:
+            _api_calls.reset(token)
+            HANDLER_SECONDS.observe(time.perf_counter() - started, **labels)
+            BOT_API_CALLS_PER_HANDLER.observe(calls[0], **labels)
+
+
+class BotAPICallsMiddleware(BaseRequestMiddleware):
+    """
+    Счетчик вызовов Bot API по ботам-арендаторам и методам.
+
+    Сессия общая для всех ботов процесса, бот вызова определяет tenant_of.
+    Вызов внутри хендлера засчитывается и ему - MetricsMiddleware пишет
+    гистограмму вызовов на апдейт.
+    """
+
+    def __init__(self, tenant_of: Optional[Callable[[Any], str]] = None):
+        self.tenant_of = tenant_of
+        self.calls: Dict[str, Dict[str, int]] = {}
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        tenant = self.tenant_of(bot) if self.tenant_of is not None else "default"
+        calls = self.calls.setdefault(tenant, {})
+        calls[name] = calls.get(name, 0) + 1
+        BOT_API_CALLS.inc(tenant=tenant, method=name)
+        calls = _api_calls.get()
+        if calls is not None:
+            calls[0] += 1
+        return await make_request(bot, method)
+
+    def get_stats(self) -> dict:
+        return {
+            tenant: {
+                "total": sum(calls.values()),
+                "by_method": dict(sorted(calls.items(), key=lambda item: -item[1])),
+            }
+            for tenant, calls in self.calls.items()
+        }
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Трасса на каждый апдейт.
+
+    Регистрируется как outer-middleware на dp.update. Отрезки Claude,
+    скрапера и Bot API попадают в трассу через contextvars; апдейт дольше
+    slow_threshold секунд пишется в лог с разбивкой по отрезкам.
+    """
+
+    def __init__(self, slow_threshold: float = 5.0):
+        self.slow_threshold = slow_threshold
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        with start_trace("update", update_id=event.update_id, type=event.event_type) as trace:
+            try:
+                return await handler(event, data)
+            finally:
+                if trace.elapsed >= self.slow_threshold:
+                    logger.warning(f"Slow update:\n{trace.breakdown()}")
+
+
+# (арендатор, id пользователя, задача, текст запроса)
+JobKey = Tuple[str, int, str, str]
+
+
+class ClaudeJobMiddleware(BaseMiddleware):
+    """
+    Хендлеры, которые ходят в Claude (флаг claude="имя задачи").
+
+    Запросы из чата получают приоритет interactive. Повтор того же
+    запроса (тот же хендлер и текст), отправленный, пока первый еще
+    выполнялся, не запускается заново - апдейты чата идут по очереди,
+    и повторные нажатия иначе отработали бы каждое. Одновременных задач
+    у пользователя не больше per_user. Пользователь - пара (бот-арендатор,
+    id в Telegram): в разных ботах это разные чаты. Если очередь Claude переполнена
+    или бот-арендатор (data["tenant"]) исчерпал свою квоту, пользователь
+    сразу получает отказ, а если очередь просто занята - номер своей позиции.
+
+    С coordinator (несколько воркеров uvicorn) задачи и повторы считаются
+    по общей базе, а не по памяти процесса.
+    """
+
+    def __init__(
+        self,
+        limiter: AdmissionController,
+        per_user: int = 2,
+        max_recent: int = 10000,
+        coordinator=None,
+    ):
+        self.limiter = limiter
+        self.per_user = per_user
+        self.max_recent = max_recent
+        self.coordinator = coordinator
+
+        self._in_flight: Dict[Tuple[str, int], set] = {}
+        self._recent: "OrderedDict[JobKey, float]" = OrderedDict()
+
+    @staticmethod
+    async def _reply(event: TelegramObject, text: str):
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
+        elif isinstance(event, Message):
+            await event.answer(text)
+
+    def _sent_while_running(self, key: JobKey) -> bool:
+        finished = self._recent.get(key)
+        arrived = received_at()
+        return finished is not None and arrived is not None and arrived < finished
+
+    def _remember(self, key: JobKey):
+        self._recent[key] = time.time()
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
+
+    def _start_local(self, key: JobKey) -> Optional[str]:
+        active = self._in_flight.get(key[:2], set())
+        if key in active:
+            return RUNNING
+        if self._sent_while_running(key):
+            return ANSWERED
+        if len(active) >= self.per_user:
+            return USER_LIMIT
+        self._in_flight.setdefault(key[:2], set()).add(key)
+        return None
+
+    def _finish_local(self, key: JobKey, remember: bool):
+        active = self._in_flight.get(key[:2])
+        if active is not None:
+            active.discard(key)
+            if not active:
+                self._in_flight.pop(key[:2], None)
+        if remember:
+            self._remember(key)
+
+    async def _start(self, key: JobKey) -> Optional[str]:
+        outcome = self._start_local(key)
+        if outcome is not None or self.coordinator is None:
+            return outcome
+        try:
+            outcome = await self.coordinator.start_job(
+                shared_key("job", *key), f"{key[0]}:{key[1]}", self.per_user, received_at()
+            )
+        except Exception as e:
+            logger.error(f"Shared job check failed: {e}")
+            return None
+        if outcome is not None:
+            self._finish_local(key, remember=False)
+        return outcome
+
+    async def _finish(self, key: JobKey, completed: bool = True):
+        self._finish_local(key, remember=completed)
+        if self.coordinator is None:
+            return
+        try:
+            if completed:
+                await self.coordinator.finish_job(shared_key("job", *key))
+            else:
+                await self.coordinator.cancel_job(shared_key("job", *key))
+        except Exception as e:
+            logger.error(f"Shared job update failed: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        job = get_flag(data, "claude")
+        user = getattr(event, "from_user", None)
+        if job is None or user is None:
+            return await handler(event, data)
+
+        tenant = data.get("tenant")
+        payload = event.data if isinstance(event, CallbackQuery) else getattr(event, "text", None)
+        key = (tenant.name if tenant is not None else "", user.id, job, payload or "")
+
+        outcome = await self._start(key)
+        if outcome == RUNNING:
+            CLAUDE_JOBS.inc(job=job, outcome="duplicate")
+            await self._reply(event, "⏳ Этот запрос уже выполняется, ответ скоро придет.")
+            return None
+        if outcome == ANSWERED:
+            CLAUDE_JOBS.inc(job=job, outcome="duplicate")
+            await self._reply(event, "☝️ Ответ на этот запрос - выше.")
+            return None
+        if outcome == USER_LIMIT:
+            CLAUDE_JOBS.inc(job=job, outcome="user_limit")
+            await self._reply(event, "⏳ Дождитесь ответа на предыдущие запросы.")
+            return None
+
+        if self.limiter.position(INTERACTIVE) >= self.limiter.max_waiting:
+            await self._finish(key, completed=False)
+            CLAUDE_JOBS.inc(job=job, outcome="shed")
+            await self._reply(event, "🚦 Сейчас очень много запросов. Попробуйте через минуту.")
+            return None
+        if tenant is not None and not tenant.quota.admit_claude():
+            await self._finish(key, completed=False)
+            CLAUDE_JOBS.inc(job=job, outcome="tenant_quota")
+            await self._reply(event, "🚦 Лимит запросов к ИИ на этот час исчерпан. Попробуйте позже.")
+            return None
+
+        chat = event.message if isinstance(event, CallbackQuery) else event
+        notified = False
+
+        async def on_queued(position: int):
+            nonlocal notified
+            if notified or chat is None:
+                return
+            notified = True
+            CLAUDE_JOBS.inc(job=job, outcome="queued")
+            try:
+                await chat.answer(f"⏳ Много запросов - вы в очереди, позиция {position}. Ответ придет сам.")
+            except Exception as e:
+                logger.warning(f"Queue notice failed: {e}")
+
+        CLAUDE_JOBS.inc(job=job, outcome="started")
+        try:
+            with priority_class(INTERACTIVE, on_queued):
+                return await handler(event, data)
+        finally:
+            await self._finish(key)
+
+    def get_stats(self) -> dict:
+        return {
+            "users_in_flight": len(self._in_flight),
+            "jobs_in_flight": sum(len(keys) for keys in self._in_flight.values()),
+        }
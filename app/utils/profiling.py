@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик работающего процесса.
+
+    Фоновый поток раз в interval снимает стек нужных потоков через
+    sys._current_frames() и считает одинаковые стеки. Результат - формат
+    "folded stacks" (frame;frame;frame count), который понимают
+    flamegraph.pl, speedscope и inferno. Сам event loop не останавливается.
+    """
+
+    def __init__(self, max_seconds: float = 60.0, min_interval: float = 0.001):
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    def _frame_label(self, frame) -> str:
+        code = frame.f_code
+        filename = code.co_filename
+        if filename.startswith(self._root):
+            filename = os.path.relpath(filename, self._root)
+        else:
+            filename = os.path.basename(filename)
+        return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+    def _stack(self, frame) -> str:
+        labels = []
+        while frame is not None:
+            labels.append(self._frame_label(frame))
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    def _sample(self, seconds: float, interval: float, thread_ids: Optional[set]) -> Counter:
+        stacks: Counter = Counter()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (thread_ids is not None and ident not in thread_ids):
+                    continue
+                thread = names.get(ident, str(ident)).replace(";", ":")
+                stacks[f"{thread};{self._stack(frame)}"] += 1
+            time.sleep(interval)
+        return stacks
+
+    async def capture(self, seconds: float, interval: float = 0.005, all_threads: bool = False) -> str:
+        """Профиль за seconds секунд в формате folded stacks"""
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        interval = max(interval, self.min_interval)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("Another profile is being captured")
+        try:
+            # Вызывается из потока event loop - его и профилируем по умолчанию
+            thread_ids = None if all_threads else {threading.get_ident()}
+            stacks = await asyncio.to_thread(self._sample, seconds, interval, thread_ids)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+from app.config import settings
+
+# Singleton экземпляр
+profiler = SamplingProfiler(max_seconds=settings.PROFILE_MAX_SECONDS)
@@ -0,0 +1,350 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Mapping, Optional
+
+from app.utils.metrics import CLAUDE_ADMISSION_WAIT, CLAUDE_ADMISSIONS, CLAUDE_QUEUE_DEPTH
+from app.utils.tracing import add_span
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше - важнее
+INTERACTIVE = 0
+SCHEDULED = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", SCHEDULED: "scheduled", BATCH: "batch"}
+
+# Запросы без явного класса (задачи планировщика) идут как scheduled
+_priority: ContextVar[int] = ContextVar("claude_priority", default=SCHEDULED)
+_on_queued: ContextVar[Optional[Callable[[int], Awaitable[None]]]] = ContextVar("claude_on_queued", default=None)
+
+
+@contextmanager
+def priority_class(priority: int, on_queued: Optional[Callable[[int], Awaitable[None]]] = None):
+    """
+    Класс приоритета для всех запросов к Claude внутри блока.
+
+    on_queued(position) вызывается, если запросу пришлось встать в очередь.
+    """
+    token = _priority.set(priority)
+    queued_token = _on_queued.set(on_queued)
+    try:
+        yield
+    finally:
+        _on_queued.reset(queued_token)
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class AdmissionTimeout(Exception):
+    """Запрос не дождался своей очереди до дедлайна"""
+
+
+class AdmissionRejected(AdmissionTimeout):
+    """Очередь переполнена - запрос отклонен, не вставая в нее"""
+
+
+class TokenBucket:
+    """Классическое ведро токенов с пополнением раз в минуту"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.capacity = per_minute if capacity is None else capacity
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в ведре не окажется amount токенов"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        # Запрос больше всего ведра пропускаем, когда оно полное
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Admission:
+    """Выданный слот; после ответа сюда пишется реальный расход токенов"""
+
+    def __init__(self, estimated_tokens: int, priority: int = SCHEDULED):
+        self.estimated_tokens = estimated_tokens
+        self.priority = priority
+        self.actual_tokens: Optional[int] = None
+
+
+class PrioritySemaphore:
+    """
+    Семафор с очередью по приоритету.
+
+    Освободившийся слот получает ожидающий с наименьшим (класс, порядок
+    прихода): внутри класса - FIFO, как у asyncio.Semaphore.
+    """
+
+    def __init__(self, value: int = 1):
+        self._value = value
+        self._waiters: List[list] = []
+        self._seq = itertools.count()
+
+    def locked(self) -> bool:
+        return self._value == 0
+
+    async def acquire(self, priority: int):
+        if self._value > 0:
+            self._value -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), future])
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот успели передать нам - отдаем следующему
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Слот переходит ожидающему, минуя счетчик
+                future.set_result(True)
+                return
+        self._value += 1
+
+
+class AdmissionController:
+    """
+    Клиентский контроль нагрузки на Claude API.
+
+    Ограничивает число одновременных запросов, держит бюджеты запросов
+    и токенов в минуту и общую паузу по retry-after. Ожидающие проходят
+    по классам приоритета (interactive > scheduled > batch), внутри
+    класса - по очереди, и получают AdmissionTimeout по дедлайну.
+    Фоновым классам недоступны reserved_interactive слотов, поэтому
+    рассылка не забирает весь параллелизм у пользователей.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        requests_per_minute: float = 50,
+        tokens_per_minute: float = 40000,
+        queue_timeout: float = 30.0,
+        reserved_interactive: int = 1,
+        max_waiting: int = 100,
+    ):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_waiting = max_waiting
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # Фоновые классы делят между собой только часть слотов
+        self._background = PrioritySemaphore(max(1, max_concurrency - reserved_interactive))
+        # Через ворота по одному проходят к слоту и бюджету - в порядке приоритета
+        self._gate = PrioritySemaphore(1)
+        self._notify_tasks = set()
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._paused_until = 0.0
+
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self.stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "throttled": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    async def _wait_for_budget(self, tokens: int):
+        while True:
+            delay = max(
+                self._paused_until - time.monotonic(),
+                self._requests.delay_for(1),
+                self._tokens.delay_for(tokens),
+            )
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        self._requests.take(1)
+        self._tokens.take(tokens)
+
+    def position(self, priority: int) -> int:
+        """Сколько запросов этого и более важных классов уже ждут"""
+        return sum(count for cls, count in self.waiting.items() if cls <= priority)
+
+    def _will_wait(self, priority: int) -> bool:
+        if self.position(priority) or self._paused_until > time.monotonic():
+            return True
+        if priority != INTERACTIVE and self._background.locked():
+            return True
+        return self.in_flight >= self.max_concurrency
+
+    def _set_waiting(self, priority: int, delta: int):
+        self.queue_depth += delta
+        self.waiting[priority] += delta
+        CLAUDE_QUEUE_DEPTH.set(self.waiting[priority], priority=PRIORITY_NAMES[priority])
+
+    def _notify_queued(self, priority: int):
+        callback = _on_queued.get()
+        if callback is None or not self._will_wait(priority):
+            return
+        task = asyncio.create_task(callback(self.position(priority) + 1))
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    async def _enter(self, priority: int, tokens: int):
+        await self._gate.acquire(priority)
+        try:
+            await self._slots.acquire()
+            try:
+                await self._wait_for_budget(tokens)
+            except BaseException:
+                self._slots.release()
+                raise
+        finally:
+            self._gate.release()
+
+    async def acquire(
+        self,
+        tokens: int = 0,
+        timeout: Optional[float] = None,
+        priority: Optional[int] = None,
+    ) -> Admission:
+        timeout = self.queue_timeout if timeout is None else timeout
+        priority = current_priority() if priority is None else priority
+        name = PRIORITY_NAMES[priority]
+
+        if self.position(priority) >= self.max_waiting:
+            self.stats["rejected"] += 1
+            CLAUDE_ADMISSIONS.inc(priority=name, result="shed")
+            raise AdmissionRejected(f"{self.position(priority)} {name} requests already waiting")
+
+        self._notify_queued(priority)
+        started = time.monotonic()
+        background = priority != INTERACTIVE
+        self._set_waiting(priority, 1)
+
+        try:
+            async with asyncio.timeout(timeout):
+                if background:
+                    await self._background.acquire(priority)
+                try:
+                    await self._enter(priority, tokens)
+                except BaseException:
+                    if background:
+                        self._background.release()
+                    raise
+        except TimeoutError:
+            self.stats["rejected"] += 1
+            CLAUDE_ADMISSIONS.inc(priority=name, result="timeout")
+            raise AdmissionTimeout(f"Queue wait exceeded {timeout:.1f}s")
+        finally:
+            self._set_waiting(priority, -1)
+
+        waited = time.monotonic() - started
+        add_span("admission.wait", started, waited, priority=name)
+        CLAUDE_ADMISSION_WAIT.observe(waited, priority=name)
+        CLAUDE_ADMISSIONS.inc(priority=name, result="admitted")
+        self.stats["admitted"] += 1
+        self.stats["wait_total"] += waited
+        self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+        self.in_flight += 1
+        return Admission(tokens, priority)
+
+    def release(self, admission: Admission):
+        self.in_flight -= 1
+        self._slots.release()
+        if admission.priority != INTERACTIVE:
+            self._background.release()
+
+        # Возвращаем в ведро переоцененные токены
+        if admission.actual_tokens is not None:
+            self._tokens.refund(admission.estimated_tokens - admission.actual_tokens)
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0, timeout: Optional[float] = None):
+        admission = await self.acquire(tokens, timeout)
+        try:
+            yield admission
+        finally:
+            self.release(admission)
+
+    def pause(self, seconds: float):
+        """Общая пауза для всех запросов (после 429 с retry-after)"""
+        self.stats["throttled"] += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"Claude admission paused for {seconds:.1f}s")
+
+    def get_stats(self) -> dict:
+        admitted = self.stats["admitted"]
+        return {
+            **self.stats,
+            "wait_total": round(self.stats["wait_total"], 3),
+            "wait_max": round(self.stats["wait_max"], 3),
+            "queue_depth": self.queue_depth,
+            "waiting": {PRIORITY_NAMES[cls]: count for cls, count in self.waiting.items()},
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "wait_avg": round(self.stats["wait_total"] / admitted, 3) if admitted else 0.0,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1),
+        }
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Время ожидания из retry-after или заголовков anthropic-ratelimit-*-reset"""
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+    resets = []
+    for name in ("anthropic-ratelimit-requests-reset", "anthropic-ratelimit-tokens-reset"):
+        value = headers.get(name)
+        if not value:
+            continue
+        try:
+            reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            resets.append((reset_at - datetime.now(timezone.utc)).total_seconds())
+        except ValueError:
+            continue
+
+    if resets:
+        return max(0.0, max(resets))
+    return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None, base: float = 1.0, cap: float = 60.0) -> float:
+    """Экспоненциальная задержка с джиттером; retry-after имеет приоритет"""
+    delay = retry_after if retry_after is not None else min(cap, base * 2 ** attempt)
+    return delay + random.uniform(0, max(delay, base) * 0.25)
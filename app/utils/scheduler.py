@@ -1,6 +1,6 @@
 import logging
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
+from datetime import datetime, timedelta
+from typing import List
 import pytz
 
 logger = logging.getLogger(__name__)
@@ -9,27 +9,106 @@ logger = logging.getLogger(__name__)
 class NotificationScheduler:
     def __init__(self, tz: str):
         try:
-            timezone = pytz.timezone(tz)
+            self.timezone = pytz.timezone(tz)
         except:
-            timezone = pytz.UTC
+            self.timezone = pytz.UTC
         
-        self.scheduler = AsyncIOScheduler(timezone=timezone)
+        # APScheduler нужен только воркеру-лидеру, создаем при первой задаче
+        self._scheduler = None
         self.is_running = False
     
-    def add_daily_job(self, callback, time_str: str):
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            from apscheduler.schedulers.asyncio import AsyncIOScheduler
+            self._scheduler = AsyncIOScheduler(timezone=self.timezone)
+        return self._scheduler
+    
+    def add_daily_job(
+        self,
+        callback,
+        time_str: str,
+        job_id: str = "daily_notification",
+        timezone=None,
+        args: tuple = (),
+        misfire_grace_time: int = 1,
+    ):
+        """
+        Ежедневная задача в HH:MM
+        
+        timezone - пояс времени запуска (по умолчанию - пояс планировщика).
+        """
+        from apscheduler.triggers.cron import CronTrigger
         try:
             hour, minute = map(int, time_str.split(":"))
-            trigger = CronTrigger(hour=hour, minute=minute)
+            trigger = CronTrigger(hour=hour, minute=minute, timezone=timezone or self.timezone)
             self.scheduler.add_job(
                 callback, 
                 trigger=trigger, 
-                id="daily_notification", 
-                replace_existing=True
+                id=job_id, 
+                args=args,
+                replace_existing=True,
+                coalesce=True,
+                misfire_grace_time=misfire_grace_time,
             )
-            logger.info(f"Scheduled daily job at {time_str}")
+            logger.info(f"Scheduled daily job {job_id} at {time_str}")
         except Exception as e:
             logger.error(f"Failed to schedule job: {e}")
     
+    def remove_job(self, job_id: str):
+        try:
+            self.scheduler.remove_job(job_id)
+            logger.info(f"Removed job {job_id}")
+        except Exception as e:
+            logger.error(f"Failed to remove job {job_id}: {e}")
+    
+    def job_ids(self, prefix: str = "") -> List[str]:
+        return [job.id for job in self.scheduler.get_jobs() if job.id.startswith(prefix)]
+    
+    def add_interval_job(
+        self,
+        callback,
+        seconds: float,
+        job_id: str,
+        run_now: bool = False,
+        first_run_in: float = None,
+    ):
+        """
+        Периодическая задача
+        
+        run_now - первый запуск сразу, first_run_in - через столько секунд
+        (по умолчанию - через полный интервал).
+        """
+        from apscheduler.triggers.interval import IntervalTrigger
+        
+        if run_now:
+            first_run_in = 0
+        # next_run_time=None у APScheduler означает "на паузе", поэтому передаем только явный срок
+        extra = {}
+        if first_run_in is not None:
+            extra["next_run_time"] = datetime.now(self.timezone) + timedelta(seconds=first_run_in)
+        try:
+            self.scheduler.add_job(
+                callback,
+                trigger=IntervalTrigger(seconds=seconds),
+                id=job_id,
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True,
+                **extra
+            )
+            logger.info(f"Scheduled job {job_id} every {seconds:.0f}s")
+        except Exception as e:
+            logger.error(f"Failed to schedule job {job_id}: {e}")
+    
+    def reschedule_interval(self, job_id: str, seconds: float):
+        from apscheduler.triggers.interval import IntervalTrigger
+        try:
+            self.scheduler.reschedule_job(job_id, trigger=IntervalTrigger(seconds=seconds))
+            logger.info(f"Rescheduled job {job_id} every {seconds:.0f}s")
+        except Exception as e:
+            logger.error(f"Failed to reschedule job {job_id}: {e}")
+    
     def start(self):
         if not self.is_running:
             self.scheduler.start()
@@ -1,32 +1,261 @@
 import aiohttp
-import feedparser
+import asyncio
+import calendar
+import json
 import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from app.utils.metrics import SCRAPE_FETCH_SECONDS, SCRAPE_PARSE_SECONDS, SCRAPE_RESULTS
+from app.utils.singleflight import SingleFlight
+from app.utils.trend_ranking import TrendHistory, TrendRanker
+from app.utils.tracing import add_span, span
 
 logger = logging.getLogger(__name__)
 
 
+class FeedSource:
+    """Один источник трендов (RSS/Atom)"""
+    
+    def __init__(self, name: str, url: str, title: str, limit: int = 5, timeout: float = 10.0):
+        self.name = name
+        self.url = url
+        self.title = title
+        self.limit = limit
+        self.timeout = timeout
+        
+        # Состояние для условных запросов (ETag / If-Modified-Since)
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.entries: List[dict] = []
+        
+        self.stats = {
+            "fetches": 0,
+            "not_modified": 0,
+            "failures": 0,
+            "last_latency": 0.0,
+            "latency_total": 0.0,
+            "last_parse": 0.0,
+            "last_error": None,
+        }
+    
+    def get_stats(self) -> dict:
+        fetches = self.stats["fetches"]
+        return {
+            **self.stats,
+            "latency_total": round(self.stats["latency_total"], 3),
+            "latency_avg": round(self.stats["latency_total"] / fetches, 3) if fetches else 0.0,
+        }
+
+
+# Reddit отдается в JSON: в нем есть очки и комментарии для скорости роста
+DEFAULT_SOURCES = [
+    ("reddit_blender", "https://www.reddit.com/r/blender/hot.json", "📱 REDDIT r/blender"),
+    ("reddit_3dmodeling", "https://www.reddit.com/r/3Dmodeling/hot.json", "📱 REDDIT r/3Dmodeling"),
+    ("reddit_cinema4d", "https://www.reddit.com/r/Cinema4D/hot.json", "📱 REDDIT r/Cinema4D"),
+    ("reddit_unrealengine", "https://www.reddit.com/r/unrealengine/hot.json", "📱 REDDIT r/unrealengine"),
+    ("youtube_blender", "https://www.youtube.com/feeds/videos.xml?channel_id=UCSMOQeBJ2RAnuFungnQOxLg", "▶️ YOUTUBE Blender"),
+    ("blendernation", "https://www.blendernation.com/feed/", "📰 BlenderNation"),
+    ("cgchannel", "https://www.cgchannel.com/feed/", "📰 CG Channel"),
+]
+
+
+def build_sources(spec: Optional[str], limit: int, timeout: float) -> List[FeedSource]:
+    """
+    Реестр источников из строки вида "name|url|title;name|url|title"
+    
+    Пустая строка - набор по умолчанию.
+    """
+    entries = DEFAULT_SOURCES
+    if spec:
+        entries = []
+        for item in spec.split(";"):
+            parts = [p.strip() for p in item.split("|")]
+            if len(parts) >= 2 and parts[0] and parts[1]:
+                entries.append((parts[0], parts[1], parts[2] if len(parts) > 2 else parts[0]))
+    
+    return [FeedSource(name, url, title, limit, timeout) for name, url, title in entries]
+
+
+def parse_listing(content: bytes) -> List[dict]:
+    """Листинг Reddit (hot.json): те же поля, что у ленты, плюс очки и комментарии"""
+    listing = json.loads(content).get("data", {})
+    entries = []
+    for child in listing.get("children", []):
+        data = child.get("data", {})
+        if data.get("stickied"):
+            continue
+        entries.append({
+            "title": data.get("title", ""),
+            "link": f"https://www.reddit.com{data.get('permalink', '')}",
+            "published": "",
+            "published_at": data.get("created_utc"),
+            "score": data.get("score") or 0,
+            "comments": data.get("num_comments") or 0,
+        })
+    return entries
+
+
+def parse_feed(content: bytes) -> List[dict]:
+    """Разбор ленты в простые dict (выполняется в пуле, результат сериализуем)"""
+    if content.lstrip()[:1] == b"{":
+        return parse_listing(content)
+    
+    # Импорт при первом разборе: запросы без сканера не платят за feedparser
+    import feedparser
+    
+    feed = feedparser.parse(content)
+    entries = []
+    for entry in feed.entries:
+        published = entry.get("published_parsed") or entry.get("updated_parsed")
+        entries.append({
+            "title": entry.get("title", ""),
+            "link": entry.get("link", ""),
+            "published": entry.get("published", ""),
+            "published_at": float(calendar.timegm(published)) if published else None,
+            "comments": int(entry.get("slash_comments") or 0),
+        })
+    return entries
+
+
 class TrendScraper:
+    def __init__(
+        self,
+        sources: List[FeedSource],
+        parse_processes: int = 0,
+        pool_size: int = 20,
+        ranker: Optional[TrendRanker] = None,
+    ):
+        self.sources = sources
+        self.parse_processes = parse_processes
+        self.pool_size = pool_size
+        # Ранжированный дайджест вместо первых заголовков каждого источника
+        self.ranker = ranker
+        self.flight = SingleFlight("trends")
+        
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._executor: Optional[Executor] = None
+    
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"User-Agent": "3d-smm-bot/1.0 (trend scanner)"},
+            )
+        if self._executor is None:
+            # feedparser - чистый Python, большие ленты держат GIL; процессы по желанию
+            if self.parse_processes > 0:
+                self._executor = ProcessPoolExecutor(max_workers=self.parse_processes)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="feedparse")
+    
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.ranker is not None:
+            self.ranker.close()
+    
     async def get_all_trends(self):
-        result = "🔍 СОБРАННЫЕ ТРЕНДЫ:\n\n"
+        # Параллельные нажатия "Сканер трендов" ждут один общий сбор
+        with span("scraper.collect"):
+            return await self.flight.do("all_trends", self._collect)
+    
+    async def _fetch(self, source: FeedSource) -> List[dict]:
+        headers = {}
+        if source.etag:
+            headers["If-None-Match"] = source.etag
+        if source.last_modified:
+            headers["If-Modified-Since"] = source.last_modified
         
-        # Reddit через RSS
+        started = time.monotonic()
+        source.stats["fetches"] += 1
+        
+        try:
+            async with self._session.get(
+                source.url,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=source.timeout),
+            ) as response:
+                if response.status == 304:
+                    source.stats["not_modified"] += 1
+                    SCRAPE_RESULTS.inc(source=source.name, result="not_modified")
+                    add_span("scraper.fetch", started, time.monotonic() - started, source=source.name, status=304)
+                    return source.entries
+                if response.status != 200:
+                    raise RuntimeError(f"HTTP {response.status}")
+                
+                content = await response.read()
+                source.etag = response.headers.get("ETag")
+                source.last_modified = response.headers.get("Last-Modified")
+            
+            parse_started = time.monotonic()
+            SCRAPE_FETCH_SECONDS.observe(parse_started - started, source=source.name)
+            add_span("scraper.fetch", started, parse_started - started, source=source.name)
+            loop = asyncio.get_running_loop()
+            source.entries = await loop.run_in_executor(self._executor, parse_feed, content)
+            parse_time = time.monotonic() - parse_started
+            SCRAPE_PARSE_SECONDS.observe(parse_time, source=source.name)
+            add_span("scraper.parse", parse_started, parse_time, source=source.name)
+            SCRAPE_RESULTS.inc(source=source.name, result="ok")
+            source.stats["last_parse"] = round(parse_time, 3)
+            source.stats["last_error"] = None
+            return source.entries
+        except Exception as e:
+            SCRAPE_RESULTS.inc(source=source.name, result="error")
+            source.stats["failures"] += 1
+            source.stats["last_error"] = str(e) or type(e).__name__
+            add_span("scraper.fetch", started, time.monotonic() - started, source=source.name, error=source.stats["last_error"])
+            logger.error(f"{source.name} error: {source.stats['last_error']}")
+            # Последние удачные данные лучше, чем ничего
+            return source.entries
+        finally:
+            latency = time.monotonic() - started
+            source.stats["last_latency"] = round(latency, 3)
+            source.stats["latency_total"] += latency
+    
+    async def fetch_all(self) -> Dict[str, List[dict]]:
+        await self.start()
+        results = await asyncio.gather(*(self._fetch(source) for source in self.sources))
+        return {source.name: entries for source, entries in zip(self.sources, results)}
+    
+    def get_stats(self) -> dict:
+        return {source.name: source.get_stats() for source in self.sources}
+    
+    async def _digest(self, collected: Dict[str, List[dict]]) -> str:
+        if self.ranker is None:
+            return ""
         try:
-            url = "https://www.reddit.com/r/blender/hot.rss"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status == 200:
-                        content = await response.text()
-                        feed = feedparser.parse(content)
-                        if feed.entries:
-                            result += "📱 REDDIT r/blender:\n"
-                            for i, entry in enumerate(feed.entries[:5], 1):
-                                result += f"{i}. {entry.title}\n"
-                            result += "\n"
+            with span("scraper.rank"):
+                return await self.ranker.digest(collected, {source.name: source.title for source in self.sources})
         except Exception as e:
-            logger.error(f"Reddit error: {e}")
+            logger.error(f"Trend ranking failed: {e}")
+            return ""
+    
+    async def _collect(self):
+        collected = await self.fetch_all()
+        digest = await self._digest(collected)
+        if digest:
+            return digest
+        
+        # Без ранжирования - первые записи каждого источника как есть
+        result = "🔍 СОБРАННЫЕ ТРЕНДЫ:\n\n"
+        for source in self.sources:
+            entries = collected.get(source.name) or []
+            if not entries:
+                continue
+            result += f"{source.title}:\n"
+            for i, entry in enumerate(entries[:source.limit], 1):
+                result += f"{i}. {entry['title']}\n"
+            result += "\n"
         
         # Если ничего не собрали - синтетические данные
-        if "REDDIT" not in result:
+        if not any(collected.values()):
             result += """📊 АКТУАЛЬНЫЕ ТЕМЫ В 3D:
 
 1. AI в 3D моделировании - интеграция нейросетей
@@ -52,54 +281,17 @@ class TrendScraper:
         return result
 
 
-class CompetitorScraper:
-    async def analyze_username(self, username: str):
-        # Синтетические данные для демонстрации
-        return f"""
-📊 ПРОФИЛЬ: @{username}
-
-ПРИМЕРЫ ПОСТОВ:
-
-Пост 1: "Just finished this cyberpunk scene in Blender 💜 #3D #blender"
-- Engagement: 1,200 лайков, 45 комментариев
-- Формат: Изображение + короткий текст
-- Время: 18:00
-
-Пост 2: "Time-lapse of my latest character modeling 🎨"
-- Engagement: 2,300 лайков, 78 комментариев
-- Формат: Видео (30 сек)
-- Время: 20:00
-
-Пост 3: "Tutorial: How to create realistic skin shader ✨"
-- Engagement: 890 лайков, 34 комментария
-- Формат: Карусель / Thread
-- Время: 15:00
-
-ПАТТЕРНЫ ПОСТИНГА:
-- Частота: 3-4 раза в неделю
-- Лучшие дни: Вторник, Четверг, Воскресенье
-- Лучшее время: 18:00-21:00
-- Активно использует эмодзи
-- Хештеги: #3D #Blender #3DArt #CGI #DigitalArt
-
-ФОРМАТЫ:
-- 40% - статичные рендеры
-- 35% - time-lapse видео
-- 25% - туториалы и breakdown
-
-ТЕМЫ:
-- Персонажи: 30%
-- Окружение: 25%
-- Abstract/Motion: 20%
-- Туториалы: 25%
-
-Примечание: Для реального анализа подключите API платформы.
-"""
-
-
-trend_scraper = TrendScraper()
-competitor_scraper = CompetitorScraper()
+from app.config import settings
 
 # Singleton экземпляры
-trend_scraper = TrendScraper()
-competitor_scraper = CompetitorScraper()
+trend_scraper = TrendScraper(
+    build_sources(settings.TREND_SOURCES, settings.TREND_SOURCE_LIMIT, settings.TREND_SOURCE_TIMEOUT),
+    parse_processes=settings.TREND_PARSE_PROCESSES,
+    ranker=TrendRanker(
+        TrendHistory(settings.TRENDS_DB_PATH, retention=settings.TREND_HISTORY_RETENTION),
+        token_budget=settings.TREND_DIGEST_TOKENS,
+        max_items=settings.TREND_DIGEST_MAX_ITEMS,
+        per_source=settings.TREND_SOURCE_LIMIT,
+        threshold=settings.TREND_DUPLICATE_THRESHOLD,
+    ),
+)
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class _SharedStream:
+    """Один поток-источник, который читают несколько подписчиков"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self._cond = asyncio.Condition()
+
+    async def feed(self, source: AsyncIterator[Any]):
+        try:
+            async for chunk in source:
+                async with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        # Подписчик, пришедший позже, получает поток с самого начала
+        position = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: len(self.chunks) > position or self.done)
+                new = self.chunks[position:]
+                position += len(new)
+                finished = self.done and position >= len(self.chunks)
+
+            for chunk in new:
+                yield chunk
+
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """
+    Схлопывание одинаковых запросов, выполняющихся одновременно.
+
+    Все вызывающие с одним ключом ждут один общий future. Отмена одного
+    ожидающего (например, упавший хендлер) не отменяет общий запрос:
+    остальные получат результат.
+    """
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._streams: Dict[Hashable, _SharedStream] = {}
+
+        self.stats = {
+            "calls": 0,
+            "executions": 0,
+            "deduplicated": 0,
+        }
+
+    def _forget(self, registry: dict, key: Hashable, value):
+        if registry.get(key) is value:
+            del registry[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats["calls"] += 1
+
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.stats["executions"] += 1
+
+            def _done(t: asyncio.Future):
+                self._forget(self._calls, key, t)
+                # Помечаем исключение прочитанным, даже если все ожидающие ушли
+                if not t.cancelled() and t.exception() is not None:
+                    logger.debug(f"[{self.name}] shared call failed: {t.exception()}")
+
+            task.add_done_callback(_done)
+        else:
+            self.stats["deduplicated"] += 1
+
+        return await asyncio.shield(task)
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        self.stats["calls"] += 1
+
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = _SharedStream()
+            self._streams[key] = shared
+            self.stats["executions"] += 1
+
+            shared.task = asyncio.ensure_future(shared.feed(factory()))
+            shared.task.add_done_callback(lambda _: self._forget(self._streams, key, shared))
+        else:
+            self.stats["deduplicated"] += 1
+
+        async for chunk in shared.subscribe():
+            yield chunk
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Optional
+
+from app.utils.ratelimit import BATCH, priority_class
+
+logger = logging.getLogger(__name__)
+
+# Номер строки дайджеста: "3. история | динамика | источники"
+_LINE_NUMBER_RE = re.compile(r"^\d+\.\s+", re.MULTILINE)
+
+
+def format_age(seconds: float) -> str:
+    """Человекочитаемый возраст снимка"""
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "только что"
+    if minutes < 60:
+        return f"{minutes} мин назад"
+    return f"{minutes // 60} ч {minutes % 60} мин назад"
+
+
+class TrendSnapshot:
+    """Готовый результат сканера: сырые тренды и анализ Claude"""
+
+    def __init__(
+        self,
+        raw: str,
+        analysis: str,
+        fingerprint: str,
+        created_at: Optional[float] = None,
+        checked_at: Optional[float] = None,
+    ):
+        self.raw = raw
+        self.analysis = analysis
+        self.fingerprint = fingerprint
+        self.created_at = created_at or time.time()
+        self.checked_at = checked_at or self.created_at
+
+    def to_json(self) -> str:
+        return json.dumps(self.__dict__, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "TrendSnapshot":
+        return cls(**json.loads(raw))
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.checked_at
+
+
+class TrendSnapshotService:
+    """
+    Фоновое обновление снимка трендов.
+
+    Снимок общий для всех пользователей, поэтому хендлер отвечает из него
+    мгновенно. Интервал обновления подстраивается под источник: если
+    данные не меняются, опрашиваем реже, если меняются - чаще.
+    """
+
+    JOB_ID = "trend_snapshot"
+    CACHE_KEY = "trend_snapshot"
+
+    def __init__(
+        self,
+        scraper,
+        claude,
+        max_age: float = 3600,
+        interval: float = 1800,
+        min_interval: float = 600,
+        max_interval: float = 7200,
+        shared_cache=None,
+        warmup_delay: float = 0,
+    ):
+        self.scraper = scraper
+        self.claude = claude
+        self.max_age = max_age
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # Общий кэш нужен, когда обновляет только воркер-лидер
+        self.shared_cache = shared_cache
+        # Первое обновление откладывается, чтобы не мешать холодному старту
+        self.warmup_delay = warmup_delay
+
+        self.snapshot: Optional[TrendSnapshot] = None
+        self._scheduler = None
+
+        self.stats = {
+            "refreshes": 0,
+            "unchanged": 0,
+            "failures": 0,
+        }
+
+    @staticmethod
+    def fingerprint(raw: str) -> str:
+        # Отпечаток - набор строк, а не их порядок: близкие по весу истории
+        # меняются местами между сборами, а анализ от этого не устаревает
+        lines = sorted(_LINE_NUMBER_RE.sub("", raw).splitlines())
+        return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+
+    async def current(self) -> Optional[TrendSnapshot]:
+        """Свежий снимок или None, если его нет или он устарел"""
+        if self.snapshot is not None and self.snapshot.age <= self.max_age:
+            return self.snapshot
+
+        # Снимок мог обновить другой воркер
+        if self.shared_cache is not None:
+            cached = await self.shared_cache.get(self.CACHE_KEY)
+            if cached is not None:
+                snapshot = TrendSnapshot.from_json(cached)
+                if snapshot.age <= self.max_age:
+                    self.snapshot = snapshot
+                    return snapshot
+        return None
+
+    async def _publish(self):
+        if self.shared_cache is not None and self.snapshot is not None:
+            await self.shared_cache.set(self.CACHE_KEY, self.snapshot.to_json(), self.max_age)
+
+    async def store(self, raw: str, analysis: str) -> TrendSnapshot:
+        self.snapshot = TrendSnapshot(raw, analysis, self.fingerprint(raw))
+        await self._publish()
+        return self.snapshot
+
+    def schedule(self, scheduler):
+        """Регистрация периодического обновления в NotificationScheduler"""
+        self._scheduler = scheduler
+        scheduler.add_interval_job(self.refresh, self.interval, self.JOB_ID, first_run_in=self.warmup_delay)
+
+    def _adapt_interval(self, changed: bool):
+        if changed:
+            interval = max(self.min_interval, self.interval / 2)
+        else:
+            interval = min(self.max_interval, self.interval * 1.5)
+
+        if interval != self.interval:
+            self.interval = interval
+            if self._scheduler is not None:
+                self._scheduler.reschedule_interval(self.JOB_ID, interval)
+
+    async def refresh(self):
+        try:
+            raw = await self.scraper.get_all_trends()
+            fingerprint = self.fingerprint(raw)
+
+            # Источник не изменился - анализ остается актуальным
+            if self.snapshot is not None and self.snapshot.fingerprint == fingerprint:
+                self.snapshot.checked_at = time.time()
+                await self._publish()
+                self.stats["unchanged"] += 1
+                self._adapt_interval(changed=False)
+                return
+
+            # Фоновое обновление - самый низкий приоритет у Claude
+            with priority_class(BATCH):
+                analysis = await self.claude.analyze_trends(raw)
+            if not analysis:
+                self.stats["failures"] += 1
+                return
+
+            await self.store(raw, analysis)
+            self.stats["refreshes"] += 1
+            self._adapt_interval(changed=True)
+            logger.info(f"Trend snapshot refreshed, next in {self.interval:.0f}s")
+        except Exception as e:
+            self.stats["failures"] += 1
+            logger.error(f"Trend snapshot refresh failed: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "interval": self.interval,
+            "age": round(self.snapshot.age) if self.snapshot else None,
+        }
+
+
+from app.config import settings
+from app.claude_api import claude_api
+from app.utils.cache import response_cache
+from app.utils.scraping import trend_scraper
+
+# Singleton экземпляр
+trend_snapshots = TrendSnapshotService(
+    trend_scraper,
+    claude_api,
+    max_age=settings.TRENDS_SNAPSHOT_MAX_AGE,
+    interval=settings.TRENDS_REFRESH_INTERVAL,
+    min_interval=settings.TRENDS_REFRESH_MIN,
+    max_interval=settings.TRENDS_REFRESH_MAX,
+    shared_cache=response_cache,
+    warmup_delay=settings.TRENDS_WARMUP_DELAY,
+)
@@ -0,0 +1,34 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Длительность фаз холодного старта: импорт, подключения, вебхук"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, name: str, started: float):
+        self.phases[name] = round(time.perf_counter() - started, 4)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, started)
+            logger.info(f"Startup phase {name}: {self.phases[name]:.3f}s")
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        phases = ", ".join(f"{name}={duration:.3f}s" for name, duration in self.phases.items())
+        logger.info(f"Startup finished in {total:.3f}s ({phases})")
+
+    def get_stats(self) -> dict:
+        return dict(self.phases)
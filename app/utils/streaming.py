@@ -0,0 +1,271 @@
+import asyncio
+import html
+import json
+import logging
+import secrets
+import time
+from typing import AsyncIterator, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from app.utils.formatter import TELEGRAM_LIMIT, close_tags, paginate, strip_tags
+
+logger = logging.getLogger(__name__)
+
+INTERRUPTED_NOTE = "\n\n⚠️ <i>Ответ прерван. Попробуйте запросить его еще раз позже.</i>"
+
+
+class ReplyPage(CallbackData, prefix="page"):
+    reply_id: str
+    page: int
+
+
+def _is_not_modified(error: TelegramBadRequest) -> bool:
+    # Текст не изменился - это не ошибка
+    return "message is not modified" in str(error).lower()
+
+
+def _preview(header: str, body: str, footer: str) -> str:
+    # Пока текст не готов, HTML может быть незакрытым - экранируем
+    body = html.escape(body)
+    budget = TELEGRAM_LIMIT - len(header) - len(footer) - 10
+    if len(body) > budget:
+        body = "…" + body[-budget:]
+    return f"{header}{body}{footer}"
+
+
+class ChatAction:
+    """
+    Индикатор "печатает..." вместо сообщения-заглушки.
+
+    Telegram гасит индикатор через ~5 секунд или при первом сообщении бота,
+    поэтому он повторяется, пока ответ не начал появляться.
+    """
+
+    def __init__(self, message: Message, action: str = "typing", interval: float = 4.5):
+        self.message = message
+        self.action = action
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.message.bot.send_chat_action(self.message.chat.id, self.action)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                logger.warning(f"Chat action failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def __aenter__(self) -> "ChatAction":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.stop()
+
+
+class ReplyPipeline:
+    """
+    Единый путь ответа хендлеров.
+
+    Пока идет работа - индикатор набора, без заглушки. Потоковый ответ
+    показывается одним сообщением с редкими правками, готовый ответ -
+    одной финальной правкой (или одним сообщением, если потока не было).
+    Длинный ответ режется на страницы по границам разделов; страницы
+    лежат в общем кэше и отдаются по кнопкам "Дальше" по требованию.
+    """
+
+    def __init__(
+        self,
+        cache=None,
+        ttl: float = 86400,
+        page_limit: int = TELEGRAM_LIMIT,
+        interval: float = 1.5,
+        min_delta: int = 40,
+    ):
+        self.cache = cache
+        self.ttl = ttl
+        self.page_limit = page_limit
+        self.interval = interval
+        self.min_delta = min_delta
+
+    def typing(self, message: Message) -> ChatAction:
+        return ChatAction(message)
+
+    # --- Страницы ---
+
+    @staticmethod
+    def keyboard(
+        reply_id: Optional[str],
+        page: int,
+        total: int,
+        extra: Optional[List[List[dict]]] = None,
+    ) -> Optional[InlineKeyboardMarkup]:
+        rows = []
+        if total > 1:
+            pager = []
+            if page > 0:
+                pager.append(InlineKeyboardButton(
+                    text=f"◀️ {page}/{total}",
+                    callback_data=ReplyPage(reply_id=reply_id, page=page - 1).pack(),
+                ))
+            if page < total - 1:
+                pager.append(InlineKeyboardButton(
+                    text=f"Дальше ▶️ {page + 2}/{total}",
+                    callback_data=ReplyPage(reply_id=reply_id, page=page + 1).pack(),
+                ))
+            rows.append(pager)
+        rows.extend([InlineKeyboardButton(**button) for button in row] for row in extra or [])
+        return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+    async def _paginate(self, text: str, markup: Optional[InlineKeyboardMarkup]):
+        """Первая страница и клавиатура; остальные страницы - в кэш"""
+        pages = paginate(text, self.page_limit)
+        extra = [
+            [button.model_dump(exclude_none=True) for button in row]
+            for row in (markup.inline_keyboard if markup else [])
+        ]
+        reply_id = None
+        if len(pages) > 1 and self.cache is not None:
+            reply_id = secrets.token_urlsafe(8)
+            payload = json.dumps({"pages": pages, "extra": extra}, ensure_ascii=False)
+            await self.cache.set(f"reply:{reply_id}", payload, self.ttl)
+        elif len(pages) > 1:
+            # Без кэша страницы не достать - показываем первую
+            pages = pages[:1]
+        return pages[0], self.keyboard(reply_id, 0, len(pages), extra)
+
+    async def page(self, reply_id: str, page: int):
+        """Страница сохраненного ответа: (текст, клавиатура) или None, если устарел"""
+        payload = await self.cache.get(f"reply:{reply_id}") if self.cache is not None else None
+        if payload is None:
+            return None
+        data = json.loads(payload)
+        pages = data["pages"]
+        page = max(0, min(page, len(pages) - 1))
+        return pages[page], self.keyboard(reply_id, page, len(pages), data["extra"])
+
+    # --- Отправка ---
+
+    async def send(self, message: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> Message:
+        """Готовый ответ одним сообщением"""
+        first, markup = await self._paginate(text, reply_markup)
+        try:
+            return await message.answer(first, parse_mode="HTML", reply_markup=markup)
+        except TelegramBadRequest as e:
+            # Ответ Claude сломал HTML-разметку - показываем без нее
+            logger.warning(f"HTML reply rejected: {e}")
+            return await message.answer(strip_tags(first), parse_mode=None, reply_markup=markup)
+
+    async def edit(self, msg: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Финальная правка уже отправленного сообщения"""
+        first, markup = await self._paginate(text, reply_markup)
+        for attempt in range(2):
+            try:
+                await msg.edit_text(first, parse_mode="HTML", reply_markup=markup)
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Final edit throttled for {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if _is_not_modified(e):
+                    return
+                logger.warning(f"HTML edit rejected: {e}")
+                break
+        try:
+            await msg.edit_text(strip_tags(first), parse_mode=None, reply_markup=markup)
+        except TelegramBadRequest as e:
+            if not _is_not_modified(e):
+                logger.error(f"Final edit failed: {e}")
+
+    async def stream(
+        self,
+        message: Message,
+        chunks: AsyncIterator[str],
+        header: str = "",
+        footer: str = "",
+        error: str = "❌ Ошибка при анализе. Попробуйте позже.",
+        action: Optional[ChatAction] = None,
+    ) -> Optional[str]:
+        """
+        Потоковый ответ: индикатор набора до первого текста, затем одно
+        сообщение с редкими правками и финальная правка с постраничным
+        ответом. Возвращает собранный текст; None - ответа нет или поток
+        оборвался (показанный текст помечен как прерванный, сохранять его
+        нельзя).
+        
+        action - индикатор, запущенный хендлером еще до запроса к Claude.
+        """
+        parts = []
+        length = 0
+        shown = 0
+        msg: Optional[Message] = None
+        next_edit = time.monotonic() + self.interval / 2
+        interrupted = False
+
+        action = action or self.typing(message)
+        action.start()
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                length += len(chunk)
+
+                now = time.monotonic()
+                if now < next_edit or length - shown < self.min_delta:
+                    continue
+
+                preview = _preview(header, "".join(parts), "\n\n⏳ ...")
+                try:
+                    if msg is None:
+                        msg = await message.answer(preview, parse_mode="HTML")
+                        action.stop()
+                    else:
+                        await msg.edit_text(preview, parse_mode="HTML")
+                    shown = length
+                    next_edit = now + self.interval
+                except TelegramRetryAfter as e:
+                    # Telegram просит подождать - просто откладываем следующую правку
+                    next_edit = now + e.retry_after
+                except TelegramBadRequest as e:
+                    if not _is_not_modified(e):
+                        logger.warning(f"Preview rejected: {e}")
+                    next_edit = now + self.interval
+        except Exception as e:
+            logger.error(f"Reply stream failed: {e}")
+            interrupted = True
+        finally:
+            action.stop()
+
+        text = "".join(parts)
+        if not text:
+            final = error
+        elif interrupted:
+            final = f"{header}{close_tags(text)}{INTERRUPTED_NOTE}"
+        else:
+            final = f"{header}{text}{footer}"
+        if msg is None:
+            await self.send(message, final)
+        else:
+            await self.edit(msg, final)
+        return None if interrupted else text or None
+
+
+from app.config import settings
+from app.utils.cache import response_cache
+
+# Singleton экземпляр
+reply_pipeline = ReplyPipeline(response_cache, ttl=settings.REPLY_PAGES_TTL)
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """Подписчик рассылки и его настройки доставки"""
+
+    __slots__ = ("user_id", "active", "timezone", "delivery_time", "blocked", "created_at")
+
+    def __init__(
+        self,
+        user_id: int,
+        active: bool = True,
+        timezone: Optional[str] = None,
+        delivery_time: Optional[str] = None,
+        blocked: bool = False,
+        created_at: Optional[float] = None,
+    ):
+        self.user_id = user_id
+        self.active = active
+        self.timezone = timezone
+        self.delivery_time = delivery_time
+        self.blocked = blocked
+        self.created_at = created_at or time.time()
+
+    @property
+    def receives(self) -> bool:
+        return self.active and not self.blocked
+
+
+class SubscriberStore:
+    """
+    Хранилище подписчиков: индекс в памяти + SQLite в режиме WAL.
+
+    Проверки и перебор идут только по памяти. Каждое изменение - одна
+    атомарная запись строки в пуле потоков, event loop не блокируется.
+    При первом запуске переносит подписчиков из старого subscribers.json.
+    """
+
+    def __init__(self, db_path: str, legacy_json: Optional[str] = None):
+        self.db_path = db_path
+        self.legacy_json = legacy_json
+
+        self._index: Dict[int, Subscriber] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    # --- SQLite (вызывается из пула потоков) ---
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscribers ("
+            "user_id INTEGER PRIMARY KEY, "
+            "active INTEGER NOT NULL DEFAULT 1, "
+            "timezone TEXT, "
+            "delivery_time TEXT, "
+            "blocked INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    def _load_sync(self) -> List[Subscriber]:
+        with self._lock:
+            self._conn = self._open()
+            self._migrate_json()
+            rows = self._conn.execute(
+                "SELECT user_id, active, timezone, delivery_time, blocked, created_at FROM subscribers"
+            ).fetchall()
+        return [
+            Subscriber(user_id, bool(active), tz, delivery_time, bool(blocked), created_at)
+            for user_id, active, tz, delivery_time, blocked, created_at in rows
+        ]
+
+    def _migrate_json(self):
+        """Одноразовый перенос subscribers.json в SQLite"""
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return
+        try:
+            with open(self.legacy_json, "r") as f:
+                user_ids = [int(uid) for uid in json.load(f)]
+        except Exception as e:
+            logger.error(f"Cannot read legacy subscribers file: {e}")
+            return
+
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO subscribers (user_id, created_at, updated_at) VALUES (?, ?, ?)",
+                [(uid, now, now) for uid in user_ids],
+            )
+        os.replace(self.legacy_json, f"{self.legacy_json}.migrated")
+        logger.info(f"Migrated {len(user_ids)} subscribers from {self.legacy_json}")
+
+    def _read_one_sync(self, user_id: int) -> Optional[Subscriber]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_id, active, timezone, delivery_time, blocked, created_at "
+                "FROM subscribers WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        uid, active, tz, delivery_time, blocked, created_at = row
+        return Subscriber(uid, bool(active), tz, delivery_time, bool(blocked), created_at)
+
+    def _write_sync(self, sub: Subscriber):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO subscribers "
+                    "(user_id, active, timezone, delivery_time, blocked, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET "
+                    "active = excluded.active, timezone = excluded.timezone, "
+                    "delivery_time = excluded.delivery_time, blocked = excluded.blocked, "
+                    "updated_at = excluded.updated_at",
+                    (
+                        sub.user_id,
+                        int(sub.active),
+                        sub.timezone,
+                        sub.delivery_time,
+                        int(sub.blocked),
+                        sub.created_at,
+                        time.time(),
+                    ),
+                )
+
+    # --- Публичный API ---
+
+    async def load(self):
+        async with self._load_lock:
+            if self._loaded:
+                return
+            subscribers = await asyncio.to_thread(self._load_sync)
+            self._index = {sub.user_id: sub for sub in subscribers}
+            self._loaded = True
+            logger.info(f"Loaded {self.count()} active subscribers")
+
+    async def reload(self):
+        """Полная перечитка индекса (другие воркеры могли изменить базу)"""
+        async with self._load_lock:
+            subscribers = await asyncio.to_thread(self._reload_sync)
+            self._index = {sub.user_id: sub for sub in subscribers}
+            self._loaded = True
+
+    def _reload_sync(self) -> List[Subscriber]:
+        if self._conn is None:
+            return self._load_sync()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, active, timezone, delivery_time, blocked, created_at FROM subscribers"
+            ).fetchall()
+        return [
+            Subscriber(user_id, bool(active), tz, delivery_time, bool(blocked), created_at)
+            for user_id, active, tz, delivery_time, blocked, created_at in rows
+        ]
+
+    async def refresh(self, user_id: int) -> Optional[Subscriber]:
+        """Перечитка одной записи из базы - O(1)"""
+        await self.load()
+        sub = await asyncio.to_thread(self._read_one_sync, user_id)
+        if sub is None:
+            self._index.pop(user_id, None)
+        else:
+            self._index[user_id] = sub
+        return sub
+
+    async def _save(self, sub: Subscriber):
+        await self.load()
+        try:
+            await asyncio.to_thread(self._write_sync, sub)
+        except Exception as e:
+            logger.error(f"Error saving subscriber {sub.user_id}: {e}")
+
+    def get(self, user_id: int) -> Optional[Subscriber]:
+        return self._index.get(user_id)
+
+    def is_subscribed(self, user_id: int) -> bool:
+        sub = self._index.get(user_id)
+        return sub is not None and sub.receives
+
+    async def subscribe(self, user_id: int, **meta) -> Subscriber:
+        await self.load()
+        sub = self._index.get(user_id)
+        if sub is None:
+            sub = Subscriber(user_id)
+            self._index[user_id] = sub
+        sub.active = True
+        sub.blocked = False
+        for field, value in meta.items():
+            setattr(sub, field, value)
+        await self._save(sub)
+        return sub
+
+    async def unsubscribe(self, user_id: int):
+        await self.load()
+        sub = self._index.get(user_id)
+        if sub is None or not sub.active:
+            return
+        sub.active = False
+        await self._save(sub)
+
+    async def toggle(self, user_id: int) -> bool:
+        """Переключение подписки; возвращает новое состояние"""
+        await self.refresh(user_id)
+        if self.is_subscribed(user_id):
+            await self.unsubscribe(user_id)
+            return False
+        await self.subscribe(user_id)
+        return True
+
+    async def update(self, user_id: int, **meta) -> Optional[Subscriber]:
+        """Обновление настроек (timezone, delivery_time, blocked)"""
+        await self.load()
+        sub = self._index.get(user_id)
+        if sub is None:
+            return None
+        for field, value in meta.items():
+            setattr(sub, field, value)
+        await self._save(sub)
+        return sub
+
+    async def mark_blocked(self, user_id: int):
+        await self.update(user_id, blocked=True)
+
+    def iter_batches(self, batch_size: int = 500) -> Iterator[List[Subscriber]]:
+        """Перебор получателей пачками (снимок индекса на момент вызова)"""
+        recipients = [sub for sub in self._index.values() if sub.receives]
+        for i in range(0, len(recipients), batch_size):
+            yield recipients[i:i + batch_size]
+
+    def count(self) -> int:
+        return sum(1 for sub in self._index.values() if sub.receives)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._loaded = False
+
+
+from app.config import settings
+
+# Singleton экземпляр
+subscriber_store = SubscriberStore(settings.SUBSCRIBERS_DB_PATH, legacy_json="subscribers.json")
@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+from typing import Dict, Iterator, List, Optional
+
+from aiogram import Bot
+
+from app.utils.broadcast import BroadcastEngine
+from app.utils.delivery import DailyDelivery, DeliveryPlanner
+from app.utils.metrics import TENANT_CLAUDE_JOBS, TENANT_UPDATES
+from app.utils.ratelimit import TokenBucket
+from app.utils.subscribers import SubscriberStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+
+
+class TenantQuota:
+    """
+    Доля общих ресурсов процесса, которую может занять один бот.
+
+    max_queued - апдейтов бота в общей очереди вебхука (None - без предела),
+    claude_per_hour - задач Claude из чата в час (0 - без предела). Предел
+    скользящий: ведро токенов на час с поминутным пополнением.
+    """
+
+    def __init__(self, tenant: str, max_queued: Optional[int] = None, claude_per_hour: int = 0):
+        self.tenant = tenant
+        self.max_queued = max_queued
+        self.claude_per_hour = claude_per_hour
+        self._claude = TokenBucket(claude_per_hour / 60, capacity=claude_per_hour) if claude_per_hour > 0 else None
+
+        self.stats = {
+            "updates_accepted": 0,
+            "updates_rejected": 0,
+            "claude_allowed": 0,
+            "claude_rejected": 0,
+        }
+
+    def record_update(self, accepted: bool):
+        result = "accepted" if accepted else "rejected"
+        self.stats[f"updates_{result}"] += 1
+        TENANT_UPDATES.inc(tenant=self.tenant, result=result)
+
+    def admit_claude(self) -> bool:
+        """Списывает задачу Claude с квоты; False - квота на этот час исчерпана"""
+        if self._claude is not None and self._claude.delay_for(1) > 0:
+            self.stats["claude_rejected"] += 1
+            TENANT_CLAUDE_JOBS.inc(tenant=self.tenant, result="rejected")
+            return False
+        if self._claude is not None:
+            self._claude.take(1)
+        self.stats["claude_allowed"] += 1
+        TENANT_CLAUDE_JOBS.inc(tenant=self.tenant, result="allowed")
+        return True
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "max_queued": self.max_queued,
+            "claude_per_hour": self.claude_per_hour,
+            "claude_left": int(self._claude.tokens) if self._claude is not None else None,
+        }
+
+
+class Tenant:
+    """
+    Бот-арендатор: свой токен, вебхук, подписчики и рассылка.
+
+    Диспетчер, очередь апдейтов, HTTP-сессии, лимитер и кэш Claude общие
+    для всех ботов процесса; бот получает их через TenantRegistry.connect.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        token: str,
+        webhook_path: str,
+        subscribers: SubscriberStore,
+        broadcast: BroadcastEngine,
+        delivery: DailyDelivery,
+        quota: TenantQuota,
+    ):
+        self.name = name
+        self.token = token
+        self.webhook_path = webhook_path
+        self.subscribers = subscribers
+        self.broadcast = broadcast
+        self.delivery = delivery
+        self.quota = quota
+        self.bot: Optional[Bot] = None
+
+    @property
+    def planner(self) -> DeliveryPlanner:
+        return self.delivery.planner
+
+    async def send_daily(self, user_id: int, text: str):
+        await self.bot.send_message(chat_id=user_id, text=text, parse_mode="HTML")
+
+    def close(self):
+        self.subscribers.close()
+        self.broadcast.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "webhook_path": self.webhook_path,
+            "subscribers": self.subscribers.count(),
+            "quota": self.quota.get_stats(),
+            "daily_delivery": self.delivery.get_stats(),
+            "last_broadcast": self.broadcast.last_report,
+        }
+
+
+def build_tenant(spec: dict, settings, claude) -> Tenant:
+    """
+    Арендатор из записи TENANTS_FILE.
+
+    Обязательны name и token (или token_env - имя переменной окружения
+    с токеном); остальное берется из общих настроек.
+    """
+    name = spec["name"]
+    token = spec.get("token") or os.getenv(spec.get("token_env", ""))
+    if not token:
+        raise ValueError(f"Tenant {name} has no bot token")
+
+    db_path = spec.get("subscribers_db", f"subscribers-{name}.db")
+    subscribers = SubscriberStore(db_path)
+    broadcast = BroadcastEngine(
+        db_path,
+        rate_per_second=float(spec.get("broadcast_rate", settings.BROADCAST_RATE)),
+        concurrency=settings.BROADCAST_CONCURRENCY,
+        tenant=name,
+    )
+    planner = DeliveryPlanner(
+        spec.get("notification_time", settings.NOTIFICATION_TIME),
+        spec.get("timezone", settings.TIMEZONE),
+        slot_minutes=settings.NOTIFICATION_SLOT_MINUTES,
+    )
+    delivery = DailyDelivery(
+        planner,
+        subscribers,
+        broadcast,
+        claude,
+        lead_time=settings.NOTIFICATION_LEAD_TIME,
+        sync_interval=settings.NOTIFICATION_SYNC_INTERVAL,
+        tenant=name,
+    )
+    quota = TenantQuota(
+        name,
+        max_queued=int(spec.get("max_queued", settings.TENANT_MAX_QUEUED)),
+        claude_per_hour=int(spec.get("claude_jobs_per_hour", settings.TENANT_CLAUDE_JOBS_PER_HOUR)),
+    )
+    return Tenant(
+        name,
+        token,
+        spec.get("webhook_path", f"{settings.WEBHOOK_PATH}/{name}"),
+        subscribers,
+        broadcast,
+        delivery,
+        quota,
+    )
+
+
+def load_tenants(path: str, settings, claude) -> List[Tenant]:
+    """Арендаторы из JSON-файла: список объектов (см. build_tenant)"""
+    with open(path, "r") as f:
+        specs = json.load(f)
+    tenants = [build_tenant(spec, settings, claude) for spec in specs]
+    logger.info(f"Loaded {len(tenants)} tenants from {path}")
+    return tenants
+
+
+class TenantRegistry:
+    """
+    Боты, которых обслуживает процесс.
+
+    Все боты ходят в Bot API через одну HTTP-сессию (общий пул соединений),
+    апдейт находит своего арендатора по пути вебхука, а вызов Bot API -
+    по id бота.
+    """
+
+    def __init__(self, tenants: List[Tenant]):
+        self.tenants: Dict[str, Tenant] = {}
+        self._by_path: Dict[str, Tenant] = {}
+        self._by_bot_id: Dict[int, Tenant] = {}
+        for tenant in tenants:
+            if tenant.name in self.tenants:
+                raise ValueError(f"Duplicate tenant name: {tenant.name}")
+            if tenant.webhook_path in self._by_path:
+                raise ValueError(f"Duplicate webhook path: {tenant.webhook_path}")
+            self.tenants[tenant.name] = tenant
+            self._by_path[tenant.webhook_path] = tenant
+
+    def __iter__(self) -> Iterator[Tenant]:
+        return iter(self.tenants.values())
+
+    def __len__(self) -> int:
+        return len(self.tenants)
+
+    def get(self, name: str) -> Optional[Tenant]:
+        return self.tenants.get(name)
+
+    def by_path(self, path: str) -> Optional[Tenant]:
+        return self._by_path.get(path)
+
+    def connect(self, session, default=None):
+        """Бот на каждого арендатора поверх общей сессии Bot API"""
+        for tenant in self:
+            tenant.bot = Bot(token=tenant.token, session=session, default=default)
+            self._by_bot_id[tenant.bot.id] = tenant
+
+    def name_of(self, bot) -> str:
+        tenant = self._by_bot_id.get(bot.id)
+        return tenant.name if tenant is not None else "unknown"
+
+    def close(self):
+        for tenant in self:
+            tenant.close()
+
+    def get_stats(self) -> dict:
+        return {tenant.name: tenant.get_stats() for tenant in self}
+
+
+from app.config import settings
+from app.claude_api import claude_api
+from app.utils.broadcast import broadcast_engine
+from app.utils.delivery import daily_delivery
+from app.utils.subscribers import subscriber_store
+
+# Singleton экземпляр: без TENANTS_FILE - один бот из переменных окружения
+tenant_registry = TenantRegistry(
+    load_tenants(settings.TENANTS_FILE, settings, claude_api)
+    if settings.TENANTS_FILE
+    else [
+        Tenant(
+            DEFAULT_TENANT,
+            settings.TELEGRAM_BOT_TOKEN,
+            settings.WEBHOOK_PATH,
+            subscriber_store,
+            broadcast_engine,
+            daily_delivery,
+            TenantQuota(DEFAULT_TENANT, claude_per_hour=settings.TENANT_CLAUDE_JOBS_PER_HOUR),
+        )
+    ]
+)
@@ -0,0 +1,131 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods.base import Response, TelegramMethod, TelegramType
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("name", "started", "duration", "attrs")
+
+    def __init__(self, name: str, started: float, duration: float, attrs: Dict[str, Any]):
+        self.name = name
+        self.started = started
+        self.duration = duration
+        self.attrs = attrs
+
+
+class Trace:
+    """
+    Трасса одного апдейта: плоский список отрезков времени.
+
+    Отрезки из параллельных задач пересекаются по времени - это видно
+    по смещению от начала трассы, вложенность не отслеживается.
+    """
+
+    def __init__(self, name: str, max_spans: int = 200, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.max_spans = max_spans
+        self.started = time.monotonic()
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+    def add(self, name: str, started: float, duration: float, attrs: Dict[str, Any]):
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        self.spans.append(Span(name, started, duration, attrs))
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def totals(self) -> Dict[str, float]:
+        """Суммарное время по именам отрезков"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        return totals
+
+    def breakdown(self) -> str:
+        attrs = " ".join(f"{k}={v}" for k, v in self.attrs.items())
+        lines = [f"{self.name} {attrs} total={self.elapsed:.3f}s"]
+        for span in sorted(self.spans, key=lambda s: s.started):
+            span_attrs = " ".join(f"{k}={v}" for k, v in span.attrs.items())
+            lines.append(
+                f"  +{span.started - self.started:7.3f}s {span.duration:7.3f}s  {span.name} {span_attrs}".rstrip()
+            )
+        if self.dropped:
+            lines.append(f"  ... {self.dropped} spans dropped")
+        for name, total in sorted(self.totals().items(), key=lambda item: -item[1]):
+            lines.append(f"  total {name}: {total:.3f}s")
+        return "\n".join(lines)
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def annotate(**attrs):
+    """Дополнительные атрибуты текущей трассы (например, имя хендлера)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def add_span(name: str, started: float, duration: float, **attrs):
+    """Уже измеренный отрезок (started - time.monotonic())"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, started, duration, attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Отрезок времени в текущей трассе.
+
+    Вне трассы (фоновые задачи, рассылка) ничего не записывает. Задачи,
+    созданные внутри апдейта, наследуют трассу через contextvars.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.monotonic() - started, attrs)
+
+
+@contextmanager
+def start_trace(name: str, **attrs):
+    trace = Trace(name, **attrs)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+class BotAPITracingMiddleware(BaseRequestMiddleware):
+    """Отрезок на каждый вызов Bot API (sendMessage, editMessageText, ...)"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with span(f"bot.{method.__api_method__}"):
+            return await make_request(bot, method)
@@ -0,0 +1,384 @@
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Вес комментария относительно апвоута: обсуждение - более сильный сигнал
+COMMENT_WEIGHT = 2.0
+# Бонус за каждый дополнительный источник, где всплыла та же история
+SOURCE_WEIGHT = 1.0
+
+_PRIME = (1 << 31) - 1
+
+
+class TrendItem:
+    """Одна запись источника с сигналами для ранжирования"""
+
+    __slots__ = ("key", "source", "title", "link", "rank", "score", "comments", "published_at", "velocity", "is_new")
+
+    def __init__(
+        self,
+        source: str,
+        title: str,
+        link: str,
+        rank: int,
+        score: int = 0,
+        comments: int = 0,
+        published_at: Optional[float] = None,
+    ):
+        self.key = hashlib.sha1(f"{source}|{link or title}".encode("utf-8")).hexdigest()[:16]
+        self.source = source
+        self.title = title
+        self.link = link
+        self.rank = rank
+        self.score = score
+        self.comments = comments
+        self.published_at = published_at
+        self.velocity = 0.0
+        self.is_new = True
+
+    @classmethod
+    def from_entry(cls, source: str, rank: int, entry: dict) -> "TrendItem":
+        return cls(
+            source,
+            " ".join((entry.get("title") or "").split()),
+            entry.get("link") or "",
+            rank,
+            score=int(entry.get("score") or 0),
+            comments=int(entry.get("comments") or 0),
+            published_at=entry.get("published_at"),
+        )
+
+
+class TrendHistory:
+    """
+    Временной ряд наблюдений трендов в SQLite (WAL).
+
+    На каждый сбор - строка на запись: позиция в ленте, очки, комментарии.
+    Старше retention секунд строки удаляются, так что таблица остается
+    компактной при любом числе сборов.
+    """
+
+    def __init__(self, db_path: str, retention: float = 259200):
+        self.db_path = db_path
+        self.retention = retention
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS trend_observations ("
+                "item_key TEXT NOT NULL, observed_at REAL NOT NULL, "
+                "rank INTEGER, score INTEGER, comments INTEGER, "
+                "PRIMARY KEY (item_key, observed_at))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS trend_observations_time ON trend_observations (observed_at)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def record(self, items: List[TrendItem], now: float) -> Dict[str, dict]:
+        """
+        Сохранение наблюдений; возвращает предыдущее состояние каждой записи.
+
+        {key: {"observed_at", "rank", "score", "comments", "first_seen"}}
+        """
+        keys = [item.key for item in items]
+        previous: Dict[str, dict] = {}
+        with self._lock:
+            conn = self._db()
+            # Лимит параметров SQLite - читаем пачками
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    "SELECT o.item_key, o.observed_at, o.rank, o.score, o.comments, l.first_seen "
+                    "FROM trend_observations o JOIN ("
+                    f"SELECT item_key, MAX(observed_at) AS last, MIN(observed_at) AS first_seen "
+                    f"FROM trend_observations WHERE item_key IN ({marks}) GROUP BY item_key"
+                    ") l ON o.item_key = l.item_key AND o.observed_at = l.last",
+                    chunk,
+                ).fetchall()
+                for key, observed_at, rank, score, comments, first_seen in rows:
+                    previous[key] = {
+                        "observed_at": observed_at,
+                        "rank": rank,
+                        "score": score,
+                        "comments": comments,
+                        "first_seen": first_seen,
+                    }
+
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO trend_observations (item_key, observed_at, rank, score, comments) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(item.key, now, item.rank, item.score, item.comments) for item in items],
+                )
+                conn.execute("DELETE FROM trend_observations WHERE observed_at < ?", (now - self.retention,))
+        return previous
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# --- Скорость роста ---
+
+
+def velocity(item: TrendItem, previous: Optional[dict], now: float) -> float:
+    """Прирост взвешенных реакций в час между сборами"""
+    engagement = item.score + COMMENT_WEIGHT * item.comments
+    if previous is not None and now > previous["observed_at"]:
+        hours = max((now - previous["observed_at"]) / 3600, 1 / 60)
+        before = (previous["score"] or 0) + COMMENT_WEIGHT * (previous["comments"] or 0)
+        return max(engagement - before, 0.0) / hours
+    # Первое наблюдение: средний темп с момента публикации
+    if item.published_at and engagement:
+        hours = max((now - item.published_at) / 3600, 0.25)
+        return engagement / hours
+    return 0.0
+
+
+# --- Кластеризация почти-дубликатов (MinHash + LSH) ---
+
+
+def shingles(title: str, size: int = 4) -> List[int]:
+    """Хэши символьных n-грамм нормализованного заголовка"""
+    text = " ".join(WORD_RE.findall(title.lower()))
+    if len(text) <= size:
+        return [zlib.crc32(text.encode("utf-8")) % _PRIME] if text else []
+    return list({zlib.crc32(text[i:i + size].encode("utf-8")) % _PRIME for i in range(len(text) - size + 1)})
+
+
+class MinHasher:
+    """
+    MinHash-подписи заголовков и LSH по полосам.
+
+    Подписи считаются одной матричной операцией NumPy на заголовок;
+    кандидаты в дубликаты - записи с совпавшей полосой подписи, затем
+    проверка оценкой сходства Жаккара по всей подписи.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.5, seed: int = 1):
+        # NumPy грузится при первом сборе трендов, а не на холодном старте
+        import numpy as np
+
+        self.np = np
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+
+    def signatures(self, titles: List[str]):
+        np = self.np
+        result = np.full((len(titles), self.num_perm), _PRIME, dtype=np.uint64)
+        for i, title in enumerate(titles):
+            hashes = np.array(shingles(title), dtype=np.uint64)
+            if len(hashes):
+                # (a * x + b) mod p для всех перестановок сразу; x, a < 2^31 - без переполнения
+                result[i] = ((np.outer(hashes, self.a) + self.b) % _PRIME).min(axis=0)
+        return result
+
+    def clusters(self, titles: List[str]) -> List[List[int]]:
+        """
+        Группы индексов заголовков, описывающих одну историю.
+
+        Запись сравнивается с первой записью кластера, а не с любым его
+        членом - иначе цепочки "A похож на B, B на C" склеивают разные истории.
+        """
+        np = self.np
+        signatures = self.signatures(titles)
+        groups: Dict[int, List[int]] = {}
+        buckets: Dict[tuple, List[int]] = {}
+
+        for i, signature in enumerate(signatures):
+            keys = [
+                (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)
+            ]
+            root = None
+            if signature[0] != _PRIME:
+                candidates = {head for key in keys for head in buckets.get(key, ())}
+                for head in sorted(candidates):
+                    if np.mean(signatures[head] == signature) >= self.threshold:
+                        root = head
+                        break
+
+            if root is None:
+                groups[i] = [i]
+                for key in keys:
+                    buckets.setdefault(key, []).append(i)
+            else:
+                groups[root].append(i)
+        return list(groups.values())
+
+
+# --- Ранжирование и дайджест ---
+
+
+def estimate_tokens(text: str) -> int:
+    # Та же грубая оценка, что и в ClaudeAPI: ~3 символа на токен для ru/en
+    return len(text) // 3 + 1
+
+
+class TrendCluster:
+    """История, собранная из почти одинаковых записей разных источников"""
+
+    def __init__(self, items: List[TrendItem]):
+        self.items = sorted(items, key=lambda item: (item.rank, -item.score))
+        self.sources = sorted({item.source for item in items})
+        self.velocity = max(item.velocity for item in items)
+        self.best_rank = min(item.rank for item in items)
+        self.is_new = all(item.is_new for item in items)
+        self.weight = (
+            math.log1p(self.velocity)
+            + SOURCE_WEIGHT * (len(self.sources) - 1)
+            + 1.0 / (1 + self.best_rank)
+        )
+
+    @property
+    def title(self) -> str:
+        return self.items[0].title
+
+    def tier(self) -> str:
+        # Ступени вместо точных чисел: дайджест (и отпечаток снимка) меняется,
+        # только когда тренд заметно ускорился или замедлился
+        if self.velocity >= 200:
+            return "🚀 взлет"
+        if self.velocity >= 30:
+            return "📈 растет"
+        if self.is_new:
+            return "🆕 новое"
+        return "➖ стабильно"
+
+
+class TrendRanker:
+    """
+    Локальная обработка трендов перед Claude.
+
+    Записи всех источников сохраняются во временной ряд, получают скорость
+    роста, склеиваются в истории по MinHash и отбираются в топ-K по весу
+    в пределах бюджета токенов. Размер промпта не зависит от числа источников.
+    """
+
+    def __init__(
+        self,
+        history: TrendHistory,
+        token_budget: int = 700,
+        max_items: int = 15,
+        per_source: int = 5,
+        threshold: float = 0.5,
+    ):
+        self.history = history
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self.per_source = per_source
+        self.threshold = threshold
+        self._hasher: Optional[MinHasher] = None
+
+        self.stats = {
+            "items": 0,
+            "clusters": 0,
+            "duplicates": 0,
+            "selected": 0,
+            "digest_tokens": 0,
+            "last_build": 0.0,
+        }
+
+    def rank(self, collected: Dict[str, List[dict]], now: float) -> List[TrendCluster]:
+        items = [
+            TrendItem.from_entry(source, rank, entry)
+            for source, entries in collected.items()
+            for rank, entry in enumerate(entries)
+            if entry.get("title")
+        ]
+        if not items:
+            return []
+
+        previous = self.history.record(items, now)
+        for item in items:
+            state = previous.get(item.key)
+            item.velocity = velocity(item, state, now)
+            item.is_new = state is None or now - state["first_seen"] < 3600
+
+        if self._hasher is None:
+            self._hasher = MinHasher(threshold=self.threshold)
+        groups = self._hasher.clusters([item.title for item in items])
+        clusters = [TrendCluster([items[i] for i in group]) for group in groups]
+        clusters.sort(key=lambda cluster: cluster.weight, reverse=True)
+
+        self.stats["items"] = len(items)
+        self.stats["clusters"] = len(clusters)
+        self.stats["duplicates"] = len(items) - len(clusters)
+        return clusters
+
+    def select(self, clusters: List[TrendCluster], titles: Dict[str, str]) -> List[str]:
+        """Топ-K строк дайджеста: не больше per_source историй с источника и бюджет токенов"""
+        lines: List[str] = []
+        per_source: Dict[str, int] = {}
+        tokens = 0
+        for cluster in clusters:
+            if len(lines) >= self.max_items:
+                break
+            primary = cluster.items[0].source
+            if per_source.get(primary, 0) >= self.per_source:
+                continue
+            sources = ", ".join(titles.get(source, source) for source in cluster.sources[:3])
+            if len(cluster.sources) > 3:
+                sources += f" +{len(cluster.sources) - 3}"
+            line = f"{len(lines) + 1}. {cluster.title[:160]} | {cluster.tier()} | {sources}"
+            cost = estimate_tokens(line)
+            if tokens + cost > self.token_budget:
+                continue
+            lines.append(line)
+            tokens += cost
+            per_source[primary] = per_source.get(primary, 0) + 1
+        self.stats["digest_tokens"] = tokens
+        self.stats["selected"] = len(lines)
+        return lines
+
+    def build(self, collected: Dict[str, List[dict]], titles: Dict[str, str], now: Optional[float] = None) -> str:
+        """Ранжированный дайджест или пустая строка, если записей нет"""
+        started = time.monotonic()
+        clusters = self.rank(collected, now or time.time())
+        lines = self.select(clusters, titles)
+        self.stats["last_build"] = round(time.monotonic() - started, 4)
+        if not lines:
+            return ""
+        return (
+            # Без общего числа историй: новая запись в хвосте не должна менять
+            # дайджест (и отпечаток снимка), если топ остался прежним
+            f"🔍 ТОП ТРЕНДОВ ({len(lines)} историй, "
+            f"{len([s for s, entries in collected.items() if entries])} источников):\n"
+            "Формат: история | динамика | где встречается\n\n" + "\n".join(lines)
+        )
+
+    async def digest(self, collected: Dict[str, List[dict]], titles: Dict[str, str]) -> str:
+        # SQLite и MinHash - вне event loop
+        return await asyncio.to_thread(self.build, collected, titles)
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
+    def close(self):
+        self.history.close()
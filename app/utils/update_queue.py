@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from aiogram.types import Update
+
+from app.utils.coordination import shared_key
+
+logger = logging.getLogger(__name__)
+
+_received_at: ContextVar[Optional[float]] = ContextVar("update_received_at", default=None)
+
+
+def received_at() -> Optional[float]:
+    """Когда (time.time) обрабатываемый апдейт пришел на вебхук"""
+    return _received_at.get()
+
+_CHAT_EVENTS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "callback_query",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+    "inline_query",
+    "chosen_inline_result",
+    "pre_checkout_query",
+    "shipping_query",
+)
+
+
+def chat_key(update: Update) -> Hashable:
+    """Ключ упорядочивания: чат (или пользователь), к которому относится апдейт"""
+    for name in _CHAT_EVENTS:
+        event = getattr(update, name, None)
+        if event is None:
+            continue
+        chat = getattr(event, "chat", None)
+        if chat is None:
+            chat = getattr(getattr(event, "message", None), "chat", None)
+        if chat is not None:
+            return chat.id
+        user = getattr(event, "from_user", None)
+        if user is not None:
+            return user.id
+    # Апдейт без чата упорядочивать не с чем
+    return ("update", update.update_id)
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь входящих апдейтов с пулом воркеров.
+
+    Вебхук сразу отвечает 200, а обработка идет в фоне. Апдейты одного
+    чата обрабатываются строго по порядку, разные чаты - параллельно.
+    Повторно доставленные апдейты отбрасываются по update_id. Когда
+    очередь переполнена, submit возвращает False и вебхук просит
+    Telegram повторить позже.
+
+    Очередь общая для нескольких ботов: source (имя бота-арендатора) входит
+    в ключи дедупликации и упорядочивания - у разных ботов свои update_id
+    и свои чаты, - а max_pending не дает одному источнику занять всю очередь.
+
+    С coordinator (несколько воркеров uvicorn) повторы отбрасываются и по
+    апдейтам, взятым другими процессами, а чат на время обработки арендуется,
+    чтобы его апдейты не шли параллельно в разных процессах.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Update, Hashable], Awaitable[None]],
+        workers: int = 16,
+        max_size: int = 1000,
+        dedup_window: int = 10000,
+        coordinator=None,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.dedup_window = dedup_window
+        self.coordinator = coordinator
+
+        self._chats: Dict[Hashable, deque] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._seen: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+        self.depth = 0
+        self._source_depth: Dict[Hashable, int] = {}
+
+        self.stats = {
+            "accepted": 0,
+            "processed": 0,
+            "failed": 0,
+            "duplicates": 0,
+            "rejected": 0,
+            "max_depth": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+            "handle_total": 0.0,
+            "handle_max": 0.0,
+        }
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Update queue started with {self.workers} workers")
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидаемся обработки очереди (не дольше timeout) и гасим воркеры"""
+        deadline = time.monotonic() + timeout
+        while self.depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _is_duplicate(self, key: Hashable) -> bool:
+        if key in self._seen:
+            return True
+        self._seen[key] = None
+        if len(self._seen) > self.dedup_window:
+            self._seen.popitem(last=False)
+        return False
+
+    def pending(self, source: Hashable = None) -> int:
+        """Апдейты источника в очереди и в обработке"""
+        return self._source_depth.get(source, 0)
+
+    def submit(self, update: Update, source: Hashable = None, max_pending: Optional[int] = None) -> bool:
+        """Постановка апдейта в очередь; False - очередь (или доля источника) переполнена"""
+        seen_key = (source, update.update_id)
+        if self._is_duplicate(seen_key):
+            self.stats["duplicates"] += 1
+            return True
+
+        if self.depth >= self.max_size or (max_pending is not None and self.pending(source) >= max_pending):
+            # Telegram доставит повторно - забываем id, чтобы не отбросить повтор
+            self._seen.pop(seen_key, None)
+            self.stats["rejected"] += 1
+            return False
+
+        key = (source, chat_key(update))
+        item = (update, source, time.monotonic(), time.time())
+        pending = self._chats.get(key)
+        if pending is None:
+            self._chats[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            # Чат уже обрабатывается - воркер заберет апдейт следом
+            pending.append(item)
+
+        self.depth += 1
+        self._source_depth[source] = self.pending(source) + 1
+        self.stats["accepted"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.depth)
+        return True
+
+    def _lease(self, key: Hashable):
+        if self.coordinator is None:
+            return nullcontext()
+        return self.coordinator.chat(shared_key("chat", *key))
+
+    async def _claim(self, update: Update, source: Hashable) -> bool:
+        if self.coordinator is None:
+            return True
+        try:
+            return await self.coordinator.claim_update(shared_key("update", source, update.update_id))
+        except Exception as e:
+            # Лучше обработать повтор, чем потерять апдейт
+            logger.error(f"Update claim failed: {e}")
+            return True
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            leased = False
+            try:
+                async with self._lease(key):
+                    leased = True
+                    await self._drain(key)
+            except Exception as e:
+                if leased:
+                    logger.error(f"Chat processing failed: {e}")
+                else:
+                    logger.error(f"Chat lease failed, processing without it: {e}")
+                    await self._drain(key)
+            # Пока отпускали аренду, submit мог дописать апдейт в очередь
+            # чата, не ставя ключ заново: такой чат возвращается в очередь
+            if self._chats[key]:
+                self._ready.put_nowait(key)
+            else:
+                del self._chats[key]
+
+    async def _drain(self, key: Hashable):
+        pending = self._chats[key]
+        while pending:
+            update, source, enqueued_at, arrived = pending.popleft()
+            started = time.monotonic()
+            waited = started - enqueued_at
+            self.stats["wait_total"] += waited
+            self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+
+            token = _received_at.set(arrived)
+            try:
+                if not await self._claim(update, source):
+                    # Telegram повторно доставил апдейт в другой воркер
+                    self.stats["duplicates"] += 1
+                    continue
+                await self.handler(update, source)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Update {update.update_id} failed: {e}")
+            finally:
+                _received_at.reset(token)
+                self.depth -= 1
+                left = self._source_depth.pop(source, 1) - 1
+                if left:
+                    self._source_depth[source] = left
+                elapsed = time.monotonic() - started
+                self.stats["handle_total"] += elapsed
+                self.stats["handle_max"] = max(self.stats["handle_max"], elapsed)
+
+    def get_stats(self) -> dict:
+        done = self.stats["processed"] + self.stats["failed"]
+        return {
+            **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.stats.items()},
+            "depth": self.depth,
+            "active_chats": len(self._chats),
+            "wait_avg": round(self.stats["wait_total"] / done, 3) if done else 0.0,
+            "handle_avg": round(self.stats["handle_total"] / done, 3) if done else 0.0,
+        }
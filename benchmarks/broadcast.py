@@ -0,0 +1,71 @@
+"""
+Замер рассылки: BroadcastEngine отправляет N сообщений через заглушку Bot API.
+
+Запускается отдельным процессом (его запускает benchmarks.run), чтобы
+пиковая память относилась только к рассылке. Печатает JSON с итогами.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def run(args) -> dict:
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from app.utils.broadcast import BroadcastEngine
+
+    bot = Bot(
+        token=os.environ["TELEGRAM_BOT_TOKEN"],
+        session=AiohttpSession(api=TelegramAPIServer.from_base(args.api_url)),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = BroadcastEngine(
+            os.path.join(tmp, "broadcast.db"),
+            rate_per_second=args.rate,
+            concurrency=args.concurrency,
+        )
+
+        async def send(user_id: int, text: str):
+            await bot.send_message(user_id, text)
+
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        report = await engine.run("bench", "Бенчмарк рассылки", range(1, args.subscribers + 1), send)
+        elapsed = time.perf_counter() - started
+
+        engine.close()
+    await bot.session.close()
+
+    return {
+        **report,
+        "subscribers": args.subscribers,
+        "wall_time": round(elapsed, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_before_mb": rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast benchmark")
+    parser.add_argument("--api-url", required=True)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=25)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Заглушки внешних сервисов для бенчмарков: Anthropic Messages API,
+Telegram Bot API, RSS-лента источника трендов и профили Reddit для
+анализа конкурентов на одном локальном порту.
+
+Запуск отдельно от бота, чтобы заглушки не делили с ним event loop:
+
+    python -m benchmarks.fakes --port 18080 --claude-latency 0.3 --claude-429-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+COPY_KEYS = ("fixed", "short", "long", "emotional", "twitter", "threads", "linkedin")
+
+LOREM = (
+    "Сцена в Blender с объемным светом и процедурными материалами собирает больше "
+    "сохранений, чем статичный рендер. Покажите таймлапс моделинга, разберите ноды "
+    "шейдера и добавьте вопрос к аудитории в конце поста. "
+)
+
+
+class FakeAnthropic:
+    """
+    Messages API: задержка, доля 429 с retry-after и потоковый ответ SSE.
+
+    slow_rate - доля запросов с хвостовой задержкой slow_latency (для
+    проверки hedging); модели с fast_marker в имени отвечают в
+    fast_speedup раз быстрее.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.3,
+        jitter: float = 0.1,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        chunk_delay: float = 0.01,
+        chunk_size: int = 40,
+        reply_chars: int = 1200,
+        slow_rate: float = 0.0,
+        slow_latency: float = 5.0,
+        fast_marker: str = "haiku",
+        fast_speedup: float = 2.0,
+        seed: int = 42,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.reply_chars = reply_chars
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.fast_marker = fast_marker
+        self.fast_speedup = fast_speedup
+        self.random = random.Random(seed)
+        self.stats = defaultdict(int)
+
+    def _reply_for(self, payload: dict) -> str:
+        system = payload.get("system") or ""
+        if isinstance(system, list):
+            system = " ".join(block.get("text", "") for block in system)
+
+        body = (LOREM * (self.reply_chars // len(LOREM) + 1))[:self.reply_chars]
+        if "JSON" in system:
+            size = max(80, self.reply_chars // len(COPY_KEYS))
+            return json.dumps({key: body[:size] for key in COPY_KEYS}, ensure_ascii=False)
+        return body
+
+    @staticmethod
+    def _sse(event: str, data: dict) -> bytes:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+    def _delay_for(self, model: str) -> float:
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        if self.random.random() < self.slow_rate:
+            self.stats["slow"] += 1
+            delay = self.slow_latency
+        if self.fast_marker and self.fast_marker in model:
+            delay /= self.fast_speedup
+        return delay
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        model = payload.get("model") or ""
+        self.stats["requests"] += 1
+        self.stats[f"model:{model}"] += 1
+        try:
+            return await self._respond(request, payload, self._delay_for(model))
+        except (asyncio.CancelledError, ConnectionResetError):
+            # Клиент закрыл соединение: проигравший страхующий запрос
+            self.stats["cancelled"] += 1
+            raise
+
+    async def _respond(self, request: web.Request, payload: dict, delay: float) -> web.StreamResponse:
+        await asyncio.sleep(delay)
+
+        if self.random.random() < self.throttle_rate:
+            self.stats["throttled"] += 1
+            return web.json_response(
+                {"type": "error", "error": {"type": "rate_limit_error", "message": "Rate limited"}},
+                status=429,
+                headers={"retry-after": str(self.retry_after)},
+            )
+
+        text = self._reply_for(payload)
+        usage = {"input_tokens": len(json.dumps(payload)) // 3, "output_tokens": len(text) // 3}
+
+        if not payload.get("stream"):
+            return web.json_response({
+                "id": f"msg_{self.stats['requests']}",
+                "type": "message",
+                "role": "assistant",
+                "model": payload.get("model"),
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": usage,
+            })
+
+        self.stats["streams"] += 1
+        response = web.StreamResponse(headers={"content-type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(self._sse("message_start", {
+            "type": "message_start",
+            "message": {"usage": {"input_tokens": usage["input_tokens"], "output_tokens": 1}},
+        }))
+        for i in range(0, len(text), self.chunk_size):
+            await asyncio.sleep(self.chunk_delay)
+            await response.write(self._sse("content_block_delta", {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": text[i:i + self.chunk_size]},
+            }))
+        await response.write(self._sse("message_delta", {
+            "type": "message_delta",
+            "usage": {"output_tokens": usage["output_tokens"]},
+        }))
+        await response.write(self._sse("message_stop", {"type": "message_stop"}))
+        await response.write_eof()
+        return response
+
+
+class FakeTelegram:
+    """
+    Bot API: отвечает на любые методы и запоминает время каждого вызова по чатам.
+
+    По этим отметкам генератор нагрузки считает сквозную задержку:
+    от POST вебхука до последнего ответа бота в чат.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        blocked_rate: float = 0.0,
+        flood_rate: float = 0.0,
+        seed: int = 42,
+    ):
+        self.latency = latency
+        self.blocked_rate = blocked_rate
+        self.flood_rate = flood_rate
+        self.random = random.Random(seed)
+        self.calls: Dict[str, List[list]] = defaultdict(list)
+        self.methods = defaultdict(int)
+        self._message_id = 0
+        self.webhook_url = ""
+
+    def _message(self, chat_id: Optional[str], text: str) -> dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            "text": text,
+        }
+
+    def _result(self, method: str, data) -> object:
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "setWebhook":
+            self.webhook_url = data.get("url", "")
+        elif method == "deleteWebhook":
+            self.webhook_url = ""
+        if (method.startswith("send") and method != "sendChatAction") or method.startswith("edit"):
+            return self._message(data.get("chat_id"), data.get("text", ""))
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        chat_id = data.get("chat_id")
+        received = time.time()
+
+        self.methods[method] += 1
+        await asyncio.sleep(self.latency)
+
+        if method == "sendMessage" and self.random.random() < self.flood_rate:
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            })
+        if method == "sendMessage" and self.random.random() < self.blocked_rate:
+            return web.json_response({
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user",
+            })
+
+        if chat_id is not None:
+            self.calls[str(chat_id)].append([method, received])
+        return web.json_response({"ok": True, "result": self._result(method, data)})
+
+
+def rss_feed(items: int = 10) -> bytes:
+    now = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
+    entries = "".join(
+        f"<item><title>Бенчмарк-тренд {i}: процедурные материалы</title>"
+        f"<link>https://example.com/{i}</link><pubDate>{now}</pubDate></item>"
+        for i in range(items)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+        f"<title>bench</title>{entries}</channel></rss>"
+    ).encode("utf-8")
+
+
+def reddit_listing(username: str, after: Optional[str], limit: int, total: int = 100) -> dict:
+    """Детерминированная лента постов профиля в формате Reddit, новые сверху"""
+    rng = random.Random(username)
+    # Сетка по часу: повторная проверка профиля видит тот же снимок
+    now = int(time.time()) // 3600 * 3600
+    media = [{"is_self": True}, {"is_self": False, "post_hint": "image"}, {"is_self": False, "is_video": True}]
+    posts = [
+        {
+            "id": f"{username}{i}",
+            "created_utc": now - (i + 1) * 3600 * rng.randint(4, 30),
+            "title": f"Рендер #{i}: процедурные материалы #blender #b3d",
+            "permalink": f"/user/{username}/comments/{username}{i}/",
+            "score": rng.randint(5, 2000),
+            "num_comments": rng.randint(0, 150),
+            **rng.choice(media),
+        }
+        for i in range(total)
+    ]
+    posts.sort(key=lambda post: post["created_utc"], reverse=True)
+
+    start = 0
+    if after:
+        ids = [post["id"] for post in posts]
+        start = ids.index(after[3:]) + 1 if after[3:] in ids else len(posts)
+    page = posts[start:start + limit]
+    has_more = start + limit < len(posts)
+    return {
+        "data": {
+            "children": [{"kind": "t3", "data": post} for post in page],
+            "after": f"t3_{page[-1]['id']}" if page and has_more else None,
+        }
+    }
+
+
+def build_app(claude: FakeAnthropic, telegram: FakeTelegram) -> web.Application:
+    feed = rss_feed()
+
+    async def reddit_handler(request: web.Request) -> web.Response:
+        limit = min(int(request.query.get("limit", 25)), 100)
+        return web.json_response(reddit_listing(request.match_info["name"], request.query.get("after"), limit))
+
+    async def feed_handler(request: web.Request) -> web.Response:
+        return web.Response(body=feed, content_type="application/rss+xml", headers={"ETag": '"bench"'})
+
+    async def calls_handler(request: web.Request) -> web.Response:
+        chat = request.query.get("chat")
+        if chat is not None:
+            return web.json_response({"calls": telegram.calls.get(chat, [])})
+        return web.json_response({"calls": telegram.calls, "methods": telegram.methods, "claude": claude.stats})
+
+    async def reset_handler(request: web.Request) -> web.Response:
+        telegram.calls.clear()
+        telegram.methods.clear()
+        claude.stats.clear()
+        return web.json_response({"ok": True})
+
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post("/v1/messages", claude.handle)
+    app.router.add_post("/bot{token}/{method}", telegram.handle)
+    app.router.add_get("/feeds/{name}", feed_handler)
+    app.router.add_get("/user/{name}/submitted.json", reddit_handler)
+    app.router.add_get("/_bench/calls", calls_handler)
+    app.router.add_post("/_bench/reset", reset_handler)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Anthropic / Telegram servers for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--claude-latency", type=float, default=0.3)
+    parser.add_argument("--claude-jitter", type=float, default=0.1)
+    parser.add_argument("--claude-429-rate", type=float, default=0.0)
+    parser.add_argument("--claude-chunk-delay", type=float, default=0.01)
+    parser.add_argument("--claude-slow-rate", type=float, default=0.0)
+    parser.add_argument("--claude-slow-latency", type=float, default=5.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--telegram-blocked-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-flood-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    claude = FakeAnthropic(
+        latency=args.claude_latency,
+        jitter=args.claude_jitter,
+        throttle_rate=args.claude_429_rate,
+        chunk_delay=args.claude_chunk_delay,
+        slow_rate=args.claude_slow_rate,
+        slow_latency=args.claude_slow_latency,
+        seed=args.seed,
+    )
+    telegram = FakeTelegram(
+        latency=args.telegram_latency,
+        blocked_rate=args.telegram_blocked_rate,
+        flood_rate=args.telegram_flood_rate,
+        seed=args.seed,
+    )
+    web.run_app(build_app(claude, telegram), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
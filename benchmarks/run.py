@@ -0,0 +1,455 @@
+"""
+Нагрузочный бенчмарк бота без сети.
+
+Поднимает заглушки Anthropic/Telegram (benchmarks.fakes) и бота под uvicorn
+отдельными процессами, шлет синтетические апдейты в вебхук с заданной
+частотой и считает сквозную задержку: от POST вебхука до последнего вызова
+Bot API в этот чат. Затем замеряет рассылку на N подписчиков.
+
+    python -m benchmarks.run --sessions 300 --rate 20 --output bench.json
+    python -m benchmarks.run --compare bench.json
+
+Параметры и seed фиксированы, поэтому результаты разных коммитов сравнимы.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "123456:bench"
+
+COPY_TEXT = (
+    "Закончил новую сцену в Blender: киберпанк-улица ночью, неон и дождь. "
+    "Рендер в Cycles занял шесть часов, зато отражения получились как надо."
+)
+
+# Сценарий - последовательность шагов (метка хендлера, текст сообщения)
+SCENARIOS: Dict[str, List[Tuple[str, str]]] = {
+    "start": [("start.cmd_start", "/start")],
+    "trends": [("trends.handle_trends", "🔥 Сканер трендов")],
+    "copywriter": [
+        ("copywriter.start_copywriter", "✍️ Копирайтер"),
+        ("copywriter.process_copywriting", COPY_TEXT + " #{n}"),
+    ],
+    "competitors": [
+        ("competitors.start_competitor_analysis", "🔎 Анализ конкурентов"),
+        ("competitors.process_competitor", "@artist{n}"),
+    ],
+    "notifications": [("notifications.toggle_notifications", "🔔 Уведомления")],
+}
+
+DEFAULT_MIX = "start=3,trends=2,copywriter=2,competitors=1,notifications=2"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+def process_memory(pid: int) -> dict:
+    """RSS и пик RSS процесса (только Linux)"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value = line.split(":", 1)
+                    memory["rss_mb" if name == "VmRSS" else "peak_rss_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+class LoadGenerator:
+    def __init__(self, session: aiohttp.ClientSession, webhook_url: str, fakes_url: str, think_time: float):
+        self.session = session
+        self.webhook_url = webhook_url
+        self.fakes_url = fakes_url
+        self.think_time = think_time
+        self.update_id = 0
+        # (chat_id, метка шага, время отправки)
+        self.sent: List[Tuple[int, str, float]] = []
+        self.rejected = 0
+
+    def _update(self, chat_id: int, text: str) -> dict:
+        self.update_id += 1
+        return {
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+                "text": text,
+            },
+        }
+
+    async def _answered_since(self, chat_id: int, since: float, timeout: float = 60.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            async with self.session.get(f"{self.fakes_url}/_bench/calls", params={"chat": str(chat_id)}) as response:
+                calls = (await response.json())["calls"]
+            if any(ts >= since for _, ts in calls):
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    async def run_session(self, chat_id: int, scenario: str, n: int):
+        steps = SCENARIOS[scenario]
+        for i, (label, text) in enumerate(steps):
+            sent_at = time.time()
+            async with self.session.post(self.webhook_url, json=self._update(chat_id, text.format(n=n))) as response:
+                if response.status != 200:
+                    self.rejected += 1
+                    return
+            self.sent.append((chat_id, label, sent_at))
+            if i < len(steps) - 1:
+                # Следующий шаг - только после ответа бота, как у живого пользователя
+                await self._answered_since(chat_id, sent_at)
+                await asyncio.sleep(self.think_time)
+
+
+async def wait_http(session: aiohttp.ClientSession, url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise SystemExit(f"{url} did not come up in {timeout}s")
+
+
+async def get_json(session: aiohttp.ClientSession, url: str) -> dict:
+    async with session.get(url) as response:
+        return await response.json()
+
+
+async def wait_drained(session: aiohttp.ClientSession, health_url: str, timeout: float) -> dict:
+    """Ждем, пока бот обработает все принятые апдейты"""
+    deadline = time.monotonic() + timeout
+    health = {}
+    while time.monotonic() < deadline:
+        health = await get_json(session, health_url)
+        queue = health["update_queue"]
+        if queue["processed"] + queue["failed"] >= queue["accepted"]:
+            return health
+        await asyncio.sleep(0.1)
+    return health
+
+
+def latencies_by_handler(sent: List[Tuple[int, str, float]], calls: Dict[str, list]) -> Tuple[dict, dict]:
+    """Задержка шага: последний вызов Bot API в чат до отправки следующего шага"""
+    by_chat: Dict[int, List[Tuple[str, float]]] = {}
+    for chat_id, label, sent_at in sent:
+        by_chat.setdefault(chat_id, []).append((label, sent_at))
+
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    for chat_id, steps in by_chat.items():
+        timestamps = sorted(ts for _, ts in calls.get(str(chat_id), []))
+        for i, (label, sent_at) in enumerate(steps):
+            until = steps[i + 1][1] if i + 1 < len(steps) else float("inf")
+            window = [ts for ts in timestamps if sent_at <= ts < until]
+            if window:
+                latencies.setdefault(label, []).append(window[-1] - sent_at)
+            else:
+                errors[label] = errors.get(label, 0) + 1
+    return latencies, errors
+
+
+async def run_load(args, app_url: str, fakes_url: str, app_pid: int) -> dict:
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    scenarios = rng.choices(list(mix), weights=list(mix.values()), k=args.sessions)
+
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await wait_http(session, f"{app_url}/health", timeout=60)
+
+        # Разогрев: лидер выставил вебхук и собрал первый снимок трендов
+        deadline = time.monotonic() + args.warmup_timeout
+        while time.monotonic() < deadline:
+            health = await get_json(session, f"{app_url}/health")
+            if health["trend_snapshot"]["age"] is not None:
+                break
+            await asyncio.sleep(0.2)
+        await session.post(f"{fakes_url}/_bench/reset")
+        memory_before = process_memory(app_pid)
+
+        generator = LoadGenerator(session, f"{app_url}/webhook", fakes_url, args.think_time)
+        started = time.perf_counter()
+        tasks = []
+        for n, scenario in enumerate(scenarios):
+            # Открытая модель нагрузки: сессии стартуют по расписанию, не дожидаясь друг друга
+            delay = started + n / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(generator.run_session(1_000_000 + n, scenario, n)))
+        await asyncio.gather(*tasks)
+        health = await wait_drained(session, f"{app_url}/health", args.drain_timeout)
+        elapsed = time.perf_counter() - started
+
+        fakes = await get_json(session, f"{fakes_url}/_bench/calls")
+        memory_after = process_memory(app_pid)
+
+    latencies, errors = latencies_by_handler(generator.sent, fakes["calls"])
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        "duration": round(elapsed, 2),
+        "updates": len(generator.sent),
+        "rejected": generator.rejected,
+        "throughput": round(len(generator.sent) / elapsed, 2) if elapsed else 0.0,
+        "latency": summarize(everything),
+        "handlers": {
+            label: {**summarize(values), "errors": errors.get(label, 0)}
+            for label, values in sorted(latencies.items())
+        },
+        "errors": errors,
+        "bot_api_calls": fakes["methods"],
+        "bot_api_calls_per_update": (
+            round(sum(fakes["methods"].values()) / len(generator.sent), 2) if generator.sent else 0.0
+        ),
+        "claude": fakes["claude"],
+        "update_queue": health.get("update_queue"),
+        "claude_admission": health.get("claude_admission"),
+        "claude_hedging": health.get("claude_hedging"),
+        "memory": {"before": memory_before, "after": memory_after},
+    }
+
+
+def run_broadcast(args, env: dict, fakes_url: str) -> dict:
+    output = subprocess.check_output(
+        [
+            sys.executable, "-m", "benchmarks.broadcast",
+            "--api-url", fakes_url,
+            "--subscribers", str(args.subscribers),
+            "--rate", str(args.broadcast_rate),
+            "--concurrency", str(args.broadcast_concurrency),
+        ],
+        cwd=ROOT,
+        env=env,
+        text=True,
+    )
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(current: dict, baseline: dict):
+    rows = [("throughput", current["load"]["throughput"], baseline["load"]["throughput"])]
+    if "bot_api_calls_per_update" in baseline["load"]:
+        rows.append((
+            "bot api calls/update",
+            current["load"]["bot_api_calls_per_update"],
+            baseline["load"]["bot_api_calls_per_update"],
+        ))
+    for q in ("p50", "p95", "p99"):
+        rows.append((f"latency {q}", current["load"]["latency"][q], baseline["load"]["latency"][q]))
+    for label, stats in current["load"]["handlers"].items():
+        old = baseline["load"]["handlers"].get(label)
+        if old:
+            rows.append((f"{label} p95", stats["p95"], old["p95"]))
+    if current.get("broadcast") and baseline.get("broadcast"):
+        rows.append(("broadcast wall_time", current["broadcast"]["wall_time"], baseline["broadcast"]["wall_time"]))
+        rows.append(("broadcast peak_rss_mb", current["broadcast"]["peak_rss_mb"], baseline["broadcast"]["peak_rss_mb"]))
+    peak = current["load"]["memory"]["after"].get("peak_rss_mb")
+    old_peak = baseline["load"]["memory"]["after"].get("peak_rss_mb")
+    if peak and old_peak:
+        rows.append(("app peak_rss_mb", peak, old_peak))
+
+    print(f"\n{'metric':<48}{'current':>12}{'baseline':>12}{'delta':>10}")
+    for name, value, old in rows:
+        delta = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{name:<48}{value:>12}{old:>12}{delta:>10}")
+
+
+def print_summary(result: dict):
+    load = result["load"]
+    print(f"\nUpdates: {load['updates']} in {load['duration']}s ({load['throughput']} upd/s), rejected {load['rejected']}")
+    print(f"{'handler':<44}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>8}")
+    for label, stats in load["handlers"].items():
+        print(f"{label:<44}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}{stats['errors']:>8}")
+    print(f"Bot API calls per update: {load['bot_api_calls_per_update']} {dict(load['bot_api_calls'])}")
+    print(f"App memory: {load['memory']['after']}")
+    for key, stats in (load.get("claude_hedging") or {}).items():
+        threshold = f"{stats['threshold']}s" if stats["threshold"] is not None else "n/a"
+        print(f"Hedging {key}: threshold {threshold}, rate {stats['hedge_rate']}, {stats['outcomes']}")
+    if result.get("broadcast"):
+        b = result["broadcast"]
+        print(f"Broadcast: {b['sent']}/{b['subscribers']} in {b['wall_time']}s ({b['rate']} msg/s), peak RSS {b['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the bot")
+    parser.add_argument("--sessions", type=int, default=200, help="user sessions to simulate")
+    parser.add_argument("--rate", type=float, default=20, help="new sessions per second")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights, e.g. start=3,trends=1")
+    parser.add_argument("--think-time", type=float, default=0.2, help="pause between steps of a session")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--warmup-timeout", type=float, default=20)
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--claude-latency", type=float, default=0.3)
+    parser.add_argument("--claude-429-rate", type=float, default=0.0)
+    parser.add_argument("--claude-slow-rate", type=float, default=0.0, help="share of requests with tail latency")
+    parser.add_argument("--claude-slow-latency", type=float, default=5.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--subscribers", type=int, default=1000, help="broadcast size, 0 to skip")
+    parser.add_argument("--broadcast-rate", type=float, default=25)
+    parser.add_argument("--broadcast-concurrency", type=int, default=10)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra bot settings")
+    parser.add_argument("--bot-log", help="write bot process output to this file")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    args = parser.parse_args()
+
+    fakes_port, app_port = free_port(), free_port()
+    fakes_url = f"http://127.0.0.1:{fakes_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "PYTHONPATH": ROOT,
+            "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+            "TELEGRAM_API_URL": fakes_url,
+            "CLAUDE_API_KEY": "bench",
+            "CLAUDE_API_URL": f"{fakes_url}/v1/messages",
+            "WEBHOOK_URL": app_url,
+            "WEBHOOK_PATH": "/webhook",
+            # Лимиты Claude делятся между воркерами по WEB_CONCURRENCY
+            "WEB_CONCURRENCY": str(args.workers),
+            "COORDINATION_DB_PATH": os.path.join(tmp, "workers.db"),
+            "FSM_DB_PATH": os.path.join(tmp, "fsm.db"),
+            "CACHE_DB_PATH": os.path.join(tmp, "cache.db"),
+            "SUBSCRIBERS_DB_PATH": os.path.join(tmp, "subscribers.db"),
+            "COMPETITOR_DB_PATH": os.path.join(tmp, "competitors.db"),
+            "TRENDS_DB_PATH": os.path.join(tmp, "trends.db"),
+            "COMPETITOR_REDDIT_URL": fakes_url,
+            "LEADER_LOCK_PATH": os.path.join(tmp, "scheduler.lock"),
+            "TREND_SOURCES": f"bench|{fakes_url}/feeds/bench.xml|Бенчмарк",
+            "TRENDS_WARMUP_DELAY": "0",
+            # Лимиты Anthropic снимаем: меряем бота, а не квоту аккаунта
+            "CLAUDE_RPM": "100000",
+            "CLAUDE_INPUT_TPM": "100000000",
+        }
+        for item in args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+
+        fakes = subprocess.Popen(
+            [
+                sys.executable, "-m", "benchmarks.fakes",
+                "--port", str(fakes_port),
+                "--seed", str(args.seed),
+                "--claude-latency", str(args.claude_latency),
+                "--claude-429-rate", str(args.claude_429_rate),
+                "--claude-slow-rate", str(args.claude_slow_rate),
+                "--claude-slow-latency", str(args.claude_slow_latency),
+                "--telegram-latency", str(args.telegram_latency),
+            ],
+            cwd=ROOT,
+        )
+        bot_log = open(args.bot_log, "w") if args.bot_log else subprocess.DEVNULL
+        bot = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "app.main:app",
+                "--host", "127.0.0.1", "--port", str(app_port),
+                "--workers", str(args.workers), "--log-level", "warning",
+            ],
+            cwd=tmp,
+            env=env,
+            stdout=bot_log,
+            stderr=subprocess.STDOUT,
+        )
+        try:
+            load = asyncio.run(run_load(args, app_url, fakes_url, bot.pid))
+        finally:
+            bot.terminate()
+            bot.wait(timeout=30)
+            if args.bot_log:
+                bot_log.close()
+
+        try:
+            broadcast = run_broadcast(args, env, fakes_url) if args.subscribers else None
+        finally:
+            fakes.terminate()
+            fakes.wait(timeout=10)
+
+    result = {
+        "meta": {
+            "commit": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": int(time.time()),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "bot_log")},
+        },
+        "load": load,
+        "broadcast": broadcast,
+    }
+
+    print_summary(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()